@@ -0,0 +1,123 @@
+"""Compare per-row writes against batched, diff-based writes for playlist and tag edits
+
+Run with: python benchmarks/bench_bulk_writes.py
+"""
+import json
+import tempfile
+import time
+
+from bench_random_songs import make_db
+
+import littlesongplace as lsp
+from littlesongplace import playlists, songs
+
+SONGS = 100_000
+PLAYLIST_SIZE = 500
+TAG_COUNT = 30
+REPEAT = 20
+SONGID = 1
+
+def edit_playlist_per_row(playlistid, songids):
+    # Previous edit_playlist_post: check each song, then delete and re-add
+    # every row
+    for songid in songids:
+        if not lsp.db.query("select * from songs where songid = ?", args=[songid]):
+            raise ValueError(songid)
+    lsp.db.query("delete from playlist_songs where playlistid = ?", args=[playlistid])
+    for position, songid in enumerate(songids):
+        lsp.db.query(
+                """
+                insert into playlist_songs (playlistid, position, songid)
+                values (?, ?, ?)
+                """,
+                args=[playlistid, position, songid])
+    lsp.db.commit()
+
+def edit_playlist_bulk(playlistid, songids):
+    found = lsp.db.query(
+            """
+            select count(*) as count from songs
+            where songid in (select value from json_each(?))
+            """,
+            [json.dumps(songids)],
+            one=True)
+    if found["count"] != len(set(songids)):
+        raise ValueError(songids)
+    playlists._set_playlist_songs(playlistid, songids)
+    lsp.db.commit()
+
+def tag_song_per_row(songid, tags):
+    # Previous update_song
+    lsp.db.query("delete from song_tags where songid = ?", [songid])
+    for tag in tags:
+        lsp.db.query("INSERT INTO song_tags (tag, songid) VALUES (?, ?)", [tag, songid])
+    lsp.db.commit()
+
+def tag_song_bulk(songid, tags):
+    songs._set_song_rows(songid, "song_tags", "tag", tags)
+    lsp.db.commit()
+
+def bench(name, func, key, before, after):
+    # Alternate between two versions, so every save changes something
+    # (unless they're the same)
+    func(key, before)
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        func(key, after if i % 2 == 0 else before)
+    duration = (time.perf_counter() - start) / REPEAT
+    print(f"{name:>10}: {duration * 1000:9.2f} ms/save")
+    return duration
+
+def compare(name, per_row, bulk, key, before, after):
+    print(name)
+    per_row_time = bench("per-row", per_row, key, before, after)
+    bulk_time = bench("bulk", bulk, key, before, after)
+    print(f"Speedup: {per_row_time / bulk_time:0.1f}x")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lsp.datadir.set_data_dir(tmpdir)
+        make_db(lsp.datadir.get_db_path(), SONGS)
+
+        with lsp.app.app_context():
+            playlistid = lsp.db.query(
+                    """
+                    INSERT INTO playlists (created, updated, userid, name, private)
+                    VALUES ('', '', 1, 'playlist', 0)
+                    RETURNING playlistid
+                    """,
+                    one=True)["playlistid"]
+            lsp.db.commit()
+
+            # Songids with gaps (see make_db)
+            songids = [
+                row["songid"] for row in lsp.db.query(
+                    "SELECT songid FROM songs ORDER BY songid LIMIT ?", [PLAYLIST_SIZE + 1])]
+            playlist, extra = songids[:-1], songids[-1]
+            middle = PLAYLIST_SIZE // 2
+            playlist_edits = {
+                "unchanged": playlist,
+                "append": playlist + [extra],
+                "remove": playlist[:middle] + playlist[middle + 1:],
+                "move": playlist[-1:] + playlist[:-1],
+            }
+            for edit, after in playlist_edits.items():
+                compare(
+                        f"{PLAYLIST_SIZE}-song playlist, {edit}",
+                        edit_playlist_per_row, edit_playlist_bulk,
+                        playlistid, playlist, after)
+
+            tags = [f"tag{i}" for i in range(TAG_COUNT)]
+            tag_edits = {
+                "unchanged": tags,
+                "change one": tags[:-1] + ["newtag"],
+                "add all": [],
+            }
+            for edit, before in tag_edits.items():
+                compare(
+                        f"{TAG_COUNT} tags, {edit}",
+                        tag_song_per_row, tag_song_bulk,
+                        SONGID, before, tags)
+
+if __name__ == "__main__":
+    main()
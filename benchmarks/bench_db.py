@@ -0,0 +1,95 @@
+"""Compare opening a database connection per request with keeping one per thread
+
+Run with: python benchmarks/bench_db.py
+"""
+import sqlite3
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from bench_random_songs import make_db
+
+import littlesongplace as lsp
+
+REQUESTS = 5_000
+THREADS = 16
+SONGS = 10_000
+QUERY = "SELECT status FROM songs WHERE songid = ?"
+WRITE = "UPDATE songs SET title = 'title' WHERE songid = ?"
+
+def request_per_connection(songid):
+    # Previous db.get and teardown: connect, set up, check the schema
+    # version, then close when the request ends
+    with lsp.app.app_context():
+        db = sqlite3.connect(lsp.datadir.get_db_path())
+        db.cursor().execute("PRAGMA foreign_keys = ON")
+        db.row_factory = sqlite3.Row
+        user_version = db.execute("pragma user_version").fetchone()[0]
+        schema_update_script = Path(lsp.app.root_path) / 'sql' / 'schema_update.sql'
+        if user_version < lsp.db.DB_VERSION and schema_update_script.exists():
+            raise RuntimeError("Database is out of date")
+        db.execute(QUERY, [songid]).fetchall()
+        db.close()
+
+def write_per_connection(songid):
+    with lsp.app.app_context():
+        db = sqlite3.connect(lsp.datadir.get_db_path())
+        db.execute(WRITE, [songid])
+        db.commit()
+        db.close()
+
+def request_persistent(songid):
+    with lsp.app.app_context():
+        lsp.db.query(QUERY, [songid])
+
+def write_persistent(songid):
+    with lsp.app.app_context():
+        lsp.db.query(WRITE, [songid])
+        lsp.db.commit()
+
+def bench(name, func, write):
+    # Single thread: per-request overhead
+    start = time.perf_counter()
+    for i in range(REQUESTS):
+        func(i % SONGS + 1)
+    duration = (time.perf_counter() - start) / REQUESTS
+    print(f"{name:>12}: {duration * 1e6:8.1f} us/request (1 thread)")
+
+    # Many threads, with one committing writes the whole time
+    done = threading.Event()
+    writes = [0]
+    def writer():
+        while not done.is_set():
+            write(writes[0] % SONGS + 1)
+            writes[0] += 1
+
+    def reader():
+        for i in range(REQUESTS // THREADS):
+            func(i % SONGS + 1)
+
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    threads = [threading.Thread(target=reader) for _ in range(THREADS)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    done.set()
+    writer_thread.join()
+    print(f"{name:>12}: {duration / REQUESTS * 1e6:8.1f} us/request ({THREADS} threads, {writes[0]} writes)")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        lsp.datadir.set_data_dir(tmpdir)
+        make_db(lsp.datadir.get_db_path(), SONGS)
+
+        # Run with the previous connections first, since the new ones switch
+        # the database to WAL (the default is a rollback journal)
+        bench("per-request", request_per_connection, write_per_connection)
+        bench("persistent", request_persistent, write_persistent)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Compare sampling random songs with ORDER BY random() against probing song IDs
+
+Run with: python benchmarks/bench_random_songs.py
+"""
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+import littlesongplace as lsp
+from littlesongplace import songs
+
+SIZES = [10_000, 100_000, 1_000_000]
+SAMPLE = 50
+REPEAT = 20
+
+def get_random_sorted(count):
+    # Previous get_random implementation: shuffles the whole songs table
+    sampled = songs._from_db(
+        songs._SELECT_SONGS + """
+        WHERE songs.songid IN (
+            SELECT songid FROM songs
+            WHERE status = 'ready'
+            ORDER BY random()
+            LIMIT ?
+        )
+        """,
+        [count])
+
+    random.shuffle(sampled)
+    return sampled
+
+def make_db(path, count):
+    # count songs by 1000 users, with a couple of tags each; a few songs are
+    # deleted (leaving gaps in the IDs) or still processing
+    db = sqlite3.connect(path)
+    schema = Path(lsp.app.root_path) / "sql" / "schema.sql"
+    db.executescript(schema.read_text())
+    db.execute(
+            """
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 1000)
+            INSERT INTO users (created, username, password)
+            SELECT '2025-01-01T00:00:00+00:00', 'user' || i, x'00' FROM n
+            """)
+    db.execute(
+            """
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO songs (created, userid, title, status)
+            SELECT
+                '2025-01-01T00:00:00+00:00', i % 1000 + 1, 'song ' || i,
+                CASE WHEN i % 97 = 0 THEN 'processing' ELSE 'ready' END
+            FROM n
+            """,
+            [count])
+    db.execute("INSERT INTO song_tags (songid, tag) SELECT songid, 'tag' || (songid % 50) FROM songs")
+    db.execute("INSERT INTO song_tags (songid, tag) SELECT songid, 'genre' || (songid % 7) FROM songs")
+    db.execute("INSERT INTO song_collaborators SELECT songid, 'collab' FROM songs WHERE songid % 10 = 0")
+    for table in ["song_tags", "song_collaborators", "songs"]:
+        db.execute(f"DELETE FROM {table} WHERE songid % 20 = 3")
+    db.commit()
+    db.close()
+
+def bench(name, func):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        sampled = func(SAMPLE)
+        assert len(sampled) == SAMPLE
+    duration = (time.perf_counter() - start) / REPEAT
+    print(f"{name:>10}: {duration * 1000:9.2f} ms")
+    return duration
+
+def main():
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lsp.datadir.set_data_dir(tmpdir)
+            make_db(lsp.datadir.get_db_path(), size)
+            print(f"{size} songs")
+            with lsp.app.app_context():
+                sorted_time = bench("sorted", get_random_sorted)
+                probed_time = bench("probed", songs.get_random)
+            print(f"Speedup: {sorted_time / probed_time:0.1f}x")
+
+if __name__ == "__main__":
+    main()
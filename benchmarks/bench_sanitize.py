@@ -0,0 +1,60 @@
+"""Compare the cached sanitizer with building a new bleach sanitizer per call
+
+Run with: python benchmarks/bench_sanitize.py
+"""
+import random
+import time
+
+import bleach
+from bleach.css_sanitizer import CSSSanitizer
+
+from littlesongplace import sanitize
+
+def sanitize_uncached(text):
+    # Previous sanitize_user_text implementation: rebuilds the sanitizer on
+    # every call
+    css_sanitizer = CSSSanitizer(allowed_css_properties=sanitize.ALLOWED_CSS_PROPERTIES)
+    return bleach.clean(
+            text,
+            tags=sanitize.ALLOWED_TAGS,
+            attributes=sanitize.ALLOWED_ATTRIBUTES,
+            css_sanitizer=css_sanitizer)
+
+def make_corpus(count, unique):
+    # Comment threads are rendered over and over, so the same text shows up
+    # many times; mix short plain comments with longer HTML descriptions
+    rng = random.Random(1234)
+    words = "love this song so good the bass synth drums vocals wow nice mix".split()
+    texts = []
+    for i in range(unique):
+        body = " ".join(rng.choices(words, k=rng.randint(3, 60)))
+        if i % 4 == 0:
+            body = (
+                f'<p style="color: #b36fab; position: fixed">{body}</p>'
+                f'<a href="https://example.com/{i}" onclick="x()">link</a>'
+                '<script>alert(1)</script><img src="a.png" width="32">')
+        elif i % 4 == 1:
+            body += "\n<b>so</b> <i>good</i> 🎶"
+        texts.append(body)
+    return [rng.choice(texts) for _ in range(count)]
+
+def bench(name, func, corpus):
+    start = time.perf_counter()
+    for text in corpus:
+        func(text)
+    duration = time.perf_counter() - start
+    print(f"{name:>10}: {duration:8.4f} s ({duration / len(corpus) * 1e6:8.1f} us/call)")
+    return duration
+
+def main():
+    corpus = make_corpus(count=20_000, unique=2_000)
+    print(f"{len(corpus)} comments, {len(set(corpus))} unique")
+
+    uncached = bench("uncached", sanitize_uncached, corpus)
+    sanitize.cache_clear()
+    cached = bench("cached", sanitize.sanitize_user_text, corpus)
+    print(f"{sanitize.cache_info()}")
+    print(f"Speedup: {uncached / cached:0.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Compare song list queries on the original songs_view view against the song_listing table
+
+Run with: python benchmarks/bench_song_listing.py
+"""
+import tempfile
+import time
+
+from bench_random_songs import make_db
+
+import littlesongplace as lsp
+from littlesongplace import songs
+
+SIZES = [100_000, 1_000_000]
+REPEAT = 20
+# Songs per page for paged lists; more than any list here, so whole lists are
+# loaded as before
+FULL_PAGE = max(SIZES)
+
+# Previous song lists (sql/migrations/06.sql): songs joined with users and
+# events, and with tags and collaborators aggregated over the whole tables
+SONGS_VIEW = """
+CREATE VIEW songs_view AS
+    WITH
+        tags_agg AS (
+            SELECT songid, GROUP_CONCAT(tag) as tags
+            FROM song_tags
+            GROUP BY songid
+        ),
+        collaborators_agg AS (
+            SELECT songid, GROUP_CONCAT(name) as collaborators
+            FROM song_collaborators
+            GROUP BY songid
+        )
+    SELECT
+        songs.*,
+        users.username,
+        users.fgcolor,
+        users.bgcolor,
+        users.accolor,
+        jam_events.title AS event_title,
+        jam_events.jamid AS jamid,
+        jam_events.enddate AS event_enddate,
+        tags_agg.tags,
+        collaborators_agg.collaborators
+    FROM songs
+    INNER JOIN users ON songs.userid = users.userid
+    LEFT JOIN tags_agg ON tags_agg.songid = songs.songid
+    LEFT JOIN collaborators_agg ON collaborators_agg.songid = songs.songid
+    LEFT JOIN jam_events ON jam_events.eventid = songs.eventid;
+"""
+
+VIEW_QUERIES = {
+    "latest": lambda: songs._from_db(
+        "SELECT * FROM songs_view WHERE status = 'ready' ORDER BY created DESC LIMIT 100"),
+    "by_id": lambda: songs._from_db("SELECT * FROM songs_view WHERE songid = 12345"),
+    "username": lambda: songs._from_db(
+        "SELECT * FROM songs_view WHERE username = 'user7' ORDER BY created DESC"),
+    "tag": lambda: songs._from_db(
+        """
+        SELECT * FROM song_tags
+        INNER JOIN songs_view on song_tags.songid = songs_view.songid
+        WHERE (username = 'user7' and tag = 'genre3')
+        ORDER BY created DESC
+        """),
+}
+
+LISTING_QUERIES = {
+    "latest": lambda: songs.get_latest(100),
+    "by_id": lambda: [songs.by_id(12345)],
+    "username": lambda: songs.get_page_for_username("user7", count=FULL_PAGE).songs,
+    "tag": lambda: songs.get_page_for_username_and_tag(
+        "user7", "genre3", count=FULL_PAGE).songs,
+}
+
+def bench(name, func):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func()
+    duration = (time.perf_counter() - start) / REPEAT
+    print(f"{name:>10}: {duration * 1000:9.2f} ms ({len(result)} songs)")
+    return duration
+
+def main():
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            lsp.datadir.set_data_dir(tmpdir)
+            make_db(lsp.datadir.get_db_path(), size)
+            print(f"{size} songs")
+            with lsp.app.app_context():
+                lsp.db.get().executescript(SONGS_VIEW)
+                for name in VIEW_QUERIES:
+                    print(name)
+                    view_time = bench("view", VIEW_QUERIES[name])
+                    listing_time = bench("listing", LISTING_QUERIES[name])
+                    print(f"   Speedup: {view_time / listing_time:0.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Compare re-encoding compliant mp3 uploads with ffmpeg against copying their frames
+
+Run with: python benchmarks/bench_transcode.py (requires ffmpeg)
+"""
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+from littlesongplace import mp3info
+
+TEST_DATA = Path(__file__).parent.parent / "test" / "data"
+REPEAT = 5
+
+def child_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def reencode(source, dest):
+    # Previous behavior: every upload goes through ffmpeg
+    subprocess.run([
+            "ffmpeg",
+            "-i", source,
+            "-codec:a", "libmp3lame",
+            "-qscale:a", "2",
+            "-ar", "44100",
+            "-y",
+            dest
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+def copy(source, dest):
+    # Check every frame, and have ffmpeg copy the frames into a new file
+    # without tags (same arguments as transcode.copy_mp3)
+    assert mp3info.is_compliant(source)
+    subprocess.run([
+            "ffmpeg",
+            "-i", source,
+            "-map", "0:a:0",
+            "-codec:a", "copy",
+            "-map_metadata", "-1",
+            "-id3v2_version", "0",
+            "-f", "mp3",
+            "-y",
+            dest
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+def bench(name, func, source, dest):
+    # CPU time used by this process and any child processes (ffmpeg)
+    start_cpu = time.process_time() + child_cpu_time()
+    start_wall = time.perf_counter()
+    for _ in range(REPEAT):
+        func(source, dest)
+    cpu = (time.process_time() + child_cpu_time() - start_cpu) / REPEAT
+    wall = (time.perf_counter() - start_wall) / REPEAT
+    print(f"{name:>10}: {cpu * 1000:9.2f} ms CPU {wall * 1000:9.2f} ms wall")
+    return cpu
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dest = os.path.join(tmpdir, "out.mp3")
+        total_reencode = total_copy = 0
+        for source in sorted(TEST_DATA.glob("*.mp3")):
+            print(f"{source.name}: {mp3info.probe(source)}")
+            total_reencode += bench("re-encode", reencode, source, dest)
+            total_copy += bench("copy", copy, source, dest)
+
+        print(f"CPU time saved on sample files: {(total_reencode - total_copy) * 1000:0.1f} ms")
+        print(f"Speedup: {total_reencode / total_copy:0.0f}x")
+
+if __name__ == "__main__":
+    main()
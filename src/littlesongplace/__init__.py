@@ -1,19 +1,18 @@
-import base64
 import logging
 import os
 import random
 import time
 from datetime import datetime, timezone
 from logging.handlers import RotatingFileHandler
-from pathlib import Path
 
 import click
 from flask import Flask, render_template, request, redirect, g, session, abort, \
         send_from_directory, flash, get_flashed_messages
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from . import activity, auth, colors, comments, datadir, db, jams, playlists, \
-        profiles, songs, users
+from . import activity, audioinfo, auth, colors, comments, datadir, db, \
+        ffmpeg, images, jams, playlists, profiles, sanitize, sendfile, songs, \
+        transcode, uploads, users, youtube
 from .logutils import flash_and_log
 
 # Logging
@@ -28,16 +27,26 @@ root_logger.addHandler(handler)
 # Flask app
 
 app = Flask(__name__)
+app.request_class = songs.SongUploadRequest
 app.secret_key = os.environ["SECRET_KEY"] if "SECRET_KEY" in os.environ else "dev"
 app.config["MAX_CONTENT_LENGTH"] = 1 * 1024 * 1024 * 1024
 app.register_blueprint(activity.bp)
 app.register_blueprint(auth.bp)
 app.register_blueprint(comments.bp)
+app.register_blueprint(images.bp)
 app.register_blueprint(jams.bp)
 app.register_blueprint(playlists.bp)
 app.register_blueprint(profiles.bp)
 app.register_blueprint(songs.bp)
+app.register_blueprint(uploads.bp)
 db.init_app(app)
+ffmpeg.init_app(app)
+sendfile.init_app(app)
+transcode.init_app(app)
+uploads.init_app(app)
+youtube.init_app(app)
+app.cli.add_command(sanitize.sanitize_db_cmd)
+app.cli.add_command(audioinfo.analyze_songs_cmd)
 
 if "DATA_DIR" in os.environ:
     # Running on server behind proxy
@@ -46,6 +55,29 @@ if "DATA_DIR" in os.environ:
     )
     app.logger.setLevel(logging.INFO)
 
+    # Let the proxy send song files and images (see sendfile.py)
+    app.config["SENDFILE_MODE"] = os.environ.get("SENDFILE_MODE") or None
+    if "SENDFILE_ACCEL_PREFIX" in os.environ:
+        app.config["SENDFILE_ACCEL_PREFIX"] = os.environ["SENDFILE_ACCEL_PREFIX"]
+
+    # Commit activity times in batches (see db.write_behind)
+    if "DB_WRITE_BEHIND_INTERVAL" in os.environ:
+        app.config["DB_WRITE_BEHIND_INTERVAL"] = float(os.environ["DB_WRITE_BEHIND_INTERVAL"])
+
+    # ffmpeg processes at once, shared by all app processes (see ffmpeg.py)
+    if "TRANSCODE_SLOTS" in os.environ:
+        app.config["TRANSCODE_SLOTS"] = int(os.environ["TRANSCODE_SLOTS"])
+
+def update_db():
+    # Update the database before handling any requests, and store sanitized
+    # HTML for rows written before it was stored (see sanitize.py)
+    if db.migrate(app):
+        with app.app_context():
+            for table, count in sanitize.backfill().items():
+                app.logger.info(f"Sanitized {count} rows in {table}")
+
+update_db()
+
 @app.route("/")
 def index():
     start = time.perf_counter()
@@ -112,28 +144,6 @@ def site_news():
 def about():
     return render_template("about.html")
 
-def get_gif_data():
-    # Convert all .gifs to base64 strings and embed them as dataset entries
-    # in <div>s.  This is used by nav.js:customImage() - it replaces specific
-    # bytes in the .gif data to swap the color palette, avoiding the need to
-    # do a pixel-by-pixel filter in the javascript.  Is it actually any faster?
-    # I have no idea.
-    gifs = []
-    static_path = Path(__file__).parent / "static"
-    for child in static_path.iterdir():
-        if child.suffix == ".gif":
-            with open(child, "rb") as gif:
-                b64 = base64.b64encode(gif.read()).decode()
-                gifs.append(
-                        '<div '
-                        'class="img-data" '
-                        f'id="{child.stem}" '
-                        f'data-img-b64="{b64}"'
-                        '></div>')
-
-    gifs = "\n".join(gifs)
-    return gifs
-
 def get_current_user_playlists():
     plist_data = []
     if "userid" in session:
@@ -143,12 +153,43 @@ def get_current_user_playlists():
 
     return plist_data
 
+def is_fragment_request():
+    # nav.js sets this header when it will only swap in the page body
+    return request.headers.get("X-LSP-Fragment") == "1"
+
+@app.after_request
+def add_vary_header(response):
+    # Full pages and fragments share URLs, so keep them apart in caches
+    if response.mimetype == "text/html":
+        response.vary.add("X-LSP-Fragment")
+    return response
+
+# Database and ffmpeg totals for each app process are logged every
+# STATS_INTERVAL (see db.get_stats and ffmpeg.get_stats)
+STATS_INTERVAL = 10 * 60  # seconds
+_last_stats = time.monotonic()
+
+@app.before_request
+def log_stats():
+    global _last_stats
+    now = time.monotonic()
+    if now - _last_stats < STATS_INTERVAL:
+        return
+    _last_stats = now
+    for name, stats in [("Database", db.get_stats()), ("ffmpeg", ffmpeg.get_stats())]:
+        totals = ", ".join(
+                f"{key}={value:0.3f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in stats.items())
+        app.logger.info(f"{name} stats for process {os.getpid()}: {totals}")
+
 @app.context_processor
 def inject_global_vars():
     return dict(
-        gif_data=get_gif_data(),
+        fragment=is_fragment_request(),
         # Add to Playlist dropdown entries
         current_user_playlists=get_current_user_playlists(),
+        # Recolored .gif versions (see images.py)
+        gif_versions=images.gif_versions,
         **colors.DEFAULT_COLORS,
     )
 
@@ -80,10 +80,9 @@ def activity():
             comment["content_username"] = jam_event["username"]
 
     timestamp = datetime.now(timezone.utc).isoformat()
-    db.query(
+    db.write_behind(
             "update users set activitytime = ? where userid = ?",
             [timestamp, session["userid"]])
-    db.commit()
 
     return render_template("activity.html", comments=notifications)
 
@@ -0,0 +1,156 @@
+import concurrent.futures
+import os
+import re
+import subprocess
+import tempfile
+from collections import namedtuple
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import blobs, datadir, db, ffmpeg, mp3info, peaks
+
+# Stored in the songs table when a song's audio is transcoded:
+#   duration: seconds
+#   bitrate: average kbps
+#   sample_rate: Hz
+#   size: bytes
+#   loudness: integrated loudness (EBU R128), LUFS
+AudioInfo = namedtuple(
+        "AudioInfo", ["duration", "bitrate", "sample_rate", "size", "loudness"])
+
+# Audio is decoded to mono at a low sample rate; plenty for waveform peaks,
+# and the duration is still accurate to a fraction of a millisecond
+DECODE_SAMPLE_RATE = 8000
+
+# Bytes of samples to read from ffmpeg at a time
+_READ_SIZE = 64 * 1024
+
+_LOUDNESS_RE = re.compile(rb"^\s*I:\s+(-?[0-9.]+) LUFS", re.MULTILINE)
+
+def decode(mp3_path, command=("ffmpeg",)):
+    # Decode an audio file to 16-bit mono samples with an ffmpeg command (see
+    # ffmpeg.get_command), measuring its loudness on the way; returns
+    # (peaks.PeakAccumulator, loudness), or None on failure.  The samples are
+    # read a chunk at a time, so memory doesn't grow with the song's length.
+    accumulator = peaks.PeakAccumulator()
+
+    # stderr goes to a file, so ffmpeg can't get stuck on a full pipe while
+    # stdout is being read
+    with tempfile.TemporaryFile() as stderr:
+        with subprocess.Popen([
+                *command,
+                "-i", str(mp3_path),
+                "-af", "ebur128=framelog=quiet",
+                "-ac", "1",
+                "-ar", str(DECODE_SAMPLE_RATE),
+                "-nostats",
+                "-f", "s16le",
+                "-",
+            ], stdout=subprocess.PIPE, stderr=stderr) as process:
+            while True:
+                data = process.stdout.read(_READ_SIZE)
+                if not data:
+                    break
+                # Reads are always full (and even) until the end; drop a
+                # trailing odd byte, if any
+                pcm = data[:len(data) // 2 * 2]
+                accumulator.add(np.frombuffer(pcm, dtype="<i2"))
+
+        if process.returncode != 0:
+            return None
+
+        # ebur128 prints a summary when it finishes; use the last one
+        stderr.seek(0)
+        matches = _LOUDNESS_RE.findall(stderr.read())
+        loudness = float(matches[-1]) if matches else None
+
+    return accumulator, loudness
+
+def analyze(mp3_path, peaks_path, command=("ffmpeg",)):
+    # Decode a song's mp3 once to write its waveform peaks file and measure
+    # it; returns an AudioInfo, or None on failure (doesn't need an app
+    # context, so it can run in any thread or process)
+    decoded = decode(mp3_path, command)
+    if decoded is None:
+        return None
+    accumulator, loudness = decoded
+
+    peaks.write(peaks_path, accumulator.peaks())
+
+    size = os.path.getsize(mp3_path)
+    duration = accumulator.length / DECODE_SAMPLE_RATE
+    info = mp3info.probe(mp3_path)
+    if info:
+        bitrate = info.bitrate
+        sample_rate = info.sample_rate
+    else:
+        bitrate = round(size * 8 / duration / 1000) if duration else None
+        sample_rate = None
+
+    return AudioInfo(duration, bitrate, sample_rate, size, loudness)
+
+def save(songid, info):
+    db.query(
+            """
+            UPDATE songs
+            SET duration = ?, bitrate = ?, sample_rate = ?, size = ?, loudness = ?
+            WHERE songid = ?
+            """,
+            [*info, songid])
+
+def _analyze_file(mp3_path, command, slot_count, slots_path):
+    # Process pool worker for analyze-songs; decodes in a transcoding slot, so
+    # it shares the limit with transcoding in the app
+    peaks_path = mp3_path.with_suffix(".peaks")
+    with ffmpeg.worker_slot(slot_count, slots_path):
+        return analyze(mp3_path, peaks_path, command)
+
+@click.command("analyze-songs")
+@click.option("--all", "reanalyze", is_flag=True, help="Reanalyze songs that already have audio info")
+@click.option("--jobs", type=int, default=None, help="Number of worker processes (default: TRANSCODE_SLOTS)")
+@with_appcontext
+def analyze_songs_cmd(reanalyze, jobs):
+    """Store audio info and waveform peaks for existing song files"""
+    songs = db.query("SELECT songid, userid, duration, blob FROM songs WHERE status = 'ready'")
+
+    # Songs that share a blob are analyzed once
+    work = {}
+    for song in songs:
+        mp3_path = blobs.get_audio_path(song["userid"], song["songid"], song["blob"])
+        if not mp3_path.exists():
+            continue
+
+        if (reanalyze
+                or song["duration"] is None
+                or not mp3_path.with_suffix(".peaks").exists()):
+            work.setdefault(mp3_path, []).append(song["songid"])
+
+    # Decoding is done by ffmpeg, but computing peaks and parsing output is
+    # Python, so use separate processes; results are saved by this process.
+    # Each decode takes a transcoding slot (see ffmpeg.py), so songs decoded
+    # at once are limited by TRANSCODE_SLOTS, along with transcodes running in
+    # the app.
+    command = ffmpeg.get_command()
+    slot_count = current_app.config["TRANSCODE_SLOTS"]
+    slots_path = datadir.get_transcode_slots_path()
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs or slot_count) as executor:
+        futures = {
+            executor.submit(_analyze_file, mp3_path, command, slot_count, slots_path): songids
+            for mp3_path, songids in work.items()}
+        for future in concurrent.futures.as_completed(futures):
+            info = future.result()
+            songids = futures[future]
+            if info is None:
+                failed += len(songids)
+                click.echo(f"Failed to analyze songs {', '.join(map(str, songids))}")
+            else:
+                for songid in songids:
+                    save(songid, info)
+
+    db.commit()
+    analyzed = sum(len(songids) for songids in work.values())
+    click.echo(f"Analyzed {analyzed - failed} songs ({failed} failed)")
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import shutil
+from datetime import datetime, timezone
+
+from . import datadir, db
+
+# Song audio is stored by content.  A blob is an mp3 named by a hash of the
+# uploaded source file and the settings used to convert it, with the files
+# made from it stored next to it:
+#   blobs/ab/ab01...ef.mp3    audio
+#   blobs/ab/ab01...ef.peaks  waveform peaks
+#   blobs/ab/ab01...ef.webm   Opus rendition
+#   blobs/ab/ab01...ef.hls/   HLS segments
+# Songs made from the same file share a blob.  The blobs table counts the
+# songs that use each blob (kept up to date by triggers on the songs table),
+# and blobs are deleted when no song uses them any more.
+#
+# Songs uploaded before blobs were added have no blob, and their files are
+# in songs/<userid>/<songid>.mp3 (etc.) until their audio is replaced.
+
+_READ_SIZE = 1024 * 1024
+
+def hash_source(path, settings):
+    # Blob name for a source file converted with the given settings
+    sha = hashlib.sha256(settings.encode() + b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def get_blob_path(blob):
+    return datadir.get_blobs_path() / blob[:2] / (blob + ".mp3")
+
+def get_audio_path(userid, songid, blob):
+    # A song's mp3; files made from it have the same path with another suffix
+    if blob:
+        return get_blob_path(blob)
+    return datadir.get_user_songs_path(userid) / (str(songid) + ".mp3")
+
+def get_song_path(userid, songid):
+    song = db.query(
+            "SELECT blob FROM songs WHERE songid = ? AND userid = ?",
+            [songid, userid],
+            one=True)
+    return get_audio_path(userid, songid, song["blob"] if song else None)
+
+def reuse(songid, blob):
+    # Point a song at a blob that has already been made (by this song or
+    # another one), copying its audio info; returns False if there is no such
+    # blob, and the source has to be converted
+    info = db.query(
+            """
+            SELECT duration, bitrate, sample_rate, size, loudness FROM songs
+            WHERE blob = ? AND status = 'ready' AND duration IS NOT NULL
+            LIMIT 1
+            """,
+            [blob],
+            one=True)
+    if info is None:
+        return False
+
+    # Take the database write lock before checking for the file; the blob
+    # can't be collected until this song's reference is committed
+    _add(blob)
+    if not get_blob_path(blob).exists():
+        db.commit()
+        return False
+
+    db.query(
+            """
+            UPDATE songs
+            SET duration = ?, bitrate = ?, sample_rate = ?, size = ?, loudness = ?
+            WHERE songid = ?
+            """,
+            [*info, songid])
+    _use(songid, blob)
+    return True
+
+def store(songid, blob, mp3_path):
+    # Move a newly converted mp3 into the store, and point the song at it
+    _add(blob)
+    os.replace(mp3_path, get_blob_path(blob))
+    db.query("UPDATE songs SET hls = 0 WHERE songid = ?", [songid])
+    _use(songid, blob)
+
+def collect():
+    # Delete blobs that no song uses; the DELETE holds the database write
+    # lock until the files are gone, so no song can start using them first
+    unused = db.query("DELETE FROM blobs WHERE refcount <= 0 RETURNING blob")
+    for row in unused:
+        remove_files(get_blob_path(row["blob"]))
+    db.commit()
+
+def remove_files(mp3_path):
+    # Remove an mp3 and every file made from it
+    for suffix in [".mp3", ".peaks", ".webm"]:
+        path = mp3_path.with_suffix(suffix)
+        if path.exists():
+            os.remove(path)
+    shutil.rmtree(mp3_path.with_suffix(".hls"), ignore_errors=True)
+
+def _add(blob):
+    timestamp = datetime.now(timezone.utc).isoformat()
+    db.query(
+            "INSERT OR IGNORE INTO blobs (blob, created) VALUES (?, ?)",
+            [blob, timestamp])
+    os.makedirs(get_blob_path(blob).parent, exist_ok=True)
+
+def _use(songid, blob):
+    song = db.query("SELECT userid, blob FROM songs WHERE songid = ?", [songid], one=True)
+    db.query("UPDATE songs SET blob = ? WHERE songid = ?", [blob, songid])
+    if song and song["blob"] is None:
+        # Audio from before blobs
+        remove_files(get_audio_path(song["userid"], songid, None))
+
+    # Free the song's previous blob (or this one, if the song was deleted)
+    collect()
@@ -1,10 +1,11 @@
 import enum
+import json
 from datetime import datetime, timezone
 
 from flask import abort, Blueprint, redirect, render_template, request, session
 
 from . import db, songs
-from .sanitize import sanitize_user_text
+from .sanitize import sanitize_user_text, stored_html
 
 bp = Blueprint("comments", __name__)
 
@@ -30,26 +31,46 @@ def create_thread(threadtype, userid):
     return thread["threadid"]
 
 def for_thread(threadid):
-    thread_comments = db.query(
+    return for_threads([threadid])[threadid]
+
+def for_threads(threadids):
+    # Load comments for several threads with a single query; returns a dict
+    # mapping each threadid to its list of top-level comments (with replies)
+    threadids = list(threadids)
+    all_comments = db.query(
             """
             select * from comments
             inner join users on comments.userid == users.userid
-            where comments.threadid = ?
+            where comments.threadid in (select value from json_each(?))
             """,
-            [threadid])
-    thread_comments = [dict(c) for c in thread_comments]
-    for c in thread_comments:
-        c["content"] = sanitize_user_text(c["content"])
+            [json.dumps(threadids)])
+
+    # Group comments by thread
+    comments_by_thread = {threadid: [] for threadid in threadids}
+    for c in all_comments:
+        c = dict(c)
+        c["content"] = stored_html(c, "content")
+        comments_by_thread.setdefault(c["threadid"], []).append(c)
 
+    return {
+        threadid: _build_tree(thread_comments)
+        for threadid, thread_comments in comments_by_thread.items()}
+
+def _build_tree(thread_comments):
     # Top-level comments
     song_comments = sorted(
             [dict(c) for c in thread_comments if c["replytoid"] is None],
             key=lambda c: c["created"])
     song_comments = list(reversed(song_comments))
+
     # Replies (can only reply to top-level)
+    replies = {}
+    for c in thread_comments:
+        if c["replytoid"] is not None:
+            replies.setdefault(c["replytoid"], []).append(c)
     for comment in song_comments:
         comment["replies"] = sorted(
-                [c for c in thread_comments if c["replytoid"] == comment["commentid"]],
+                replies.get(comment["commentid"], []),
                 key=lambda c: c["created"])
 
     return song_comments
@@ -142,8 +163,15 @@ def comment():
         if comment:
             # Update existing comment
             db.query(
-                    "update comments set content = ? where commentid = ?",
-                    args=[content, comment["commentid"]])
+                    """
+                    update comments set content = ?, content_html = ?
+                    where commentid = ?
+                    """,
+                    args=[
+                        content,
+                        sanitize_user_text(content),
+                        comment["commentid"],
+                    ])
         else:
             # Add new comment
             timestamp = datetime.now(timezone.utc).isoformat()
@@ -154,11 +182,15 @@ def comment():
             comment = db.query(
                     """
                     insert into comments
-                        (threadid, userid, replytoid, created, content)
-                    values (?, ?, ?, ?, ?)
+                        (threadid, userid, replytoid, created, content,
+                         content_html)
+                    values (?, ?, ?, ?, ?, ?)
                     returning (commentid)
                     """,
-                    args=[threadid, userid, replytoid, timestamp, content],
+                    args=[
+                        threadid, userid, replytoid, timestamp, content,
+                        sanitize_user_text(content),
+                    ],
                     one=True)
             commentid = comment["commentid"]
 
@@ -179,14 +211,16 @@ def comment():
                 notification_targets.remove(userid)
 
             # Create notifications
-            for target in notification_targets:
-                db.query(
-                        """
-                        insert into notifications
-                            (objectid, objecttype, targetuserid, created)
-                        values (?, ?, ?, ?)
-                        """,
-                        [commentid, ObjectType.COMMENT, target, timestamp])
+            db.query_many(
+                    """
+                    insert into notifications
+                        (objectid, objecttype, targetuserid, created)
+                    values (?, ?, ?, ?)
+                    """,
+                    [
+                        [commentid, ObjectType.COMMENT, target, timestamp]
+                        for target in notification_targets
+                    ])
 
         db.commit()
 
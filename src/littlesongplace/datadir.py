@@ -13,8 +13,14 @@ def set_data_dir(newdir):
     global _data_dir
     _data_dir = Path(newdir)
 
+def get_songs_path():
+    return _data_dir / "songs"
+
+def get_blobs_path():
+    return _data_dir / "blobs"
+
 def get_user_songs_path(userid):
-    userpath = _data_dir / "songs" / str(userid)
+    userpath = get_songs_path() / str(userid)
     if not userpath.exists():
         os.makedirs(userpath)
     return userpath
@@ -28,3 +34,24 @@ def get_user_images_path(userid):
 def get_app_log_path():
     return _data_dir / "app.log"
 
+
+def get_image_cache_path():
+    cachepath = _data_dir / "cache" / "images"
+    if not cachepath.exists():
+        os.makedirs(cachepath, exist_ok=True)
+    return cachepath
+
+def get_transcode_slots_path():
+    slotspath = _data_dir / "slots"
+    if not slotspath.exists():
+        os.makedirs(slotspath, exist_ok=True)
+    return slotspath
+
+def get_upload_staging_path():
+    stagingpath = _data_dir / "uploads"
+    if not stagingpath.exists():
+        os.makedirs(stagingpath, exist_ok=True)
+    return stagingpath
+
+def get_data_dir():
+    return _data_dir
@@ -1,38 +1,137 @@
+import atexit
+import random
 import sqlite3
+import threading
+import time
 from pathlib import Path
 
 import click
-from flask import abort, g, current_app
+from flask import abort, current_app
 
 from . import datadir
 
-DB_VERSION = 6
+# Schema version in schema.sql; each version has a step in sql/migrations (see
+# migrate), and schema_revert.sql undoes the latest one
+DB_VERSION = 16
+
+# Each thread keeps its own connection open between requests (sqlite3
+# connections can't be shared between threads), so the connection setup below
+# only happens once per thread.  WAL lets readers and a writer work at the
+# same time; with synchronous=NORMAL, a power loss can lose the last few
+# commits, but never corrupts the database.
+BUSY_TIMEOUT = 5000  # ms to wait for another connection's write lock
+CACHE_SIZE = 16 * 1024  # KiB of page cache per connection
+MMAP_SIZE = 256 * 1024 * 1024  # bytes
+
+# Write transactions start with BEGIN IMMEDIATE when query() runs the first
+# write statement (INSERT, UPDATE, DELETE or REPLACE) after a commit, so the
+# write lock is taken up front.  A deferred transaction would upgrade its
+# lock partway through instead, and fail right away with "database is locked"
+# (without waiting for the busy timeout) if another thread wrote in between.
+# If the lock still isn't free after the busy timeout, BEGIN is retried with
+# backoff; nothing has been written yet, so that's always safe.
+WRITE_RETRIES = 3
+WRITE_BACKOFF = 0.05  # seconds before the first retry, doubled for each one
+SLOW_LOCK_WAIT = 1.0  # seconds; longer waits for the write lock are logged
+
+_WRITE_STATEMENTS = {"insert", "update", "delete", "replace"}
+
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_stats = {"transactions": 0, "retries": 0, "failures": 0, "lock_wait": 0.0, "max_lock_wait": 0.0}
+
+# Writes queued by write_behind, committed by the flusher thread
+_pending_lock = threading.Lock()
+_pending = []
+_flusher = None
 
 def get():
-    db = getattr(g, '_database', None)
+    db_path = datadir.get_db_path()
+    db = getattr(_local, "connection", None)
+    if db is not None and _local.path != db_path:
+        # Data directory changed (tests)
+        db.close()
+        db = None
+
     if db is None:
-        db = g._database = sqlite3.connect(datadir.get_db_path())
-        db.cursor().execute("PRAGMA foreign_keys = ON")
+        # Transactions are started by query() (see _begin)
+        db = sqlite3.connect(db_path, isolation_level=None)
+        db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT:d}")
+        db.execute("PRAGMA journal_mode = WAL")
+        db.execute("PRAGMA synchronous = NORMAL")
+        db.execute(f"PRAGMA cache_size = -{CACHE_SIZE:d}")
+        db.execute(f"PRAGMA mmap_size = {MMAP_SIZE:d}")
+        db.execute("PRAGMA foreign_keys = ON")
         db.row_factory = sqlite3.Row
+        _local.connection = db
+        _local.path = db_path
+    return db
 
-        # Get current version
-        user_version = query("pragma user_version", one=True)[0]
+def rollback(exception):
+    # Connections outlive the app context, so don't leave anything that
+    # wasn't committed for the next request on this thread
+    db = getattr(_local, "connection", None)
+    if db is not None and db.in_transaction:
+        db.rollback()
 
-        # Run update script if DB is out of date
-        schema_update_script = Path(current_app.root_path) / 'sql' / 'schema_update.sql'
-        if user_version < DB_VERSION and schema_update_script.exists():
-            with current_app.open_resource(schema_update_script, mode='r') as f:
-                db.cursor().executescript(f.read())
-            db.commit()
-    return db
+def migrate(app):
+    # Bring the database up to date when the app starts, instead of checking
+    # on every request.  Each sql/migrations/NN.sql updates the database from
+    # version NN-1 to NN; all pending steps run in order, in one transaction.
+    # Returns True if the database was updated.
+    db_path = datadir.get_db_path()
+    if not db_path.exists():
+        return False
+
+    db = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # Hold the write lock from checking the version until the update is
+        # committed, so only one app process runs the update
+        db.execute("BEGIN IMMEDIATE")
+        user_version = db.execute("PRAGMA user_version").fetchone()[0]
+        if user_version > DB_VERSION:
+            raise RuntimeError(
+                    f"Database version {user_version} is newer than this app "
+                    f"(version {DB_VERSION})")
+
+        updated = 0 < user_version < DB_VERSION
+        if updated:
+            app.logger.info(f"Updating database from version {user_version}")
+            for version in range(user_version + 1, DB_VERSION + 1):
+                _run_migration(app, db, version)
 
-def close(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
+        db.execute("COMMIT")
+    finally:
+        # (Rolls back if the update failed)
         db.close()
 
+    return updated
+
+def _run_migration(app, db, version):
+    script = Path(app.root_path) / "sql" / "migrations" / f"{version:02d}.sql"
+    if not script.exists():
+        raise RuntimeError(f"No migration to database version {version}")
+    for statement in _split_script(script.read_text()):
+        db.execute(statement)
+    if db.execute("PRAGMA user_version").fetchone()[0] != version:
+        raise RuntimeError(f"{script.name} didn't set the database version to {version}")
+
+def _split_script(script):
+    # Statements in a SQL script, for running them inside a transaction
+    # (executescript commits first)
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
 def query(query, args=(), one=False, expect_one=False):
-    cur = get().execute(query, args)
+    db = get()
+    if not db.in_transaction and _is_write(query):
+        _begin(db)
+    cur = db.execute(query, args)
     rv = cur.fetchall()
     cur.close()
     if expect_one and not rv:
@@ -40,9 +139,110 @@ def query(query, args=(), one=False, expect_one=False):
 
     return (rv[0] if rv else None) if (one or expect_one) else rv
 
+def query_many(query, rows):
+    # Run a write statement once for each row of args, in one call (with one
+    # transaction and no results); does nothing if there are no rows
+    rows = list(rows)
+    if not rows:
+        return
+
+    db = get()
+    if not db.in_transaction and _is_write(query):
+        _begin(db)
+    db.executemany(query, rows)
+
 def commit():
     get().commit()
 
+def write_behind(sql, args=()):
+    # Write something that doesn't have to be committed right away (like a
+    # user's last activity time).  With DB_WRITE_BEHIND_INTERVAL set, writes
+    # are queued and committed together by a background thread every
+    # interval, instead of each taking the write lock separately.
+    global _flusher
+    app = current_app._get_current_object()
+    if not app.config["DB_WRITE_BEHIND_INTERVAL"]:
+        query(sql, args)
+        commit()
+        return
+
+    with _pending_lock:
+        _pending.append((sql, args))
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, args=[app], daemon=True)
+            _flusher.start()
+            atexit.register(_flush_at_exit, app)
+
+def flush_writes():
+    # Commit all of the writes queued by write_behind in one transaction
+    with _pending_lock:
+        writes = list(_pending)
+        _pending.clear()
+    if not writes:
+        return
+
+    for sql, args in writes:
+        query(sql, args)
+    commit()
+
+def get_stats():
+    # Totals for this process: write transactions, retried and failed BEGINs,
+    # and seconds spent waiting for the write lock
+    with _stats_lock:
+        return dict(_stats)
+
+def _is_write(query):
+    words = query.split(None, 1)
+    return bool(words) and words[0].lower() in _WRITE_STATEMENTS
+
+def _begin(db):
+    start = time.perf_counter()
+    retries = 0
+    while True:
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            break
+        except sqlite3.OperationalError as e:
+            busy = e.sqlite_errorcode & 0xff == sqlite3.SQLITE_BUSY
+            if busy and retries < WRITE_RETRIES:
+                time.sleep(WRITE_BACKOFF * 2 ** retries * random.uniform(0.5, 1.0))
+                retries += 1
+                continue
+
+            _update_stats(retries=retries, failures=1)
+            if busy:
+                current_app.logger.error(
+                        f"Failed to get database write lock after {retries} retries "
+                        f"({time.perf_counter() - start:0.3f} s)")
+            raise
+
+    wait = time.perf_counter() - start
+    _update_stats(transactions=1, retries=retries, lock_wait=wait)
+    if wait >= SLOW_LOCK_WAIT or retries:
+        current_app.logger.warning(
+                f"Waited {wait:0.3f} s for database write lock ({retries} retries)")
+
+def _update_stats(**changes):
+    with _stats_lock:
+        for key, value in changes.items():
+            _stats[key] += value
+        if "lock_wait" in changes:
+            _stats["max_lock_wait"] = max(_stats["max_lock_wait"], changes["lock_wait"])
+
+def _flush_loop(app):
+    while True:
+        # (Writes are committed right away again if the interval is unset)
+        time.sleep(app.config["DB_WRITE_BEHIND_INTERVAL"] or 1)
+        with app.app_context():
+            try:
+                flush_writes()
+            except Exception:
+                app.logger.exception("Failed to commit queued writes")
+
+def _flush_at_exit(app):
+    with app.app_context():
+        flush_writes()
+
 @click.command("init-db")
 def init_cmd():
     """Clear the existing data and create new tables"""
@@ -62,6 +262,9 @@ def init_cmd():
         db.commit()
 
 def init_app(app):
+    # Seconds between commits of writes queued by write_behind, or None to
+    # commit them right away
+    app.config.setdefault("DB_WRITE_BEHIND_INTERVAL", None)
     app.cli.add_command(init_cmd)
-    app.teardown_appcontext(close)
+    app.teardown_appcontext(rollback)
 
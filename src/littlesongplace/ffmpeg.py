@@ -0,0 +1,124 @@
+import contextlib
+import os
+import subprocess
+import threading
+import time
+
+from flask import current_app
+
+from . import datadir
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows; slots are only shared by threads in one process
+
+# Every ffmpeg process runs in a transcoding slot.  Slots are shared by all
+# worker processes on the host: each one is an exclusive lock on a file in
+# data/slots, which the OS releases if the process holding it dies.  Waiting
+# for a slot and running ffmpeg are both timed, and added to the log line for
+# each run.  The waiting count in stats is threads in this process waiting for
+# a slot; waiters in other processes can't be seen from here.
+
+_POLL_INTERVAL = 0.05  # seconds
+
+_stats_lock = threading.Lock()
+_stats = {"runs": 0, "waiting": 0, "wait_time": 0.0, "run_time": 0.0}
+_semaphores = {}
+
+def init_app(app):
+    app.config.setdefault("FFMPEG", "ffmpeg")
+    # ffmpeg processes running at once on the host
+    app.config.setdefault("TRANSCODE_SLOTS", os.cpu_count() or 1)
+    # Niceness of ffmpeg processes (None to run at normal priority), so web
+    # requests come first
+    app.config.setdefault("FFMPEG_NICE", 10)
+    # Threads per ffmpeg process for decoding and filtering (the encoders used
+    # here are single-threaded); None lets ffmpeg decide
+    app.config.setdefault("FFMPEG_THREADS", 1)
+
+def get_command():
+    # Start of an ffmpeg command line, with the configured priority and thread
+    # limits
+    config = current_app.config
+    command = [config["FFMPEG"]]
+    if config["FFMPEG_THREADS"] is not None:
+        threads = str(config["FFMPEG_THREADS"])
+        command += ["-threads", threads, "-filter_threads", threads]
+    if config["FFMPEG_NICE"] is not None and os.name == "posix":
+        command = ["nice", "-n", str(config["FFMPEG_NICE"])] + command
+    return command
+
+def run(name, args):
+    # Run ffmpeg with args in a transcoding slot; returns the CompletedProcess
+    with slot(name):
+        return subprocess.run(get_command() + args, stdout=subprocess.PIPE)
+
+@contextlib.contextmanager
+def slot(name):
+    # Hold a transcoding slot for the body of the with statement (for running
+    # ffmpeg, and anything else that should count against the limit)
+    count = current_app.config["TRANSCODE_SLOTS"]
+    _update_stats(waiting=1)
+    start = time.perf_counter()
+    try:
+        release = _acquire(count, datadir.get_transcode_slots_path())
+    finally:
+        _update_stats(waiting=-1)
+    wait_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        release()
+        run_time = time.perf_counter() - start
+        stats = _update_stats(runs=1, wait_time=wait_time, run_time=run_time)
+        label = f" ({name})" if name else ""
+        current_app.logger.info(
+                f"Ran ffmpeg{label} in {run_time:0.6f} s "
+                f"(waited {wait_time:0.6f} s for a slot, "
+                f"{stats['waiting']} threads in this process waiting)")
+
+@contextlib.contextmanager
+def worker_slot(count, slots_path):
+    # Hold one of count slots in slots_path, without an app context (for
+    # worker processes); not timed or logged
+    release = _acquire(count, slots_path)
+    try:
+        yield
+    finally:
+        release()
+
+def get_stats():
+    # Totals for this process: ffmpeg runs, threads in this process waiting
+    # for a slot now, and seconds spent waiting for slots and running
+    with _stats_lock:
+        return dict(_stats)
+
+def _update_stats(**changes):
+    with _stats_lock:
+        for key, value in changes.items():
+            _stats[key] += value
+        return dict(_stats)
+
+def _acquire(count, slots_path):
+    # Wait for a free slot; returns a function that releases it
+    if fcntl is None:
+        with _stats_lock:
+            semaphore = _semaphores.setdefault(count, threading.BoundedSemaphore(count))
+        semaphore.acquire()
+        return semaphore.release
+
+    while True:
+        for i in range(count):
+            # Each open() has its own lock, so threads in this process
+            # exclude each other as well as other processes
+            lock_file = open(slots_path / f"{i}.lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                continue
+            return lock_file.close
+        time.sleep(_POLL_INTERVAL)
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from flask import abort, Blueprint, request, send_from_directory
+
+from . import colors, datadir
+
+bp = Blueprint("images", __name__)
+
+# Max number of recolored images to keep on disk; when there are more, the
+# least recently used are deleted until CACHE_TRIM of that is left
+CACHE_SIZE = 5000
+CACHE_TRIM = 0.9
+# Cache hits mark an image as recently used at most this often
+TOUCH_INTERVAL = 24 * 60 * 60  # seconds
+
+_COLOR_RE = re.compile(r"#?([0-9a-fA-F]{6})")
+
+def _load_gifs():
+    gifs = {}
+    static_path = Path(__file__).parent / "static"
+    for child in static_path.iterdir():
+        if child.suffix == ".gif":
+            with open(child, "rb") as gif:
+                gifs[child.stem] = gif.read()
+    return gifs
+
+_gifs = _load_gifs()
+
+# Short hash of each .gif, in recolored images' URLs (see nav.js) and cache
+# filenames, so they change when the .gif does
+gif_versions = {
+    name: hashlib.sha256(data).hexdigest()[:8] for name, data in _gifs.items()}
+
+_cache_lock = threading.Lock()
+_cache_count = None  # Images in the cache, as of this process's last count
+
+def recolor_gif(data, bgcolor, accolor):
+    # Swap the color palette of a .gif by replacing the background and accent
+    # entries in its global color table.  The byte indexes match .gifs from
+    # Aseprite, and may not work for all .gif files.
+    data = bytearray(data)
+    data[16:19] = bytes.fromhex(bgcolor)
+    data[19:22] = bytes.fromhex(accolor)
+    return bytes(data)
+
+def _get_color(arg, default):
+    # Colors come from page styles, so anything unexpected (an unset or
+    # non-hex value) gets the default color instead of breaking the image
+    match = _COLOR_RE.fullmatch(request.args.get(arg, ""))
+    return match.group(1).lower() if match else default.lstrip("#")
+
+@bp.get("/static-colored/<name>.gif")
+def colored_gif(name):
+    if name not in _gifs:
+        abort(404)
+
+    bgcolor = _get_color("bg", colors.BGCOLOR)
+    accolor = _get_color("ac", colors.ACCOLOR)
+
+    cache_path = datadir.get_image_cache_path()
+    filename = f"{name}-{gif_versions[name]}-{bgcolor}-{accolor}.gif"
+    filepath = cache_path / filename
+    try:
+        # Mark as recently used, unless that was done lately
+        if time.time() - filepath.stat().st_mtime > TOUCH_INTERVAL:
+            os.utime(filepath)
+    except FileNotFoundError:
+        # Write to a temporary file first so other threads never see a
+        # partially written image
+        with tempfile.NamedTemporaryFile(dir=cache_path, prefix=".", delete=False) as tmp_file:
+            tmp_file.write(recolor_gif(_gifs[name], bgcolor, accolor))
+        os.replace(tmp_file.name, filepath)
+        _count_cached(cache_path)
+
+    response = send_from_directory(cache_path, filename, max_age=365*24*60*60)
+    response.cache_control.immutable = True
+    return response
+
+def _count_cached(cache_path):
+    # Count a newly cached image, and evict once the count is over CACHE_SIZE
+    # (the cache directory is only scanned then, and on the first miss in each
+    # process; other processes' images are only seen by scanning)
+    global _cache_count
+    with _cache_lock:
+        if _cache_count is not None:
+            _cache_count += 1
+            if _cache_count <= CACHE_SIZE:
+                return
+        _cache_count = _evict(cache_path)
+
+def _evict(cache_path):
+    # Delete the least recently used images if the cache is over CACHE_SIZE;
+    # returns the number of images left
+    entries = [e for e in os.scandir(cache_path) if not e.name.startswith(".")]
+    if len(entries) <= CACHE_SIZE:
+        return len(entries)
+
+    keep = int(CACHE_SIZE * CACHE_TRIM)
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:len(entries) - keep]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # Already evicted by another thread
+    return keep
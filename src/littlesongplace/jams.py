@@ -5,7 +5,7 @@ from datetime import datetime, timezone
 from flask import abort, Blueprint, g, redirect, render_template, request, url_for
 
 from . import auth, comments, db, jams, songs
-from .sanitize import sanitize_user_text
+from .sanitize import sanitize_user_text, stored_html
 
 bp = Blueprint("jams", __name__, url_prefix="/jams")
 
@@ -97,10 +97,12 @@ def update(jamid):
     row = db.query(
             """
             UPDATE jams
-            SET title = ?, description = ?
+            SET title = ?, description = ?, description_html = ?
             WHERE jamid = ?
             RETURNING *
-            """, [title, description, jamid], expect_one=True)
+            """,
+            [title, description, sanitize_user_text(description), jamid],
+            expect_one=True)
 
     db.commit()
     return redirect(url_for("jams.jam", jamid=jamid))
@@ -172,11 +174,19 @@ def events_update(jamid, eventid):
     db.query(
             """
             UPDATE jam_events
-            SET title = ?, description = ?, startdate = ?, enddate = ?
+            SET
+                title = ?,
+                description = ?,
+                description_html = ?,
+                startdate = ?,
+                enddate = ?
             WHERE eventid = ? AND jamid = ?
             RETURNING *
             """,
-            [title, description, startdate, enddate, eventid, jamid],
+            [
+                title, description, sanitize_user_text(description),
+                startdate, enddate, eventid, jamid,
+            ],
             expect_one=True)
     db.commit()
     return redirect(url_for("jams.events_view", jamid=jamid, eventid=eventid))
@@ -245,6 +255,7 @@ class Jam:
                     e.startdate,
                     e.enddate,
                     e.description,
+                    e.description_html,
                     j.title as jam_title,
                     u.username as jam_ownername
                 FROM jam_events as e
@@ -256,7 +267,7 @@ class Jam:
         return cls(
                 jamid=row["jamid"],
                 title=row["title"],
-                description=sanitize_user_text(row["description"] or ""),
+                description=stored_html(row, "description"),
                 ownerid=row["userid"],
                 ownername=row["username"],
                 created=datetime.fromisoformat(row["created"]),
@@ -293,7 +304,7 @@ class JamEvent:
                 title=row["title"],
                 startdate=startdate,
                 enddate=enddate,
-                description=sanitize_user_text(row["description"] or ""),
+                description=stored_html(row, "description"),
                 jam_title=row["jam_title"],
                 jam_ownername=row["jam_ownername"],
                 # TODO: Comment object?
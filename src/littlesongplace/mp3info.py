@@ -0,0 +1,179 @@
+import mmap
+import struct
+from collections import namedtuple
+
+# Uploads that already match what ffmpeg would produce (MPEG-1 Layer III at
+# 44.1 kHz, at a reasonable bitrate, average bitrate for VBR) have their
+# frames copied into a new file instead of being re-encoded
+SAMPLE_RATE = 44100
+MIN_BITRATE = 128  # kbps
+
+Mp3Info = namedtuple("Mp3Info", ["sample_rate", "bitrate", "channels", "vbr"])
+
+# Number of consecutive frames that must parse before the file is trusted to
+# be an mp3 (random data can look like a single frame header)
+_FRAMES_TO_CHECK = 8
+
+# Only enough of the file to check the first few frames is read
+_READ_SIZE = 64 * 1024
+
+# MPEG-1 Layer III tables
+_BITRATES = [None, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, None]
+_SAMPLE_RATES = [44100, 48000, 32000, None]
+_SAMPLES_PER_FRAME = 1152
+
+def is_compliant(path):
+    # Every frame header is checked, not just the first few, since the frames
+    # are kept as they are: the format can't change partway through, and
+    # nothing but tags can follow the last frame (the tags are dropped)
+    found = _find_frames(path)
+    if found is None:
+        return False
+    info, start = found
+    if info.sample_rate != SAMPLE_RATE or info.bitrate < MIN_BITRATE:
+        return False
+    return _check_all_frames(path, start, info.sample_rate)
+
+def probe(path):
+    # Parse the first few frame headers of an MPEG-1 Layer III file; returns
+    # an Mp3Info, or None if the file is not an mp3 (or uses a format this
+    # parser doesn't understand, e.g. MPEG-2 or free bitrate)
+    found = _find_frames(path)
+    return found[0] if found else None
+
+def _find_frames(path):
+    # (Mp3Info, offset of the first frame in the file) for probe, or None
+    with open(path, "rb") as f:
+        data = f.read(10)
+        offset = _id3v2_size(data)
+        f.seek(offset)
+        data = f.read(_READ_SIZE)
+
+    # Allow some padding before the first frame
+    start = data.find(b"\xff", 0, 4096)
+    while start >= 0:
+        info = _parse_frames(data, start)
+        if info:
+            return info, offset + start
+        start = data.find(b"\xff", start + 1, 4096)
+
+    return None
+
+def _check_all_frames(path, start, sample_rate):
+    # Whether the file is frames like the one at start through to the end,
+    # followed by nothing but ID3v1 and APE tags
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offset = start
+        while True:
+            header = _parse_header(data, offset)
+            if not header or header[1] != sample_rate:
+                break
+            offset += header[3]
+        if offset > len(data):
+            return False  # Last frame cut short
+        return _only_tags(data, offset)
+
+def _only_tags(data, offset):
+    while offset < len(data):
+        if data[offset:offset + 8] == b"APETAGEX" and offset + 32 <= len(data):
+            # APEv2 tag, starting with its header (a tag without one starts
+            # with its items, and isn't recognized); the size covers the
+            # items and footer
+            size, _, flags = struct.unpack("<III", data[offset + 12:offset + 24])
+            if not flags & 0x20000000:
+                return False
+            offset += 32 + size
+        elif data[offset:offset + 3] == b"TAG" and offset + 128 == len(data):
+            offset += 128  # ID3v1, always last
+        else:
+            return False
+    return offset == len(data)
+
+def _id3v2_size(data):
+    # Size of the ID3v2 tag at the start of the file (0 if there is no tag)
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = 0
+    for b in data[6:10]:
+        size = (size << 7) | (b & 0x7f)  # Sync-safe integer
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def _parse_header(data, offset):
+    # Returns (bitrate, sample_rate, channels, frame_length) for a valid
+    # MPEG-1 Layer III frame header at offset, or None
+    if offset + 4 > len(data):
+        return None
+
+    b0, b1, b2, b3 = data[offset:offset + 4]
+    if b0 != 0xff or (b1 & 0xe0) != 0xe0:
+        return None  # No frame sync
+    if (b1 >> 3) & 0x3 != 0x3 or (b1 >> 1) & 0x3 != 0x1:
+        return None  # Not MPEG-1 Layer III
+
+    bitrate = _BITRATES[b2 >> 4]
+    sample_rate = _SAMPLE_RATES[(b2 >> 2) & 0x3]
+    if bitrate is None or sample_rate is None:
+        return None
+
+    padding = (b2 >> 1) & 0x1
+    channels = 1 if (b3 >> 6) == 0x3 else 2
+    frame_length = 144 * bitrate * 1000 // sample_rate + padding
+    return bitrate, sample_rate, channels, frame_length
+
+def _parse_frames(data, start):
+    header = _parse_header(data, start)
+    if not header:
+        return None
+    _, sample_rate, channels, _ = header
+
+    xing = _xing_header(data, start, header)
+
+    # Walk the following frames to make sure this is really an mp3 (a
+    # Xing/Info header's frame holds no audio, and may be at any bitrate, so
+    # it doesn't count towards the average)
+    bitrates = []
+    offset = start
+    for i in range(_FRAMES_TO_CHECK):
+        header = _parse_header(data, offset)
+        if not header:
+            if offset + 4 > len(data) and bitrates:
+                break  # Short file, ran out of frames
+            return None
+        bitrate, frame_sample_rate, _, frame_length = header
+        if frame_sample_rate != sample_rate:
+            return None
+        if i > 0 or xing is None:
+            bitrates.append(bitrate)
+        offset += frame_length
+
+    # An "Info" header only marks a CBR file (its byte count includes tags
+    # and the header's own frame), so the frames' bitrate is used instead
+    if xing is not None and xing[1]:
+        return Mp3Info(sample_rate, xing[0], channels, True)
+    if not bitrates:
+        return None
+
+    average = sum(bitrates) // len(bitrates)
+    return Mp3Info(sample_rate, average, channels, len(set(bitrates)) > 1)
+
+def _xing_header(data, start, header):
+    # (average bitrate, vbr) from a Xing/Info header in the first frame
+    # (written by LAME; "Xing" for VBR files, "Info" for CBR), or None if
+    # there isn't one
+    _, sample_rate, channels, _ = header
+    side_info_size = 32 if channels == 2 else 17
+    offset = start + 4 + side_info_size
+    tag = data[offset:offset + 4]
+    if tag not in (b"Xing", b"Info") or offset + 16 > len(data):
+        return None
+
+    flags, = struct.unpack(">I", data[offset + 4:offset + 8])
+    if flags & 0x3 != 0x3:
+        return None  # Missing frame or byte count
+    frames, size = struct.unpack(">II", data[offset + 8:offset + 16])
+    if frames == 0:
+        return None
+
+    duration = frames * _SAMPLES_PER_FRAME / sample_rate
+    return int(size * 8 / duration / 1000), tag == b"Xing"
@@ -0,0 +1,144 @@
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from . import blobs
+
+# Waveform peaks are stored next to each song's mp3 (see blobs.py) as:
+#   "LSPK" + uint32 count + count (min, max) int8 pairs
+# (little-endian), where each pair covers 1/count of the song
+MAGIC = b"LSPK"
+PEAK_COUNT = 1024
+
+def get_peaks_path(userid, songid):
+    return blobs.get_song_path(userid, songid).with_suffix(".peaks")
+
+# Peaks for decoded audio are computed from min/max blocks of at least this
+# many per peak (see PeakAccumulator)
+BLOCKS_PER_PEAK = 16
+
+def compute_peaks(samples, count=PEAK_COUNT):
+    # Min/max of each of count equal-sized buckets of 16-bit samples, scaled
+    # to 8 bits; returns an int8 array of interleaved (min, max) pairs
+    return _reduce(samples, samples, count)
+
+def _reduce(mins, maxs, count, block_size=1, length=None):
+    # Peaks from the min/max of blocks of samples (or the samples themselves),
+    # covering length samples
+    if len(mins) < count:
+        mins = np.pad(mins, (0, count - len(mins)))
+        maxs = np.pad(maxs, (0, count - len(maxs)))
+        length = count
+    elif length is None:
+        length = len(mins) * block_size
+
+    # Start of each peak, rounded to the nearest block
+    starts = np.linspace(0, length, count, endpoint=False)
+    if block_size == 1:
+        starts = starts.astype(np.intp)
+    else:
+        starts = np.rint(starts / block_size).astype(np.intp)
+    peaks = np.empty(count * 2, dtype=np.int8)
+    peaks[0::2] = np.minimum.reduceat(mins, starts) >> 8
+    peaks[1::2] = np.maximum.reduceat(maxs, starts) >> 8
+    return peaks
+
+class PeakAccumulator:
+    # Computes peaks for 16-bit samples added a chunk at a time, without
+    # keeping the samples.  Only the min/max of each block of samples is kept,
+    # and blocks double in size whenever there are more than BLOCKS_PER_PEAK
+    # per peak, so memory doesn't grow with the length of the audio.  Peak
+    # boundaries are rounded to a block, but otherwise match compute_peaks.
+    def __init__(self, count=PEAK_COUNT):
+        self.count = count
+        self.length = 0  # Samples added so far
+        self._block_size = 1
+        self._mins = []  # Arrays of block mins/maxs
+        self._maxs = []
+        self._blocks = 0
+        self._tail = None  # (min, max, samples) of the unfinished last block
+
+    def add(self, samples):
+        self.length += len(samples)
+
+        # Finish the last block first
+        if self._tail:
+            tail_min, tail_max, tail_length = self._tail
+            head = samples[:self._block_size - tail_length]
+            samples = samples[len(head):]
+            if len(head):
+                self._tail = (
+                        min(tail_min, head.min()), max(tail_max, head.max()),
+                        tail_length + len(head))
+            if self._tail[2] == self._block_size:
+                self._append(np.array([self._tail[0]]), np.array([self._tail[1]]))
+                self._tail = None
+
+        full = len(samples) // self._block_size * self._block_size
+        if full:
+            blocks = samples[:full].reshape(-1, self._block_size)
+            self._append(blocks.min(axis=1), blocks.max(axis=1))
+        rest = samples[full:]
+        if len(rest):
+            self._tail = (rest.min(), rest.max(), len(rest))
+
+        while self._blocks >= 2 * BLOCKS_PER_PEAK * self.count:
+            self._merge_blocks()
+
+    def peaks(self):
+        mins, maxs = self._mins, self._maxs
+        if self._tail:
+            mins = mins + [np.array([self._tail[0]])]
+            maxs = maxs + [np.array([self._tail[1]])]
+        if not mins:
+            return _reduce(np.zeros(0, np.int16), np.zeros(0, np.int16), self.count)
+        return _reduce(
+                np.concatenate(mins), np.concatenate(maxs), self.count,
+                self._block_size, self.length)
+
+    def _append(self, mins, maxs):
+        self._mins.append(mins.astype(np.int16))
+        self._maxs.append(maxs.astype(np.int16))
+        self._blocks += len(mins)
+
+    def _merge_blocks(self):
+        # Double the block size by merging pairs of blocks; an odd last block
+        # becomes the first half of the (unfinished) last block
+        mins = np.concatenate(self._mins)
+        maxs = np.concatenate(self._maxs)
+        if len(mins) % 2:
+            last = (mins[-1], maxs[-1], self._block_size)
+            if self._tail:
+                tail_min, tail_max, tail_length = self._tail
+                last = (
+                        min(last[0], tail_min), max(last[1], tail_max),
+                        last[2] + tail_length)
+            self._tail = last
+            mins, maxs = mins[:-1], maxs[:-1]
+
+        self._mins = [mins.reshape(-1, 2).min(axis=1)]
+        self._maxs = [maxs.reshape(-1, 2).max(axis=1)]
+        self._blocks = len(self._mins[0])
+        self._block_size *= 2
+
+def encode(peaks):
+    return MAGIC + struct.pack("<I", len(peaks) // 2) + peaks.tobytes()
+
+def decode(data):
+    # Returns an int8 array of interleaved (min, max) pairs
+    magic, count = struct.unpack_from("<4sI", data)
+    if magic != MAGIC:
+        raise ValueError("Not a peaks file")
+    return np.frombuffer(data, dtype=np.int8, count=count * 2, offset=8)
+
+def write(peaks_path, peaks):
+    # Write peaks (see compute_peaks or PeakAccumulator) to a file
+    data = encode(peaks)
+
+    # Write to a temporary file first so readers never see a partial file
+    peaks_dir = os.path.dirname(peaks_path)
+    with tempfile.NamedTemporaryFile(dir=peaks_dir, suffix=".peaks", delete=False) as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_file.name, peaks_path)
@@ -1,3 +1,4 @@
+import json
 from datetime import datetime, timezone
 
 from flask import abort, Blueprint, get_flashed_messages, session, redirect, \
@@ -160,24 +161,19 @@ def edit_playlist_post(playlistid):
             # Invalid songid(s)
             abort(400)
 
-        for songid in songids:
-            song_data = db.query(
-                    "select * from songs where songid = ?", args=[songid])
-            if not song_data:
-                abort(400)
-
-    # All songs valid - delete old songs
-    db.query("delete from playlist_songs where playlistid = ?", args=[playlistid])
-
-    # Re-add songs with new positions
-    for position, songid in enumerate(songids):
-        print(position, songid)
-        db.query(
+        # One query for all songs (a playlist can list a song more than once)
+        found = db.query(
                 """
-                insert into playlist_songs (playlistid, position, songid)
-                values (?, ?, ?)
+                select count(*) as count from songs
+                where songid in (select value from json_each(?))
                 """,
-                args=[playlistid, position, songid])
+                [json.dumps(songids)],
+                one=True)
+        if found["count"] != len(set(songids)):
+            abort(400)
+
+    # All songs valid - update positions
+    _set_playlist_songs(playlistid, songids)
 
     # Update private, name
     private = int(request.form["type"] == "private")
@@ -190,6 +186,36 @@ def edit_playlist_post(playlistid):
     flash_and_log("Playlist updated", "success")
     return redirect(request.referrer)
 
+def _set_playlist_songs(playlistid, songids):
+    # Make a playlist's songs match songids (in order), only writing the
+    # positions that changed
+    existing = {
+        row["position"]: row["songid"] for row in db.query(
+            "select position, songid from playlist_songs where playlistid = ?",
+            [playlistid])}
+    positions = dict(enumerate(songids))
+    db.query_many(
+            "delete from playlist_songs where playlistid = ? and position = ?",
+            [[playlistid, p] for p in existing if p not in positions])
+    db.query_many(
+            """
+            update playlist_songs set songid = ?
+            where playlistid = ? and position = ?
+            """,
+            [
+                [songid, playlistid, p] for p, songid in positions.items()
+                if p in existing and existing[p] != songid
+            ])
+    db.query_many(
+            """
+            insert into playlist_songs (playlistid, position, songid)
+            values (?, ?, ?)
+            """,
+            [
+                [playlistid, p, songid] for p, songid in positions.items()
+                if p not in existing
+            ])
+
 @bp.get("/playlists/<int:playlistid>")
 def playlists(playlistid):
 
@@ -212,7 +238,24 @@ def playlists(playlistid):
             abort(404)
 
     # Get songs
-    plist_songs = songs.get_for_playlist(playlistid)
+    after = request.args.get("after", None, type=int)
+    page = songs.get_page_for_playlist(playlistid, after)
+    if after is not None:
+        return songs.render_more(page, "playlists.playlists", playlistid=playlistid)
+
+    # The editor needs the whole playlist, but only titles and names
+    edit_songs = []
+    if session.get("userid", None) == plist_data["userid"]:
+        edit_songs = db.query(
+                """
+                SELECT songs.songid, songs.title, song_listing.username
+                FROM playlist_songs
+                INNER JOIN songs ON songs.songid = playlist_songs.songid
+                INNER JOIN song_listing ON song_listing.songid = playlist_songs.songid
+                WHERE playlist_songs.playlistid = ?
+                ORDER BY playlist_songs.position ASC
+                """,
+                [playlistid])
 
     # Get comments
     plist_comments = comments.for_thread(plist_data["threadid"])
@@ -227,5 +270,7 @@ def playlists(playlistid):
             username=plist_data["username"],
             threadid=plist_data["threadid"],
             **users.get_user_colors(plist_data),
-            songs=plist_songs,
+            songs=page.songs,
+            more_url=songs.get_more_url(page, "playlists.playlists", playlistid=playlistid),
+            edit_songs=edit_songs,
             comments=plist_comments)
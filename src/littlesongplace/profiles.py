@@ -1,9 +1,10 @@
-from flask import abort, Blueprint, current_app, flash, send_from_directory, \
+from flask import abort, Blueprint, current_app, flash, \
         redirect, render_template, request, session
 from PIL import Image, UnidentifiedImageError
 
 from . import comments, datadir, db, songs, users
-from .sanitize import sanitize_user_text
+from .sanitize import sanitize_user_text, stored_html
+from .sendfile import send_data_file
 
 bp = Blueprint("profiles", __name__)
 
@@ -19,6 +20,13 @@ def users_profile(profile_username):
         abort(404)
     profile_userid = profile_data["userid"]
 
+    # Get songs for current profile
+    after = request.args.get("after", None)
+    page = songs.get_page_for_userid(profile_userid, after)
+    if after is not None:
+        return songs.render_more(
+                page, "profiles.users_profile", profile_username=profile_username)
+
     # Get playlists for current profile
     userid = session.get("userid", None)
     show_private = userid == profile_userid
@@ -35,16 +43,10 @@ def users_profile(profile_username):
                 """,
                 [profile_userid])
 
-    # Get songs for current profile
-    profile_songs = songs.get_all_for_userid(profile_userid)
-
     # Get comments for current profile
     profile_comments = comments.for_thread(profile_data["threadid"])
 
-    # Sanitize bio
-    profile_bio = ""
-    if profile_data["bio"] is not None:
-        profile_bio = sanitize_user_text(profile_data["bio"])
+    profile_bio = stored_html(profile_data, "bio")
 
     return render_template(
             "profile.html",
@@ -53,7 +55,9 @@ def users_profile(profile_username):
             bio=profile_bio,
             **users.get_user_colors(profile_data),
             playlists=plist_data,
-            songs=profile_songs,
+            songs=page.songs,
+            more_url=songs.get_more_url(
+                page, "profiles.users_profile", profile_username=profile_username),
             comments=profile_comments,
             threadid=profile_data["threadid"],
             user_has_pfp=users.user_has_pfp(profile_userid))
@@ -67,6 +71,7 @@ def edit_profile():
             """
             update users set
                 bio = ?,
+                bio_html = ?,
                 bgcolor = ?,
                 fgcolor = ?,
                 accolor = ?
@@ -74,6 +79,7 @@ def edit_profile():
             """,
             [
                 request.form["bio"],
+                sanitize_user_text(request.form["bio"]),
                 request.form["bgcolor"],
                 request.form["fgcolor"],
                 request.form["accolor"],
@@ -121,5 +127,5 @@ def edit_profile():
 
 @bp.get("/pfp/<int:userid>")
 def pfp(userid):
-    return send_from_directory(datadir.get_user_images_path(userid), "pfp.jpg")
+    return send_data_file(datadir.get_user_images_path(userid), "pfp.jpg")
 
@@ -1,25 +1,120 @@
+import collections
+import hashlib
+import threading
+
 import bleach
+import click
 from bleach.css_sanitizer import CSSSanitizer
+from flask.cli import with_appcontext
+
+from . import db
+
+ALLOWED_TAGS = bleach.sanitizer.ALLOWED_TAGS.union({
+    'area', 'br', 'div', 'img', 'map', 'hr', 'header', 'hgroup', 'table', 'tr', 'td',
+    'th', 'thead', 'tbody', 'span', 'small', 'p', 'q', 'u', 'pre',
+})
+ALLOWED_ATTRIBUTES = {
+    "*": ["style"], "a": ["href", "title"], "abbr": ["title"], "acronym": ["title"],
+    "img": ["src", "alt", "usemap", "width", "height"], "map": ["name"],
+    "area": ["shape", "coords", "alt", "href"]
+}
+ALLOWED_CSS_PROPERTIES = {
+    "font-size", "font-style", "font-variant", "font-family", "font-weight", "color",
+    "background-color", "background-image", "border", "border-color",
+    "border-image", "width", "height"
+}
+
+# Max number of sanitized strings to keep in memory
+CACHE_SIZE = 4096
+
+CacheInfo = collections.namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+# Cleaner instances are not thread-safe, so each thread gets its own
+_local = threading.local()
+
+# The cache is shared by all threads, and only used while holding the lock
+_lock = threading.Lock()
+_cache = collections.OrderedDict()  # Content hash -> sanitized HTML
+_hits = 0
+_misses = 0
+
+def _get_cleaner():
+    cleaner = getattr(_local, "cleaner", None)
+    if cleaner is None:
+        cleaner = bleach.Cleaner(
+                tags=ALLOWED_TAGS,
+                attributes=ALLOWED_ATTRIBUTES,
+                css_sanitizer=CSSSanitizer(allowed_css_properties=ALLOWED_CSS_PROPERTIES))
+        _local.cleaner = cleaner
+    return cleaner
 
 def sanitize_user_text(text):
-        allowed_tags = bleach.sanitizer.ALLOWED_TAGS.union({
-            'area', 'br', 'div', 'img', 'map', 'hr', 'header', 'hgroup', 'table', 'tr', 'td',
-            'th', 'thead', 'tbody', 'span', 'small', 'p', 'q', 'u', 'pre',
-        })
-        allowed_attributes = {
-            "*": ["style"], "a": ["href", "title"], "abbr": ["title"], "acronym": ["title"],
-            "img": ["src", "alt", "usemap", "width", "height"], "map": ["name"],
-            "area": ["shape", "coords", "alt", "href"]
-        }
-        allowed_css_properties = {
-            "font-size", "font-style", "font-variant", "font-family", "font-weight", "color",
-            "background-color", "background-image", "border", "border-color",
-            "border-image", "width", "height"
-        }
-        css_sanitizer = CSSSanitizer(allowed_css_properties=allowed_css_properties)
-        return bleach.clean(
-                text,
-                tags=allowed_tags,
-                attributes=allowed_attributes,
-                css_sanitizer=css_sanitizer)
+    global _hits, _misses
+    key = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    with _lock:
+        if key in _cache:
+            _hits += 1
+            _cache.move_to_end(key)
+            return _cache[key]
+        _misses += 1
+
+    # Sanitize without holding the lock, so threads don't wait on each other
+    html = _get_cleaner().clean(text)
+    with _lock:
+        _cache[key] = html
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)  # Drop least recently used
+    return html
+
+def cache_info():
+    with _lock:
+        return CacheInfo(_hits, _misses, CACHE_SIZE, len(_cache))
+
+def cache_clear():
+    global _hits, _misses
+    with _lock:
+        _cache.clear()
+        _hits = 0
+        _misses = 0
+
+def stored_html(row, column):
+    # Get the sanitized HTML stored alongside a user text column; rows that
+    # were written before it was stored are filled in when the database is
+    # updated (see backfill), but are sanitized on the fly just in case
+    html = row[column + "_html"]
+    if html is None:
+        html = sanitize_user_text(row[column] or "")
+    return html
+
+# (table, primary key, user text column) for all user text rendered as HTML
+_SANITIZED_COLUMNS = [
+    ("songs", "songid", "description"),
+    ("comments", "commentid", "content"),
+    ("users", "userid", "bio"),
+    ("jams", "jamid", "description"),
+    ("jam_events", "eventid", "description"),
+]
+
+def backfill(all_rows=False):
+    # Store sanitized HTML for rows that don't have it yet (or every row);
+    # returns the number of rows updated in each table
+    counts = {}
+    for table, key, column in _SANITIZED_COLUMNS:
+        where = "" if all_rows else f"WHERE {column}_html IS NULL"
+        rows = db.query(f"SELECT {key}, {column} FROM {table} {where}")
+        db.query_many(
+                f"UPDATE {table} SET {column}_html = ? WHERE {key} = ?",
+                [[sanitize_user_text(row[column] or ""), row[key]] for row in rows])
+        db.commit()
+        counts[table] = len(rows)
+    return counts
 
+@click.command("sanitize-db")
+@click.option(
+        "--all", "all_rows", is_flag=True,
+        help="Re-sanitize every row (use after changing the allow-list)")
+@with_appcontext
+def sanitize_db_cmd(all_rows):
+    """Store sanitized HTML for user text that doesn't have it yet"""
+    for table, count in backfill(all_rows).items():
+        click.echo(f"Sanitized {count} rows in {table}")
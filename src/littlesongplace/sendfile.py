@@ -0,0 +1,53 @@
+import os
+from urllib.parse import quote
+
+from flask import abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+
+from . import datadir
+
+# How send_data_file sends files:
+#   None: stream the file from Python (development)
+#   "accel": nginx X-Accel-Redirect to SENDFILE_ACCEL_PREFIX + the file's
+#     path in the data directory (an internal location aliased to DATA_DIR)
+#   "sendfile": X-Sendfile with the file's absolute path (Apache
+#     mod_xsendfile, lighttpd)
+MODES = [None, "accel", "sendfile"]
+
+def init_app(app):
+    app.config.setdefault("SENDFILE_MODE", None)
+    app.config.setdefault("SENDFILE_ACCEL_PREFIX", "/data")
+
+def send_data_file(directory, path, **kwargs):
+    # Send a file from the data directory; takes the same arguments as
+    # send_from_directory.  Behind a proxy, the route only has to find the
+    # file, and the proxy sends the bytes without tying up a server thread.
+    mode = current_app.config["SENDFILE_MODE"]
+    if mode not in MODES:
+        raise ValueError(f"Invalid SENDFILE_MODE: {mode}")
+
+    if mode is None:
+        return send_from_directory(directory, path, **kwargs)
+
+    filepath = safe_join(os.fspath(directory), path)
+    if filepath is None or not os.path.isfile(filepath):
+        abort(404)
+
+    # Conditional and range requests are handled by the proxy
+    response = send_file(
+            filepath, request.environ, conditional=False, etag=False,
+            use_x_sendfile=True, response_class=current_app.response_class,
+            **kwargs)
+
+    # The proxy replaces the (empty) body, so don't claim it has the file's
+    # length
+    del response.headers["Content-Length"]
+
+    if mode == "accel":
+        del response.headers["X-Sendfile"]
+        relpath = os.path.relpath(filepath, datadir.get_data_dir())
+        prefix = current_app.config["SENDFILE_ACCEL_PREFIX"].rstrip("/")
+        response.headers["X-Accel-Redirect"] = prefix + "/" + quote(relpath)
+
+    return response
@@ -1,25 +1,60 @@
 import json
+import math
 import os
 import random
-import shutil
-import subprocess
+import secrets
 import tempfile
-import time
+from collections import namedtuple
 from datetime import datetime, timezone
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional
 
-from flask import Blueprint, current_app, render_template, request, redirect, \
-        session, abort, send_from_directory
-from yt_dlp import YoutubeDL
-from yt_dlp.utils import DownloadError
+from flask import Blueprint, Request, current_app, render_template, request, \
+        redirect, session, abort, jsonify, url_for
 
-from . import comments, colors, datadir, db, users
-from .sanitize import sanitize_user_text
+from . import blobs, comments, colors, datadir, db, peaks, transcode, uploads, users
+from .sanitize import sanitize_user_text, stored_html
+from .sendfile import send_data_file
 from .logutils import flash_and_log
 
 bp = Blueprint("songs", __name__)
 
+# Most IDs get_random probes per song asked for before falling back to
+# shuffling the table, and per query
+RANDOM_PROBE_LIMIT = 20
+RANDOM_PROBE_BATCH = 500
+
+# Songs per page of a song list
+PAGE_SIZE = 50
+
+# One page of a song list, and the cursor for the next page (None on the last
+# page).  Lists are paged by their sort key rather than an offset, so every
+# page is an index range scan no matter how far down it is: (created, songid)
+# for lists by date, encoded as "<created>_<songid>", and position for
+# playlists.
+Page = namedtuple("Page", ["songs", "after"])
+
+# Columns for _from_db: songs with their user, event, tags and collaborators
+# from song_listing (kept up to date by triggers, see schema.sql).  Filter and
+# sort on song_listing's columns to use its indexes.
+_SONG_COLUMNS = """
+        songs.*,
+        song_listing.username,
+        song_listing.fgcolor,
+        song_listing.bgcolor,
+        song_listing.accolor,
+        song_listing.event_title,
+        song_listing.jamid,
+        song_listing.event_enddate,
+        song_listing.tags,
+        song_listing.collaborators
+"""
+_SELECT_SONGS = f"""
+    SELECT {_SONG_COLUMNS}
+    FROM song_listing
+    INNER JOIN songs ON songs.songid = song_listing.songid
+"""
+
 @dataclass
 class Song:
     songid: int
@@ -37,108 +72,228 @@ class Song:
     eventid: Optional[int]
     jamid: Optional[int]
     event_title: Optional[str]
+    status: str
+    # Audio info (see audioinfo.py); None until the song has been analyzed
+    duration: Optional[float]
+    bitrate: Optional[int]
+    sample_rate: Optional[int]
+    size: Optional[int]
+    loudness: Optional[float]
+    hls: bool
+    # Songs loaded together share a batch so their comments can be fetched
+    # with a single query (see get_comments)
+    _batch: list = field(default_factory=list, repr=False, compare=False)
+    _comments: Optional[list] = field(default=None, repr=False, compare=False)
 
     def json(self):
         vs = vars(self)
-        return json.dumps({k: vs[k] for k in vs if not isinstance(vs[k], users.User)})
+        return json.dumps({
+            k: vs[k] for k in vs
+            if not (k.startswith("_") or isinstance(vs[k], users.User))})
 
     def get_comments(self):
-        return comments.for_thread(self.threadid)
+        if self._comments is None:
+            load_comments(self._batch or [self])
+        return self._comments
+
+def load_comments(songs):
+    # Fetch the comments for every song in the list at once
+    songs = [s for s in songs if s._comments is None]
+    thread_comments = comments.for_threads(s.threadid for s in songs)
+    for song in songs:
+        song._comments = thread_comments[song.threadid]
 
 def by_id(songid):
-    songs = _from_db("SELECT * FROM songs_view WHERE songid = ?", [songid])
+    songs = _from_db(_SELECT_SONGS + "WHERE song_listing.songid = ?", [songid])
     if not songs:
         raise ValueError(f"No song for ID {songid:d}")
 
     return songs[0]
 
 def by_threadid(threadid):
-    songs = _from_db("SELECT * FROM songs_view WHERE threadid = ?", [threadid])
+    songs = _from_db(_SELECT_SONGS + "WHERE songs.threadid = ?", [threadid])
     if not songs:
         raise ValueError(f"No song for Thread ID {songid:d}")
 
     return songs[0]
 
-def get_all_for_userid(userid):
-    return _from_db(
-        """
-        SELECT * FROM songs_view
-        WHERE userid = ?
-        ORDER BY created DESC
-        """, [userid])
+def get_page_for_userid(userid, after=None, count=PAGE_SIZE):
+    return _get_page_by_date(
+        "WHERE song_listing.userid = ?", [userid], "song_listing", after, count)
 
-def get_all_for_username(username):
-    return _from_db(
-        """
-        SELECT * FROM songs_view
-        WHERE username = ?
-        ORDER BY created DESC
-        """, [username])
+def get_page_for_username(username, after=None, count=PAGE_SIZE):
+    return _get_page_by_date(
+        "WHERE song_listing.username = ?", [username], "song_listing", after, count)
 
-def get_all_for_username_and_tag(username, tag):
-    return _from_db(
+def get_page_for_username_and_tag(username, tag, after=None, count=PAGE_SIZE):
+    return _get_page_by_date(
         """
-        SELECT * FROM song_tags
-        INNER JOIN songs_view on song_tags.songid = songs_view.songid
-        WHERE (username = ? and tag = ?)
-        ORDER BY created DESC
+        INNER JOIN song_tags ON song_tags.songid = song_listing.songid
+        WHERE (song_listing.username = ? AND song_tags.tag = ?)
         """,
-        [username, tag])
+        [username, tag], "song_tags", after, count)
 
-def get_all_for_tag(tag):
-    return _from_db(
+def get_page_for_tag(tag, after=None, count=PAGE_SIZE):
+    return _get_page_by_date(
         """
-        SELECT * FROM song_tags
-        INNER JOIN songs_view on song_tags.songid = songs_view.songid
-        WHERE tag = ?
-        ORDER BY created DESC
+        INNER JOIN song_tags ON song_tags.songid = song_listing.songid
+        WHERE song_tags.tag = ?
         """,
-        [tag])
+        [tag], "song_tags", after, count)
 
 def get_latest(count):
     return _from_db(
-        """
-        SELECT * FROM songs_view
-        ORDER BY created DESC
+        _SELECT_SONGS + """
+        WHERE song_listing.status = 'ready'
+        ORDER BY song_listing.created DESC
         LIMIT ?
         """,
         [count])
 
 def get_random(count):
+    songids = _sample_songids(count)
     songs = _from_db(
-        """
-        SELECT * FROM songs_view
-        WHERE songid IN (
-            SELECT songid FROM songs
-            ORDER BY random()
-            LIMIT ?
-        )
-        """,
-        [count])
+        _SELECT_SONGS + f"WHERE song_listing.songid IN ({', '.join('?' * len(songids))})",
+        songids)
 
     random.shuffle(songs)
     return songs
 
-def get_for_playlist(playlistid):
-    return _from_db(
-        """
-        SELECT * FROM playlist_songs
-        INNER JOIN songs_view ON playlist_songs.songid = songs_view.songid
-        WHERE playlistid = ?
+def _sample_songids(count):
+    # Pick random IDs between the first and last song, and keep the ones that
+    # belong to ready songs.  IDs are only missing for deleted songs, so this
+    # takes a few primary key lookups per song instead of shuffling the whole
+    # table, and every ready song is equally likely to be picked.
+    # (Separate subqueries, so SQLite reads each end of the primary key
+    # instead of scanning the table)
+    bounds = db.query(
+            """
+            SELECT
+                (SELECT MIN(songid) FROM songs) AS low,
+                (SELECT MAX(songid) FROM songs) AS high
+            """,
+            one=True)
+    if bounds["low"] is None:
+        return []
+    low, high = bounds["low"], bounds["high"]
+
+    # Probe in rounds, sized from the share of IDs that were hits so far, until
+    # there are enough songs or every ID has been probed.  No ID is probed
+    # twice, so the probes are a random subset of IDs, and the songs found are
+    # a random subset of songs.
+    found = set()
+    probed = set()
+    size = high - low + 1
+    while (len(found) < count and len(probed) < size
+            and len(probed) < count * RANDOM_PROBE_LIMIT):
+        hit_rate = len(found) / len(probed) if found else 0.5
+        needed = math.ceil((count - len(found)) / hit_rate * 1.2)
+        probes = _pick_unprobed(low, high, probed, min(needed, RANDOM_PROBE_BATCH))
+        probed.update(probes)
+        rows = db.query(
+                f"""
+                SELECT songid FROM songs
+                WHERE songid IN ({', '.join('?' * len(probes))}) AND status = 'ready'
+                """,
+                probes)
+        found.update(row["songid"] for row in rows)
+
+    if len(found) >= count:
+        return random.sample(sorted(found), count)
+
+    # Too few songs (or too many gaps) to probe for; fill in the rest from a
+    # shuffle of the whole table
+    rows = db.query(
+            f"""
+            SELECT songid FROM songs
+            WHERE status = 'ready' AND songid NOT IN ({', '.join('?' * len(found))})
+            ORDER BY random()
+            LIMIT ?
+            """,
+            [*found, count - len(found)])
+    return [*found, *(row["songid"] for row in rows)]
+
+def _pick_unprobed(low, high, probed, count):
+    # Up to count random IDs from low to high that aren't in probed
+    remaining = high - low + 1 - len(probed)
+    if count * 2 >= remaining:
+        # Mostly probed already; pick from the rest
+        unprobed = [i for i in range(low, high + 1) if i not in probed]
+        return random.sample(unprobed, min(count, remaining))
+
+    picked = set()
+    while len(picked) < count:
+        songid = random.randint(low, high)
+        if songid not in probed:
+            picked.add(songid)
+    return list(picked)
+
+def get_page_for_playlist(playlistid, after=None, count=PAGE_SIZE):
+    rows = db.query(
+        f"""
+        SELECT {_SONG_COLUMNS}, playlist_songs.position
+        FROM playlist_songs
+        INNER JOIN song_listing ON song_listing.songid = playlist_songs.songid
+        INNER JOIN songs ON songs.songid = playlist_songs.songid
+        WHERE playlist_songs.playlistid = ? AND playlist_songs.position > ?
         ORDER BY playlist_songs.position ASC
+        LIMIT ?
         """,
-        [playlistid])
+        [playlistid, -1 if after is None else after, count + 1])
+    return _to_page(rows, count, lambda row: row["position"])
 
 def get_for_event(eventid):
-    return _from_db("SELECT * FROM songs_view WHERE eventid = ?", [eventid])
+    return _from_db(_SELECT_SONGS + "WHERE song_listing.eventid = ?", [eventid])
+
+def get_more_url(page, endpoint, **values):
+    # URL for a song list's "load more" button, or None on the last page
+    if page.after is None:
+        return None
+    return url_for(endpoint, **values, after=page.after)
+
+def render_more(page, endpoint, **values):
+    # Response to "load more": just the songs on the page, and the button for
+    # the next page (see loadMoreSongs in player.js)
+    return render_template(
+        "song-list-page.html",
+        songs=page.songs,
+        more_url=get_more_url(page, endpoint, **values))
+
+def _get_page_by_date(query, args, table, after, count):
+    # Newest songs first; table has the created and songid columns to sort by
+    # (its index must end with them)
+    if after is not None:
+        created, _, songid = after.rpartition("_")
+        try:
+            songid = int(songid)
+        except ValueError:
+            abort(400)
+        query += f" AND ({table}.created, {table}.songid) < (?, ?)"
+        args = [*args, created, songid]
+
+    rows = db.query(
+        _SELECT_SONGS + query + f"""
+        ORDER BY {table}.created DESC, {table}.songid DESC
+        LIMIT ?
+        """,
+        [*args, count + 1])
+    return _to_page(rows, count, lambda row: f"{row['created']}_{row['songid']}")
+
+def _to_page(rows, count, get_cursor):
+    # One extra row is fetched to tell if there's another page
+    after = get_cursor(rows[count - 1]) if len(rows) > count else None
+    return Page(_from_rows(rows[:count]), after)
 
 def _from_db(query, args=()):
-    songs_data = db.query(query, args)
+    return _from_rows(db.query(query, args))
+
+def _from_rows(songs_data):
     songs = []
     for sd in songs_data:
         songid = sd["songid"]
-        song_tags = sd["tags"].split(",") if sd["tags"] else []
-        song_collabs = sd["collaborators"].split(",") if sd["collaborators"] else []
+        # GROUP_CONCAT doesn't promise an order (see song_listing), so sort
+        song_tags = sorted(sd["tags"].split(",")) if sd["tags"] else []
+        song_collabs = sorted(sd["collaborators"].split(",")) if sd["collaborators"] else []
 
         # Song is hidden if it was submitted to an event that hasn't ended yet
         hidden = False
@@ -157,7 +312,7 @@ def _from_db(query, args=()):
             threadid=sd["threadid"],
             username=sd["username"],
             title=sd["title"],
-            description=sanitize_user_text(sd["description"]),
+            description=stored_html(sd, "description"),
             created=created,
             tags=song_tags,
             collaborators=song_collabs,
@@ -166,7 +321,18 @@ def _from_db(query, args=()):
             eventid=sd["eventid"],
             jamid=sd["jamid"],
             event_title=sd["event_title"],
+            status=sd["status"],
+            duration=sd["duration"],
+            bitrate=sd["bitrate"],
+            sample_rate=sd["sample_rate"],
+            size=sd["size"],
+            loudness=sd["loudness"],
+            hls=bool(sd["hls"]),
         ))
+
+    for song in songs:
+        song._batch = songs
+
     return songs
 
 @bp.get("/edit-song")
@@ -289,8 +455,7 @@ def update_song():
     except ValueError:
         abort(400)
 
-    file = request.files["song-file"] if "song-file" in request.files else None
-    yt_url = request.form["song-url"] if "song-url" in request.form else None
+    file, uploadid, yt_url = get_song_source()
     title = request.form["title"]
     description = request.form["description"]
     tags = [t.strip() for t in request.form["tags"].split(",") if t]
@@ -304,55 +469,49 @@ def update_song():
         abort(401)
 
     error = False
-    if file or yt_url:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            passed = convert_song(tmp_file, file, yt_url)
-
-            if passed:
-                # Move file to permanent location
-                user_songs_path = datadir.get_user_songs_path(session["userid"])
-                filepath = user_songs_path / (str(song_data["songid"]) + ".mp3")
-                shutil.move(tmp_file.name, filepath)
-            else:
-                error = True
+    if file or uploadid or yt_url:
+        # The previous audio file stays in place until the new one is converted
+        source = stage_song_file(file, uploadid, yt_url)
+        if source:
+            error = not queue_transcode(songid, source, yt_url)
+        else:
+            error = True
 
     if not error:
         # Update songs table
         db.query(
             """
-            UPDATE songs SET title = ?, description = ?
+            UPDATE songs SET title = ?, description = ?, description_html = ?
             WHERE songid = ?
             """,
-            [title, description, songid])
-
-        # Update song_tags table
-        db.query("delete from song_tags where songid = ?", [songid])
-        for tag in tags:
-            db.query(
-                """
-                INSERT INTO song_tags (tag, songid)
-                VALUES (?, ?)
-                """,
-                [tag, songid])
-
-        # Update song_collaborators table
-        db.query("DELETE FROM song_collaborators WHERE songid = ?", [songid])
-        for collab in collaborators:
-            db.query(
-                """
-                INSERT INTO song_collaborators (name, songid)
-                VALUES (?, ?)
-                """,
-                [collab, songid])
+            [title, description, sanitize_user_text(description), songid])
+
+        # Update song_tags and song_collaborators tables
+        _set_song_rows(songid, "song_tags", "tag", tags)
+        _set_song_rows(songid, "song_collaborators", "name", collaborators)
 
         db.commit()
         flash_and_log(f"Successfully updated '{title}'", "success")
 
     return error
 
+def _set_song_rows(songid, table, column, values):
+    # Make a song's tags or collaborators match values, only deleting and
+    # inserting the ones that changed (each change updates song_listing).
+    # Their order isn't stored; songs list them sorted (see _from_rows).
+    existing = {
+        row[column] for row in db.query(
+            f"SELECT {column} FROM {table} WHERE songid = ?", [songid])}
+    values = dict.fromkeys(values)  # Drop duplicates, keeping the order
+    db.query_many(
+        f"DELETE FROM {table} WHERE songid = ? AND {column} = ?",
+        [[songid, value] for value in existing if value not in values])
+    db.query_many(
+        f"INSERT INTO {table} (songid, {column}) VALUES (?, ?)",
+        [[songid, value] for value in values if value not in existing])
+
 def create_song():
-    file = request.files["song-file"] if "song-file" in request.files else None
-    yt_url = request.form["song-url"] if "song-url" in request.form else None
+    file, uploadid, yt_url = get_song_source()
     title = request.form["title"]
     description = request.form["description"]
     tags = [t.strip() for t in request.form["tags"].split(",") if t]
@@ -362,101 +521,123 @@ def create_song():
     except ValueError:
         abort(400)
 
-    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-        passed = convert_song(tmp_file, file, yt_url)
+    source = stage_song_file(file, uploadid, yt_url)
+    if not source:
+        return True
 
-        if not passed:
-            return True
-        else:
-            # Create comment thread
-            threadid = comments.create_thread(
-                comments.ThreadType.SONG, session["userid"])
-
-            # Create song
-            timestamp = datetime.now(timezone.utc).isoformat()
-            song_data = db.query(
-                """
-                INSERT INTO songs (userid, title, description, created, threadid, eventid)
-                VALUES (?, ?, ?, ?, ?, ?)
-                RETURNING (songid)
-                """,
-                [session["userid"], title, description, timestamp, threadid, eventid],
-                one=True)
+    # Create comment thread
+    threadid = comments.create_thread(
+        comments.ThreadType.SONG, session["userid"])
 
-            # Move file to permanent location
-            user_songs_path = datadir.get_user_songs_path(session["userid"])
-            filepath = user_songs_path / (str(song_data["songid"]) + ".mp3")
-            shutil.move(tmp_file.name, filepath)
-
-            # Assign tags
-            songid = song_data["songid"]
-            for tag in tags:
-                db.query(
-                    "INSERT INTO song_tags (tag, songid) VALUES (?, ?)",
-                    [tag, songid])
-
-            # Assign collaborators
-            for collab in collaborators:
-                db.query(
-                    "INSERT INTO song_collaborators (songid, name) VALUES (?, ?)",
-                    [songid, collab])
+    # Create song (not playable until the transcode job finishes)
+    timestamp = datetime.now(timezone.utc).isoformat()
+    song_data = db.query(
+        """
+        INSERT INTO songs (
+            userid, title, description, description_html, created,
+            threadid, eventid, status)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'pending')
+        RETURNING (songid)
+        """,
+        [
+            session["userid"], title, description,
+            sanitize_user_text(description), timestamp, threadid,
+            eventid,
+        ],
+        one=True)
+
+    # Assign tags and collaborators
+    songid = song_data["songid"]
+    _set_song_rows(songid, "song_tags", "tag", tags)
+    _set_song_rows(songid, "song_collaborators", "name", collaborators)
+
+    if not queue_transcode(songid, source, yt_url):
+        # Conversion already failed, don't keep a song with no audio
+        delete_song_data(songid)
+        db.query("DELETE FROM comment_threads WHERE threadid = ?", [threadid])
+        db.commit()
+        return True
 
-            db.commit()
+    flash_and_log(f"Successfully uploaded '{title}'", "success")
+    return False
 
-            flash_and_log(f"Successfully uploaded '{title}'", "success")
-            return False
+class SongUploadRequest(Request):
+    # Request class for the app; uploaded song files are streamed straight
+    # into the upload staging directory while the form is parsed (instead of
+    # into Werkzeug's own temp files), so they can be queued without copying
+    def _get_file_stream(
+            self, total_content_length, content_type, filename=None,
+            content_length=None):
+        if self.endpoint == "songs.upload_song":
+            return tempfile.NamedTemporaryFile(
+                    dir=datadir.get_upload_staging_path(), prefix="upload-")
+
+        return super()._get_file_stream(
+                total_content_length, content_type, filename, content_length)
+
+def get_song_source():
+    # New audio from the song form, as (file, uploadid, yt_url), where only
+    # one is set: a file uploaded with the form, a finished chunked upload
+    # (see uploads.py), or a YouTube URL to import (or none of them)
+    file = request.files.get("song-file") or None
+    uploadid = request.form.get("upload-id") or None
+    yt_url = request.form.get("song-url") or None
+    if file:
+        return file, None, None
+    elif uploadid:
+        return None, uploadid, None
+    return None, None, yt_url
+
+def stage_song_file(request_file, uploadid, yt_url):
+    # Save the uploaded file into the upload staging directory (YouTube
+    # imports are downloaded there by the transcode job); returns the path to
+    # the file, or None on failure
+    if uploadid:
+        return uploads.finish(uploadid)
+
+    # Random name, so nothing else in the directory uses it
+    staging_path = datadir.get_upload_staging_path()
+    source = str(staging_path / ("staged-" + secrets.token_hex(16)))
 
-def convert_song(tmp_file, request_file, yt_url):
     if request_file:
-        # Get uploaded file
-        request_file.save(tmp_file)
-        tmp_file.close()
-    else:
-        # Import from YouTube
-        tmp_file.close()
-        os.unlink(tmp_file.name)  # Delete file so yt-dlp doesn't complain
-        try:
-            yt_import(tmp_file, yt_url)
-        except DownloadError as ex:
-            current_app.logger.warning(str(ex))
-            flash_and_log(f"Failed to import from YouTube URL: {yt_url}")
-            return False
-
-    # Try to convert with ffmpeg
-    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as out_file:
-        out_file.close()
-        os.remove(out_file.name)
-        start = time.perf_counter()
-        result = subprocess.run([
-                "ffmpeg",
-                "-i", tmp_file.name,
-                "-codec:a", "libmp3lame",
-                "-qscale:a", "2",
-                "-ar", "44100",
-                out_file.name
-            ], stdout=subprocess.PIPE)
-        duration = time.perf_counter() - start
-        current_app.logger.info(f"Ran ffmpeg in {duration:0.6f} s")
-
-        if result.returncode == 0:
-            # Successfully converted file, overwrite original file
-            os.replace(out_file.name, tmp_file.name)
-            return True
-
-        if os.path.exists(out_file.name):
-            os.remove(out_file.name)
-
-    flash_and_log("Invalid audio file", "error")
-    return False
+        stream = request_file.stream
+        if os.path.dirname(getattr(stream, "name", "")) == str(staging_path):
+            # Already streamed into the staging directory; link the file so
+            # it outlives the request (the request's copy is deleted when the
+            # request is closed)
+            stream.flush()
+            os.link(stream.name, source)
+        else:
+            request_file.save(source)
+        return source
+
+    # Import from YouTube
+    if not yt_url:
+        flash_and_log("No audio file or YouTube URL", "error")
+        return None
+    if transcode.get_import_count(session["userid"]) >= current_app.config["YT_IMPORTS_PER_USER"]:
+        flash_and_log("Too many YouTube imports in progress, try again when they've finished", "error")
+        return None
+
+    return source
+
+def queue_transcode(songid, source, yt_url=None):
+    # Commit any pending changes and start converting the source file (or
+    # importing from YouTube); returns False if the conversion has already
+    # failed (always known when TRANSCODE_WORKERS is 0)
+    jobid = transcode.create_job(songid, session["userid"], source, yt_url)
+    db.commit()
+    transcode.submit(jobid)
 
-def yt_import(tmp_file, yt_url):
-    ydl_opts = {
-        'format': 'm4a/bestaudio/best',
-        'outtmpl': tmp_file.name,
-        'logger': current_app.logger,
-    }
-    with YoutubeDL(ydl_opts) as ydl:
-        ydl.download([yt_url])
+    job = transcode.get_job(jobid)
+    if job and job["status"] == transcode.FAILED:
+        if yt_url:
+            flash_and_log(f"Failed to import from YouTube URL: {yt_url}", "error")
+        else:
+            flash_and_log("Invalid audio file", "error")
+        return False
+
+    return True
 
 @bp.get("/delete-song/<int:songid>")
 def delete_song(songid):
@@ -474,18 +655,12 @@ def delete_song(songid):
             f"Failed song delete - {session['username']} - user doesn't own song")
         abort(401)
 
-    # Delete tags, collaborators
-    db.query("DELETE FROM song_tags WHERE songid = ?", [songid])
-    db.query("DELETE FROM song_collaborators WHERE songid = ?", [songid])
-
-    # Delete song database entry
-    db.query("DELETE FROM songs WHERE songid = ?", [songid])
-    db.commit()
-
-    # Delete song file from disk
-    songpath = datadir.get_user_songs_path(session["userid"]) / (str(songid) + ".mp3")
-    if songpath.exists():
-        os.remove(songpath)
+    # Delete song files from disk (shared files are kept until no song uses
+    # them)
+    if song_data["blob"] is None:
+        blobs.remove_files(blobs.get_audio_path(session["userid"], songid, None))
+    delete_song_data(songid)
+    blobs.collect()
 
     current_app.logger.info(
         f"{session['username']} deleted song: {song_data['title']}")
@@ -493,6 +668,15 @@ def delete_song(songid):
 
     return redirect(f"/users/{session['username']}")
 
+def delete_song_data(songid):
+    # Delete tags, collaborators, transcode jobs
+    db.query("DELETE FROM song_tags WHERE songid = ?", [songid])
+    db.query("DELETE FROM song_collaborators WHERE songid = ?", [songid])
+    transcode.delete_jobs(songid)
+
+    # Delete song database entry
+    db.query("DELETE FROM songs WHERE songid = ?", [songid])
+
 @bp.get("/song/<int:userid>/<int:songid>")
 def song(userid, songid):
     action = request.args.get("action", None)
@@ -509,13 +693,85 @@ def song(userid, songid):
                         song=song,
                         **users.get_user_colors(userid))
             else:  # download
-                return send_from_directory(
-                    datadir.get_user_songs_path(userid), str(songid) + ".mp3", as_attachment=True, download_name=song.title + ".mp3")
+                mp3_path = blobs.get_song_path(userid, songid)
+                return send_data_file(
+                    mp3_path.parent, mp3_path.name, as_attachment=True, download_name=song.title + ".mp3")
         except ValueError:
             abort(404)
     else:
-        return send_from_directory(
-            datadir.get_user_songs_path(userid), str(songid) + ".mp3")
+        if requested_rendition() == "opus":
+            opus_path = transcode.get_opus_path(userid, songid)
+            if opus_path.exists():
+                response = send_data_file(
+                    opus_path.parent, opus_path.name, mimetype="audio/webm")
+                response.vary.add("Accept")
+                return response
+
+        # Fall back to the mp3 if the rendition hasn't been made yet
+        mp3_path = blobs.get_song_path(userid, songid)
+        response = send_data_file(mp3_path.parent, mp3_path.name)
+        response.vary.add("Accept")
+        return response
+
+def requested_rendition():
+    # The player asks for the small Opus rendition with ?rendition=opus on
+    # slow connections; other clients get it if they can't play mp3s
+    rendition = request.args.get("rendition", None)
+    if rendition in ["mp3", "opus"]:
+        return rendition
+
+    accept = request.accept_mimetypes
+    if accept and not accept["audio/mpeg"] and accept["audio/webm"]:
+        return "opus"
+
+    return "mp3"
+
+@bp.get("/song/<int:userid>/<int:songid>/hls/<name>")
+def song_hls(userid, songid, name):
+    # HLS manifest and segments for long songs (see transcode.py)
+    if name == transcode.HLS_MANIFEST:
+        mimetype = "application/vnd.apple.mpegurl"
+    else:
+        mimetype = "video/mp2t"
+
+    return send_data_file(
+            transcode.get_hls_path(userid, songid), name, mimetype=mimetype)
+
+@bp.get("/song/<int:userid>/<int:songid>/peaks")
+def song_peaks(userid, songid):
+    # Waveform peaks (see peaks.py); served with an ETag, so clients only
+    # download them again when the song's audio changes
+    peaks_path = peaks.get_peaks_path(userid, songid)
+    return send_data_file(
+            peaks_path.parent, peaks_path.name,
+            mimetype="application/octet-stream")
+
+@bp.get("/song/<int:songid>/details")
+def song_details(songid):
+    # HTML fragment with the song's description, tags, and comments; song
+    # lists only include a placeholder, and load this when a song is expanded
+    try:
+        song = by_id(songid)
+    except ValueError:
+        abort(404)
+
+    return render_template("song-details.html", song=song)
+
+@bp.get("/song/<int:songid>/status")
+def song_status(songid):
+    # Progress of the song's latest transcode job, polled by the song page
+    song_data = db.query(
+            "SELECT status FROM songs WHERE songid = ?", [songid], expect_one=True)
+
+    job = transcode.get_latest_job(songid)
+    position = None
+    if job and job["status"] == transcode.PENDING:
+        position = transcode.get_queue_position(job["jobid"])
+
+    return jsonify(
+        status=song_data["status"],
+        job=job["status"] if job else None,
+        position=position)
 
 @bp.get("/songs")
 def view_songs():
@@ -526,19 +782,24 @@ def view_songs():
     if user:
         page_colors = users.get_user_colors(user)
 
+    after = request.args.get("after", None)
     if tag and user:
-        page_songs = get_all_for_username_and_tag(user, tag)
+        page = get_page_for_username_and_tag(user, tag, after)
     elif tag:
-        page_songs = get_all_for_tag(tag)
+        page = get_page_for_tag(tag, after)
     elif user:
-        page_songs = get_all_for_username(user)
+        page = get_page_for_username(user, after)
     else:
-        page_songs = get_random(50)
+        page = Page(get_random(PAGE_SIZE), None)
+
+    if after is not None:
+        return render_more(page, "songs.view_songs", tag=tag, user=user)
 
     return render_template(
         "songs-by-tag.html",
         user=user,
         tag=tag,
-        songs=page_songs,
+        songs=page.songs,
+        more_url=get_more_url(page, "songs.view_songs", tag=tag, user=user),
         **page_colors)
 
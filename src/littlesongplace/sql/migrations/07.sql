@@ -0,0 +1,10 @@
+-- Sanitized HTML is stored when user text is written (existing rows are
+-- filled when the app starts, see sanitize.backfill)
+ALTER TABLE songs ADD COLUMN description_html TEXT;
+ALTER TABLE comments ADD COLUMN content_html TEXT;
+ALTER TABLE users ADD COLUMN bio_html TEXT;
+ALTER TABLE jams ADD COLUMN description_html TEXT;
+ALTER TABLE jam_events ADD COLUMN description_html TEXT;
+
+PRAGMA user_version = 7;
+
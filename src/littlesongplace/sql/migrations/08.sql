@@ -0,0 +1,19 @@
+-- Uploaded audio is converted by background transcode jobs; songs stay
+-- 'pending' until their first job finishes
+ALTER TABLE songs ADD COLUMN status TEXT NOT NULL DEFAULT 'ready';
+
+CREATE TABLE transcode_jobs (
+    jobid INTEGER PRIMARY KEY,
+    songid INTEGER NOT NULL,
+    userid INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created TEXT NOT NULL,
+    pid INTEGER,
+    FOREIGN KEY(songid) REFERENCES songs(songid)
+);
+CREATE INDEX idx_transcode_jobs_by_status ON transcode_jobs(status);
+CREATE INDEX idx_transcode_jobs_by_songid ON transcode_jobs(songid);
+
+PRAGMA user_version = 8;
+
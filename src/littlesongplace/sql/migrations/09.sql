@@ -0,0 +1,10 @@
+-- Audio info is stored when songs are transcoded (fill existing rows with the
+-- analyze-songs command)
+ALTER TABLE songs ADD COLUMN duration REAL;
+ALTER TABLE songs ADD COLUMN bitrate INTEGER;
+ALTER TABLE songs ADD COLUMN sample_rate INTEGER;
+ALTER TABLE songs ADD COLUMN size INTEGER;
+ALTER TABLE songs ADD COLUMN loudness REAL;
+
+PRAGMA user_version = 9;
+
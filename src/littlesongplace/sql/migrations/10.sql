@@ -0,0 +1,11 @@
+-- Songs get a small Opus rendition; existing songs are backfilled by
+-- background transcode jobs (which run after any uploads)
+ALTER TABLE transcode_jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'upload';
+
+INSERT INTO transcode_jobs (songid, userid, source, status, created, kind)
+SELECT songid, userid, '', 'pending', strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'), 'opus'
+FROM songs
+WHERE status = 'ready';
+
+PRAGMA user_version = 10;
+
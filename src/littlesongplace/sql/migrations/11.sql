@@ -0,0 +1,6 @@
+-- Long songs are split into HLS segments (queue existing songs with the
+-- queue-hls command)
+ALTER TABLE songs ADD COLUMN hls INTEGER NOT NULL DEFAULT 0;
+
+PRAGMA user_version = 11;
+
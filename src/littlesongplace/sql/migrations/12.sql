@@ -0,0 +1,33 @@
+-- Song audio is stored by content in blobs (see blobs.py); existing songs
+-- keep their files until their audio is replaced
+CREATE TABLE blobs (
+    blob TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL
+);
+CREATE INDEX idx_blobs_by_refcount ON blobs(refcount);
+
+ALTER TABLE songs ADD COLUMN blob TEXT;
+CREATE INDEX idx_songs_by_blob ON songs(blob);
+
+CREATE TRIGGER trg_insert_song_blob
+AFTER INSERT ON songs FOR EACH ROW WHEN NEW.blob IS NOT NULL
+BEGIN
+    UPDATE blobs SET refcount = refcount + 1 WHERE blob = NEW.blob;
+END;
+
+CREATE TRIGGER trg_update_song_blob
+AFTER UPDATE OF blob ON songs FOR EACH ROW WHEN NEW.blob IS NOT OLD.blob
+BEGIN
+    UPDATE blobs SET refcount = refcount - 1 WHERE blob = OLD.blob;
+    UPDATE blobs SET refcount = refcount + 1 WHERE blob = NEW.blob;
+END;
+
+CREATE TRIGGER trg_delete_song_blob
+AFTER DELETE ON songs FOR EACH ROW WHEN OLD.blob IS NOT NULL
+BEGIN
+    UPDATE blobs SET refcount = refcount - 1 WHERE blob = OLD.blob;
+END;
+
+PRAGMA user_version = 12;
+
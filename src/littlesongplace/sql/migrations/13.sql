@@ -0,0 +1,17 @@
+-- YouTube imports are downloaded by transcode jobs, and cached by video ID
+ALTER TABLE transcode_jobs ADD COLUMN url TEXT;
+
+CREATE TABLE youtube_cache (
+    videoid TEXT PRIMARY KEY,
+    blob TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+
+CREATE TRIGGER trg_delete_blob_youtube_cache
+AFTER DELETE ON blobs FOR EACH ROW
+BEGIN
+    DELETE FROM youtube_cache WHERE blob = OLD.blob;
+END;
+
+PRAGMA user_version = 13;
+
@@ -0,0 +1,21 @@
+-- Resumable chunked uploads (see uploads.py)
+CREATE TABLE uploads (
+    uploadid TEXT PRIMARY KEY,
+    userid INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    FOREIGN KEY(userid) REFERENCES users(userid)
+);
+CREATE INDEX idx_uploads_by_updated ON uploads(updated);
+CREATE INDEX idx_uploads_by_userid ON uploads(userid);
+
+CREATE TABLE upload_chunks (
+    uploadid TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    PRIMARY KEY(uploadid, chunk),
+    FOREIGN KEY(uploadid) REFERENCES uploads(uploadid)
+);
+
+PRAGMA user_version = 14;
+
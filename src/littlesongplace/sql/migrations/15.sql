@@ -0,0 +1,141 @@
+DROP VIEW IF EXISTS songs_view;
+
+-- Songs' user, event, tags and collaborators, kept up to date by triggers so
+-- song lists don't have to join and aggregate them on every page (see
+-- songs._from_db).  userid, created, status and eventid are copies from
+-- songs, for the indexes.  tags and collaborators are comma-separated, in no
+-- particular order (GROUP_CONCAT); songs._from_rows sorts them.
+CREATE TABLE song_listing (
+    songid INTEGER PRIMARY KEY,
+    userid INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    status TEXT NOT NULL,
+    eventid INTEGER,
+    username TEXT NOT NULL,
+    fgcolor TEXT,
+    bgcolor TEXT,
+    accolor TEXT,
+    event_title TEXT,
+    jamid INTEGER,
+    event_enddate TEXT,
+    tags TEXT,
+    collaborators TEXT,
+    FOREIGN KEY(songid) REFERENCES songs(songid)
+);
+CREATE INDEX idx_song_listing_by_status ON song_listing(status, created);
+CREATE INDEX idx_song_listing_by_user ON song_listing(userid, created);
+CREATE INDEX idx_song_listing_by_username ON song_listing(username, created);
+CREATE INDEX idx_song_listing_by_eventid ON song_listing(eventid);
+
+CREATE TRIGGER trg_insert_song_listing
+AFTER INSERT ON songs FOR EACH ROW
+BEGIN
+    INSERT OR REPLACE INTO song_listing
+    SELECT
+        NEW.songid, NEW.userid, NEW.created, NEW.status, NEW.eventid,
+        users.username, users.fgcolor, users.bgcolor, users.accolor,
+        jam_events.title, jam_events.jamid, jam_events.enddate,
+        (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = NEW.songid),
+        (SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = NEW.songid)
+    FROM users
+    LEFT JOIN jam_events ON jam_events.eventid = NEW.eventid
+    WHERE users.userid = NEW.userid;
+END;
+
+CREATE TRIGGER trg_update_song_listing
+AFTER UPDATE OF userid, created, status, eventid ON songs FOR EACH ROW
+BEGIN
+    INSERT OR REPLACE INTO song_listing
+    SELECT
+        NEW.songid, NEW.userid, NEW.created, NEW.status, NEW.eventid,
+        users.username, users.fgcolor, users.bgcolor, users.accolor,
+        jam_events.title, jam_events.jamid, jam_events.enddate,
+        (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = NEW.songid),
+        (SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = NEW.songid)
+    FROM users
+    LEFT JOIN jam_events ON jam_events.eventid = NEW.eventid
+    WHERE users.userid = NEW.userid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing
+AFTER DELETE ON songs FOR EACH ROW
+BEGIN
+    DELETE FROM song_listing WHERE songid = OLD.songid;
+END;
+
+CREATE TRIGGER trg_insert_song_listing_tag
+AFTER INSERT ON song_tags FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET tags = (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = NEW.songid)
+    WHERE songid = NEW.songid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing_tag
+AFTER DELETE ON song_tags FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET tags = (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = OLD.songid)
+    WHERE songid = OLD.songid;
+END;
+
+CREATE TRIGGER trg_insert_song_listing_collaborator
+AFTER INSERT ON song_collaborators FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET collaborators = (
+        SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = NEW.songid)
+    WHERE songid = NEW.songid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing_collaborator
+AFTER DELETE ON song_collaborators FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET collaborators = (
+        SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = OLD.songid)
+    WHERE songid = OLD.songid;
+END;
+
+CREATE TRIGGER trg_update_song_listing_user
+AFTER UPDATE OF username, fgcolor, bgcolor, accolor ON users FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET
+        username = NEW.username,
+        fgcolor = NEW.fgcolor,
+        bgcolor = NEW.bgcolor,
+        accolor = NEW.accolor
+    WHERE userid = NEW.userid;
+END;
+
+CREATE TRIGGER trg_update_song_listing_event
+AFTER UPDATE OF title, jamid, enddate ON jam_events FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET event_title = NEW.title, jamid = NEW.jamid, event_enddate = NEW.enddate
+    WHERE eventid = NEW.eventid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing_event
+AFTER DELETE ON jam_events FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET event_title = NULL, jamid = NULL, event_enddate = NULL
+    WHERE eventid = OLD.eventid;
+END;
+
+-- Build the listing for existing songs
+INSERT INTO song_listing
+    SELECT
+        songs.songid, songs.userid, songs.created, songs.status, songs.eventid,
+        users.username, users.fgcolor, users.bgcolor, users.accolor,
+        jam_events.title, jam_events.jamid, jam_events.enddate,
+        (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = songs.songid),
+        (SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = songs.songid)
+    FROM songs
+    INNER JOIN users ON users.userid = songs.userid
+    LEFT JOIN jam_events ON jam_events.eventid = songs.eventid;
+
+PRAGMA user_version = 15;
+
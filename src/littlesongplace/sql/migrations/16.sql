@@ -0,0 +1,17 @@
+ALTER TABLE song_tags ADD COLUMN created TEXT;
+UPDATE song_tags SET created = (SELECT created FROM songs WHERE songs.songid = song_tags.songid);
+DROP INDEX idx_song_tags_tag;
+CREATE INDEX idx_song_tags_by_created ON song_tags(tag, created, songid);
+
+-- Copy of the song's created time, so tag pages can be paged through in the
+-- index (see songs.get_page_for_tag)
+CREATE TRIGGER trg_insert_song_tag_created
+AFTER INSERT ON song_tags FOR EACH ROW
+BEGIN
+    UPDATE song_tags
+    SET created = (SELECT created FROM songs WHERE songid = NEW.songid)
+    WHERE songid = NEW.songid AND tag = NEW.tag;
+END;
+
+PRAGMA user_version = 16;
+
@@ -5,6 +5,7 @@ CREATE TABLE users (
     username TEXT UNIQUE NOT NULL,
     password BLOB NOT NULL,
     bio TEXT,
+    bio_html TEXT,
     activitytime TEXT,
     bgcolor TEXT,
     fgcolor TEXT,
@@ -13,6 +14,14 @@ CREATE TABLE users (
 );
 CREATE INDEX users_by_name ON users(username);
 
+DROP TABLE IF EXISTS blobs;
+CREATE TABLE blobs (
+    blob TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL
+);
+CREATE INDEX idx_blobs_by_refcount ON blobs(refcount);
+
 DROP TABLE IF EXISTS songs;
 CREATE TABLE songs (
     songid INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -20,13 +29,92 @@ CREATE TABLE songs (
     userid INTEGER NOT NULL,
     title TEXT NOT NULL,
     description TEXT,
+    description_html TEXT,
     threadid INTEGER,
     eventid INTEGER,
+    status TEXT NOT NULL DEFAULT 'ready',
+    duration REAL,
+    bitrate INTEGER,
+    sample_rate INTEGER,
+    size INTEGER,
+    loudness REAL,
+    hls INTEGER NOT NULL DEFAULT 0,
+    blob TEXT,
     FOREIGN KEY(userid) REFERENCES users(userid),
     FOREIGN KEY(eventid) REFERENCES jam_events(eventid)
 );
 CREATE INDEX idx_songs_by_user ON songs(userid);
 CREATE INDEX idx_songs_by_eventid ON songs(eventid);
+CREATE INDEX idx_songs_by_blob ON songs(blob);
+
+-- Count the songs that use each blob (see blobs.py)
+CREATE TRIGGER trg_insert_song_blob
+AFTER INSERT ON songs FOR EACH ROW WHEN NEW.blob IS NOT NULL
+BEGIN
+    UPDATE blobs SET refcount = refcount + 1 WHERE blob = NEW.blob;
+END;
+
+CREATE TRIGGER trg_update_song_blob
+AFTER UPDATE OF blob ON songs FOR EACH ROW WHEN NEW.blob IS NOT OLD.blob
+BEGIN
+    UPDATE blobs SET refcount = refcount - 1 WHERE blob = OLD.blob;
+    UPDATE blobs SET refcount = refcount + 1 WHERE blob = NEW.blob;
+END;
+
+CREATE TRIGGER trg_delete_song_blob
+AFTER DELETE ON songs FOR EACH ROW WHEN OLD.blob IS NOT NULL
+BEGIN
+    UPDATE blobs SET refcount = refcount - 1 WHERE blob = OLD.blob;
+END;
+
+DROP TABLE IF EXISTS transcode_jobs;
+CREATE TABLE transcode_jobs (
+    jobid INTEGER PRIMARY KEY,
+    songid INTEGER NOT NULL,
+    userid INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created TEXT NOT NULL,
+    pid INTEGER,
+    kind TEXT NOT NULL DEFAULT 'upload',
+    url TEXT,
+    FOREIGN KEY(songid) REFERENCES songs(songid)
+);
+CREATE INDEX idx_transcode_jobs_by_status ON transcode_jobs(status);
+CREATE INDEX idx_transcode_jobs_by_songid ON transcode_jobs(songid);
+
+DROP TABLE IF EXISTS upload_chunks;
+DROP TABLE IF EXISTS uploads;
+CREATE TABLE uploads (
+    uploadid TEXT PRIMARY KEY,
+    userid INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    updated TEXT NOT NULL,
+    FOREIGN KEY(userid) REFERENCES users(userid)
+);
+CREATE INDEX idx_uploads_by_updated ON uploads(updated);
+CREATE INDEX idx_uploads_by_userid ON uploads(userid);
+
+CREATE TABLE upload_chunks (
+    uploadid TEXT NOT NULL,
+    chunk INTEGER NOT NULL,
+    PRIMARY KEY(uploadid, chunk),
+    FOREIGN KEY(uploadid) REFERENCES uploads(uploadid)
+);
+
+DROP TABLE IF EXISTS youtube_cache;
+CREATE TABLE youtube_cache (
+    videoid TEXT PRIMARY KEY,
+    blob TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+
+CREATE TRIGGER trg_delete_blob_youtube_cache
+AFTER DELETE ON blobs FOR EACH ROW
+BEGIN
+    DELETE FROM youtube_cache WHERE blob = OLD.blob;
+END;
 
 DROP TABLE IF EXISTS song_collaborators;
 CREATE TABLE song_collaborators (
@@ -40,10 +128,21 @@ DROP TABLE IF EXISTS song_tags;
 CREATE TABLE song_tags (
     songid INTEGER NOT NULL,
     tag TEXT NOT NULL,
+    created TEXT,
     FOREIGN KEY(songid) REFERENCES songs(songid),
     PRIMARY KEY(songid, tag)
 );
-CREATE INDEX idx_song_tags_tag ON song_tags(tag);
+CREATE INDEX idx_song_tags_by_created ON song_tags(tag, created, songid);
+
+-- Copy of the song's created time, so tag pages can be paged through in the
+-- index (see songs.get_page_for_tag)
+CREATE TRIGGER trg_insert_song_tag_created
+AFTER INSERT ON song_tags FOR EACH ROW
+BEGIN
+    UPDATE song_tags
+    SET created = (SELECT created FROM songs WHERE songid = NEW.songid)
+    WHERE songid = NEW.songid AND tag = NEW.tag;
+END;
  
 DROP TABLE IF EXISTS playlists;
 CREATE TABLE playlists (
@@ -108,6 +207,7 @@ CREATE TABLE comments (
     replytoid INTEGER,
     created TEXT NOT NULL,
     content TEXT NOT NULL,
+    content_html TEXT,
     FOREIGN KEY(threadid) REFERENCES comment_threads(threadid) ON DELETE CASCADE,
     FOREIGN KEY(userid) REFERENCES users(userid) ON DELETE CASCADE
 );
@@ -141,6 +241,7 @@ CREATE TABLE jams (
     created TEXT NOT NULL,
     title TEXT NOT NULL,
     description TEXT,
+    description_html TEXT,
     FOREIGN KEY(ownerid) REFERENCES users(userid)
 );
 
@@ -154,9 +255,137 @@ CREATE TABLE jam_events(
     startdate TEXT,
     enddate TEXT,
     description TEXT, -- Hidden until startdate
+    description_html TEXT,
     FOREIGN KEY(jamid) REFERENCES jams(jamid),
     FOREIGN KEY(threadid) REFERENCES comment_threads(threadid)
 );
 
-PRAGMA user_version = 5;
+DROP TABLE IF EXISTS song_listing;
+-- Songs' user, event, tags and collaborators, kept up to date by triggers so
+-- song lists don't have to join and aggregate them on every page (see
+-- songs._from_db).  userid, created, status and eventid are copies from
+-- songs, for the indexes.  tags and collaborators are comma-separated, in no
+-- particular order (GROUP_CONCAT); songs._from_rows sorts them.
+CREATE TABLE song_listing (
+    songid INTEGER PRIMARY KEY,
+    userid INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    status TEXT NOT NULL,
+    eventid INTEGER,
+    username TEXT NOT NULL,
+    fgcolor TEXT,
+    bgcolor TEXT,
+    accolor TEXT,
+    event_title TEXT,
+    jamid INTEGER,
+    event_enddate TEXT,
+    tags TEXT,
+    collaborators TEXT,
+    FOREIGN KEY(songid) REFERENCES songs(songid)
+);
+-- (songid is the rowid, so it's also the last column of each index)
+CREATE INDEX idx_song_listing_by_status ON song_listing(status, created);
+CREATE INDEX idx_song_listing_by_user ON song_listing(userid, created);
+CREATE INDEX idx_song_listing_by_username ON song_listing(username, created);
+CREATE INDEX idx_song_listing_by_eventid ON song_listing(eventid);
+
+CREATE TRIGGER trg_insert_song_listing
+AFTER INSERT ON songs FOR EACH ROW
+BEGIN
+    INSERT OR REPLACE INTO song_listing
+    SELECT
+        NEW.songid, NEW.userid, NEW.created, NEW.status, NEW.eventid,
+        users.username, users.fgcolor, users.bgcolor, users.accolor,
+        jam_events.title, jam_events.jamid, jam_events.enddate,
+        (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = NEW.songid),
+        (SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = NEW.songid)
+    FROM users
+    LEFT JOIN jam_events ON jam_events.eventid = NEW.eventid
+    WHERE users.userid = NEW.userid;
+END;
+
+CREATE TRIGGER trg_update_song_listing
+AFTER UPDATE OF userid, created, status, eventid ON songs FOR EACH ROW
+BEGIN
+    INSERT OR REPLACE INTO song_listing
+    SELECT
+        NEW.songid, NEW.userid, NEW.created, NEW.status, NEW.eventid,
+        users.username, users.fgcolor, users.bgcolor, users.accolor,
+        jam_events.title, jam_events.jamid, jam_events.enddate,
+        (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = NEW.songid),
+        (SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = NEW.songid)
+    FROM users
+    LEFT JOIN jam_events ON jam_events.eventid = NEW.eventid
+    WHERE users.userid = NEW.userid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing
+AFTER DELETE ON songs FOR EACH ROW
+BEGIN
+    DELETE FROM song_listing WHERE songid = OLD.songid;
+END;
+
+CREATE TRIGGER trg_insert_song_listing_tag
+AFTER INSERT ON song_tags FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET tags = (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = NEW.songid)
+    WHERE songid = NEW.songid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing_tag
+AFTER DELETE ON song_tags FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET tags = (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = OLD.songid)
+    WHERE songid = OLD.songid;
+END;
+
+CREATE TRIGGER trg_insert_song_listing_collaborator
+AFTER INSERT ON song_collaborators FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET collaborators = (
+        SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = NEW.songid)
+    WHERE songid = NEW.songid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing_collaborator
+AFTER DELETE ON song_collaborators FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET collaborators = (
+        SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = OLD.songid)
+    WHERE songid = OLD.songid;
+END;
+
+CREATE TRIGGER trg_update_song_listing_user
+AFTER UPDATE OF username, fgcolor, bgcolor, accolor ON users FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET
+        username = NEW.username,
+        fgcolor = NEW.fgcolor,
+        bgcolor = NEW.bgcolor,
+        accolor = NEW.accolor
+    WHERE userid = NEW.userid;
+END;
+
+CREATE TRIGGER trg_update_song_listing_event
+AFTER UPDATE OF title, jamid, enddate ON jam_events FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET event_title = NEW.title, jamid = NEW.jamid, event_enddate = NEW.enddate
+    WHERE eventid = NEW.eventid;
+END;
+
+CREATE TRIGGER trg_delete_song_listing_event
+AFTER DELETE ON jam_events FOR EACH ROW
+BEGIN
+    UPDATE song_listing
+    SET event_title = NULL, jamid = NULL, event_enddate = NULL
+    WHERE eventid = OLD.eventid;
+END;
+
+PRAGMA user_version = 16;
 
@@ -1,3 +1,5 @@
-DROP VIEW songs_view;
-PRAGMA user_version = 5;
-
+DROP TRIGGER trg_insert_song_tag_created;
+DROP INDEX idx_song_tags_by_created;
+CREATE INDEX idx_song_tags_tag ON song_tags(tag);
+ALTER TABLE song_tags DROP COLUMN created;
+PRAGMA user_version = 15;
@@ -5,19 +5,7 @@ document.addEventListener("DOMContentLoaded", async (e) => {
         window.history.replaceState(document.documentElement.outerHTML, "");
     }
 
-    // Handle link clicks with AJAX
-    document.querySelectorAll("a").forEach((anchor) => {
-        anchor.removeEventListener("click", onLinkClick);
-        if (!anchor.download) {
-            anchor.addEventListener("click", onLinkClick);
-        }
-    });
-
-    // Handle form submissions with AJAX
-    document.querySelectorAll("form").forEach((form) => {
-        form.removeEventListener("submit", onFormSubmit);
-        form.addEventListener("submit", onFormSubmit);
-    });
+    addAjaxHandlers(document);
 
     // Update colors
     var mainDiv = document.getElementById("main");
@@ -48,6 +36,25 @@ document.addEventListener("DOMContentLoaded", async (e) => {
     });
 });
 
+function addAjaxHandlers(root) {
+    // Handle link clicks with AJAX
+    root.querySelectorAll("a").forEach((anchor) => {
+        anchor.removeEventListener("click", onLinkClick);
+        if (!anchor.download) {
+            anchor.addEventListener("click", onLinkClick);
+        }
+    });
+
+    // Handle form submissions with AJAX
+    root.querySelectorAll("form").forEach((form) => {
+        form.removeEventListener("submit", onFormSubmit);
+        form.addEventListener("submit", onFormSubmit);
+    });
+}
+
+// Ask the server to only send the page body and page info (see base.html)
+const m_fragmentHeaders = {"X-LSP-Fragment": "1"};
+
 function onLinkClick(event) {
     if (event.defaultPrevented) {
         return;
@@ -56,7 +63,7 @@ function onLinkClick(event) {
     if (urlIsOnSameSite(targetUrl)) {
         event.preventDefault();
         event.stopPropagation();
-        fetch(targetUrl, {redirect: "follow"}).then(handleAjaxResponse).catch((err) => console.log(err));
+        fetch(targetUrl, {redirect: "follow", headers: m_fragmentHeaders}).then(handleAjaxResponse).catch((err) => console.log(err));
     }
 }
 
@@ -69,7 +76,7 @@ function onFormSubmit(event) {
         event.preventDefault();
         event.stopPropagation();
         var formData = new FormData(event.target);
-        fetch(targetUrl, {redirect: "follow", body: formData, method: event.target.method})
+        fetch(targetUrl, {redirect: "follow", headers: m_fragmentHeaders, body: formData, method: event.target.method})
             .then(handleAjaxResponse)
             .catch((err) => window.location.reload());  // Failed to submit form; just reload page (should never happen)
     }
@@ -137,24 +144,46 @@ function updatePageState(data) {
     // Replace the contents of the current page with those from data
 
     if (!data) {
-        fetch(window.location.href, {redirect: "follow"}).then(handleAjaxResponse).catch((err) => window.location.reload());
+        fetch(window.location.href, {redirect: "follow", headers: m_fragmentHeaders}).then(handleAjaxResponse).catch((err) => window.location.reload());
         return;
     }
     var parser = new DOMParser();
     data = parser.parseFromString(data, "text/html");
 
+    var newMainDiv, newFlashes, newTitle;
+    var pageData = data.getElementById("page-data");
+    if (pageData) {
+        // Page fragment - page info is in a JSON envelope, followed by the
+        // contents of the main div
+        var page = JSON.parse(pageData.textContent);
+        newMainDiv = document.createElement("div");
+        newMainDiv.className = "main";
+        newMainDiv.id = "main";
+        newMainDiv.dataset.bgcolor = page.bgcolor;
+        newMainDiv.dataset.fgcolor = page.fgcolor;
+        newMainDiv.dataset.accolor = page.accolor;
+        newMainDiv.dataset.username = page.username || "";
+        newMainDiv.replaceChildren(...data.body.childNodes);
+        newFlashes = createFlashes(page.flashes);
+        newTitle = page.title;
+    }
+    else {
+        // Full page (initial page load)
+        newMainDiv = data.getElementById("main");
+        newFlashes = data.getElementById("flashes-container");
+        newTitle = data.title;
+    }
+
     // Update main body content
-    var newMainDiv = data.getElementById("main");
     var oldMainDiv = document.getElementById("main");
     oldMainDiv.parentElement.replaceChild(newMainDiv, oldMainDiv);
 
     // Update flashed messages
-    var newFlashes = data.getElementById("flashes-container");
     var oldFlashes = document.getElementById("flashes-container");
     oldFlashes.parentElement.replaceChild(newFlashes, oldFlashes);
 
     // Update page title
-    document.title = data.title;
+    document.title = newTitle;
 
     // Load inline scripts (DOMParser disables these by default)
     var scripts = document.getElementById("main").getElementsByTagName("script");
@@ -176,6 +205,27 @@ function updatePageState(data) {
     window.scrollTo(0, 0);
 }
 
+function createFlashes(flashes) {
+    // Build the flashed messages container from [category, message] pairs
+    // (matches the markup in base.html)
+    var container = document.createElement("div");
+    container.id = "flashes-container";
+    if (flashes.length) {
+        var flashesDiv = document.createElement("div");
+        flashesDiv.className = "flashes";
+        var list = document.createElement("ul");
+        for (const [category, message] of flashes) {
+            var item = document.createElement("li");
+            item.className = `flash-msg ${category}`;
+            item.textContent = message;
+            list.appendChild(item);
+        }
+        flashesDiv.appendChild(list);
+        container.appendChild(flashesDiv);
+    }
+    return container;
+}
+
 async function checkForNewActivity() {
     // Query the server to see if the user has new activity
 
@@ -199,44 +249,56 @@ async function checkForNewActivity() {
 // Check for new activity every 5 minutes (in ms)
 setInterval(checkForNewActivity, 5 * 60 * 1000);
 
-function customImage(source, target) {
-    // Customize an image by performing a palette swap on the .gif
-    // file.  The source element must contain a data-img-b64 attribute
-    // containing the base64 representation of a .gif file.  The byte
-    // indexes match .gifs from Aseprite, and may not work for all
-    // .gif files.
-
-    var style = window.getComputedStyle(target);
-    var bgcolor = style.getPropertyValue("--yellow");
-    var accolor = style.getPropertyValue("--purple");
-
-    // Convert base64 string to Uint8Array so we can modify it
-    var data = atob(source.dataset.imgB64);
-    var bytes = Uint8Array.from(data, c => c.charCodeAt(0));
-
-    // Replace background color palette bytes in gif file
-    bytes[16] = parseInt(bgcolor.substring(1, 3), 16);
-    bytes[17] = parseInt(bgcolor.substring(3, 5), 16);
-    bytes[18] = parseInt(bgcolor.substring(5, 7), 16);
+// Short hash of each recolored .gif (see images.py), loaded on first use
+var m_gifVersions = null;
 
-    // Replace foreground color palette bytes in gif file
-    bytes[19] = parseInt(accolor.substring(1, 3), 16);
-    bytes[20] = parseInt(accolor.substring(3, 5), 16);
-    bytes[21] = parseInt(accolor.substring(5, 7), 16);
+function customImage(name, target) {
+    // Get the URL for a .gif with its color palette swapped to match the
+    // target element's colors.  The palette swap is done by the server.
 
-    // Convert Uint8Array back to base64 so we can use it in a src string
-    data = btoa(String.fromCharCode(...bytes));
+    var style = window.getComputedStyle(target);
+    var colors = {
+        bg: style.getPropertyValue("--yellow").trim(),
+        ac: style.getPropertyValue("--purple").trim(),
+    };
+
+    // Leave out anything the server can't swap in (unset, or not written as
+    // #rrggbb), so it uses the default color instead
+    var params = new URLSearchParams();
+    for (var key in colors) {
+        if (/^#[0-9a-f]{6}$/i.test(colors[key])) {
+            params.set(key, colors[key]);
+        }
+    }
 
-    // Embed base64 in a data string that can be used as an img src.
-    return `data:image/gif;base64, ${data}`;
+    // The URL changes with the .gif, since the image is cached for good
+    if (m_gifVersions === null) {
+        m_gifVersions = JSON.parse(document.getElementById("gif-versions").textContent);
+    }
+    if (name in m_gifVersions) {
+        params.set("v", m_gifVersions[name]);
+    }
+    return `/static-colored/${name}.gif?${params}`;
 }
 
+const m_customImages = [
+    "lsp_btn_add02",
+    "lsp_btn_delete02",
+    "lsp_btn_download02",
+    "lsp_btn_edit02",
+    "lsp_btn_hide02",
+    "lsp_btn_next02",
+    "lsp_btn_pause02",
+    "lsp_btn_play02",
+    "lsp_btn_prev02",
+    "lsp_btn_show02",
+];
+
 function updateImageColors() {
     // Perform a palette swap on all gifs based on current page colors
-    document.querySelectorAll(".img-data").forEach(e => {
-        document.querySelectorAll(`.${e.id}`).forEach(t => {
-            t.src = customImage(e, t);
+    for (const name of m_customImages) {
+        document.querySelectorAll(`.${name}`).forEach(t => {
+            t.src = customImage(name, t);
         });
-    });
+    }
 }
-
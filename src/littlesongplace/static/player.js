@@ -1,5 +1,6 @@
 var m_allSongs = [];
 var m_songIndex = 0;
+var m_songDuration = 0;  // From the server, until the browser loads the song
 
 // Play a new song from the list in the player
 function play(event) {
@@ -22,10 +23,13 @@ function playCurrentSong() {
 
     var audio = document.getElementById("player-audio");
     audio.pause();
-    audio.src = `/song/${songData.userid}/${songData.songid}`;
+    audio.src = getSongUrl(songData);
     audio.currentTime = 0;
     audio.play();
 
+    m_songDuration = songData.duration;
+    document.getElementById("player-total-time").textContent = getTimeString(m_songDuration);
+
     var pfp = document.getElementById("player-pfp")
     var albumImg;
     if (songData.user_has_pfp) {
@@ -145,6 +149,31 @@ function songPrevious() {
     playCurrentSong();
 }
 
+function getSongUrl(songData) {
+    var url = `/song/${songData.userid}/${songData.songid}`;
+    var audio = document.getElementById("player-audio");
+    if (songData.hls && audio.canPlayType("application/vnd.apple.mpegurl") !== "") {
+        // Long songs are split into segments, for browsers that can play HLS
+        return `${url}/hls/index.m3u8`;
+    }
+    if (useLowBandwidth()) {
+        return `${url}?rendition=opus`;
+    }
+    return url;
+}
+
+// Use the small Opus rendition of songs on slow or metered connections
+// (navigator.connection isn't available in every browser)
+function useLowBandwidth() {
+    var connection = navigator.connection;
+    if (!connection) {
+        return false;
+    }
+    var slow = connection.saveData || ["slow-2g", "2g", "3g"].includes(connection.effectiveType);
+    var audio = document.getElementById("player-audio");
+    return slow && audio.canPlayType('audio/webm; codecs="opus"') !== "";
+}
+
 // Convert float seconds to "min:sec"
 function getTimeString(time) {
     if (isNaN(time))
@@ -164,15 +193,16 @@ function getTimeString(time) {
 function songUpdate() {
     var audio = document.getElementById("player-audio");
     var position = document.getElementById("position-slider");
-    if (audio.duration) {
-        position.value = audio.currentTime / audio.duration;
+    var duration = audio.duration || m_songDuration;
+    if (duration) {
+        position.value = audio.currentTime / duration;
     }
     else {
         position.value = 0;
     }
 
     document.getElementById("player-current-time").textContent = getTimeString(audio.currentTime);
-    document.getElementById("player-total-time").textContent = getTimeString(audio.duration);
+    document.getElementById("player-total-time").textContent = getTimeString(duration);
 }
 
 // Shown song details when the "..." button is clicked in a song list
@@ -182,21 +212,46 @@ function showSongDetails(event) {
     var detailsToggle = songElement.querySelector(".details-toggle img");
     if (songDetails.hidden) {
         // Show details
+        if (songDetails.dataset.detailsUrl) {
+            loadSongDetails(songDetails);
+        }
         songDetails.hidden = false;
         detailsToggle.alt = "Hide Details";
         detailsToggle.className = "lsp_btn_hide02";
-        detailsToggle.src = customImage(document.getElementById("lsp_btn_hide02"), detailsToggle);
+        detailsToggle.src = customImage("lsp_btn_hide02", detailsToggle);
     }
     else {
         // Hide details
         songDetails.hidden = true;
         detailsToggle.alt = "Show Details";
         detailsToggle.className = "lsp_btn_show02";
-        detailsToggle.src = customImage(document.getElementById("lsp_btn_show02"), detailsToggle);
+        detailsToggle.src = customImage("lsp_btn_show02", detailsToggle);
     }
     return false;
 }
 
+// Replace a song details placeholder with the details from the server
+async function loadSongDetails(placeholder) {
+    const url = placeholder.dataset.detailsUrl;
+    delete placeholder.dataset.detailsUrl;  // Only load once
+    const response = await fetch(url);
+    if (!response.ok) {
+        console.log(`Failed to get song details: ${response.status}`);
+        placeholder.dataset.detailsUrl = url;  // Try again next time
+        return;
+    }
+
+    const template = document.createElement("template");
+    template.innerHTML = await response.text();
+    const songDetails = template.content.querySelector(".song-details");
+    songDetails.hidden = placeholder.hidden;
+    placeholder.replaceWith(songDetails);
+
+    // Set up new links/forms and buttons
+    addAjaxHandlers(songDetails);
+    updateImageColors();
+}
+
 // Shuffle the songs in a song list
 function shuffleSongList(event) {
     var songList = event.target.closest(".song-list");
@@ -227,6 +282,42 @@ function shuffleSongList(event) {
     }
 }
 
+// Append the next page of a song list, and replace the "load more" button
+// with the one for the page after that (if any)
+async function loadMoreSongs(event) {
+    var button = event.target;
+    var songList = button.closest(".song-list");
+    button.disabled = true;
+    const response = await fetch(button.dataset.url);
+    if (!response.ok) {
+        console.log(`Failed to load more songs: ${response.status}`);
+        button.disabled = false;  // Try again next time
+        return false;
+    }
+
+    const template = document.createElement("template");
+    template.innerHTML = await response.text();
+    var songs = songList.querySelector(".song-list-songs");
+    for (const song of template.content.querySelectorAll(".song")) {
+        if (songList.dataset.original) {
+            // Shuffled; keep the new songs when unshuffling
+            songList.dataset.original += song.outerHTML;
+        }
+        songs.appendChild(song);
+        addAjaxHandlers(song);
+    }
+
+    const nextButton = template.content.querySelector(".song-list-more");
+    if (nextButton) {
+        button.replaceWith(nextButton);
+    }
+    else {
+        button.remove();
+    }
+    updateImageColors();
+    return false;
+}
+
 // Add event listeners
 var m_firstLoadPlayer = true;
 document.addEventListener("DOMContentLoaded", (event) => {
@@ -253,18 +344,18 @@ document.addEventListener("DOMContentLoaded", (event) => {
     var miniButton = document.getElementById("mini-play-pause-button");
     audio.addEventListener("play", (event) => {
         button.className = "lsp_btn_pause02";
-        button.src = customImage(document.getElementById("lsp_btn_pause02"), button);
+        button.src = customImage("lsp_btn_pause02", button);
         miniButton.className = "lsp_btn_pause02";
-        miniButton.src = customImage(document.getElementById("lsp_btn_pause02"), button);
+        miniButton.src = customImage("lsp_btn_pause02", button);
         updateImageColors();
     })
 
     // Show play button when audio is paused
     audio.addEventListener("pause", (event) => {
         button.className = "lsp_btn_play02";
-        button.src = customImage(document.getElementById("lsp_btn_play02"), button);
+        button.src = customImage("lsp_btn_play02", button);
         miniButton.className = "lsp_btn_play02";
-        miniButton.src = customImage(document.getElementById("lsp_btn_play02"), button);
+        miniButton.src = customImage("lsp_btn_play02", button);
         updateImageColors();
     })
 
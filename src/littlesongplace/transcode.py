@@ -0,0 +1,524 @@
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import audioinfo, blobs, db, ffmpeg, mp3info, peaks, youtube
+
+# Job statuses
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+# Job kinds: converting an uploaded file, or making one of the other files
+# for a song from its mp3.  The song can be played as soon as its upload job
+# stores the mp3; the upload job then queues jobs for the other files.
+UPLOAD = "upload"
+ANALYZE = "analyze"  # Audio info and waveform peaks (then HLS, if needed)
+OPUS = "opus"
+HLS = "hls"
+
+# Small rendition for slow connections (the mp3 is ~190 kbps)
+OPUS_BITRATE = "64k"
+
+# Long songs are also split into segments for HTTP Live Streaming, so they
+# start quickly and seek without range requests into one huge file
+HLS_SEGMENT_SECONDS = 10
+HLS_MANIFEST = "index.m3u8"
+
+# Song files are stored by a hash of the source file and these settings (see
+# blobs.py); change them when the ffmpeg arguments below change, so songs
+# uploaded afterwards don't reuse files made the old way
+BLOB_SETTINGS = f"mp3 -qscale:a 2 -ar 44100; opus -b:a {OPUS_BITRATE}; hls -hls_time {HLS_SEGMENT_SECONDS}"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def init_app(app):
+    # Number of ffmpeg jobs to run at once in each worker process; 0 runs
+    # jobs synchronously in the request that submits them
+    app.config.setdefault("TRANSCODE_WORKERS", os.cpu_count() or 1)
+    # Songs at least this long (seconds) get HLS segments; None disables them
+    app.config.setdefault("HLS_MIN_DURATION", 10 * 60)
+    app.before_request(_start_executor)
+    app.cli.add_command(queue_opus_cmd)
+    app.cli.add_command(queue_hls_cmd)
+
+def create_job(songid, userid, source, url=None):
+    # Queue a source audio file to be converted for a song; the source file is
+    # owned by the job from now on, and will be deleted when it finishes.  For
+    # YouTube imports, the job downloads the url into the source file first.
+    timestamp = datetime.now(timezone.utc).isoformat()
+    job = db.query(
+            """
+            INSERT INTO transcode_jobs (songid, userid, source, status, created, url)
+            VALUES (?, ?, ?, ?, ?, ?)
+            RETURNING jobid
+            """,
+            [songid, userid, str(source), PENDING, timestamp, url],
+            one=True)
+    return job["jobid"]
+
+def queue_backfill(kind):
+    # Queue rendition jobs for songs that are missing the rendition (and
+    # don't already have a job running); returns the number of jobs queued
+    songs = db.query(
+            """
+            SELECT songid, userid, duration, hls FROM songs
+            WHERE status = 'ready' AND NOT EXISTS (
+                SELECT 1 FROM transcode_jobs
+                WHERE transcode_jobs.songid = songs.songid
+                    AND status IN (?, ?)
+            )
+            """,
+            [PENDING, PROCESSING])
+
+    count = 0
+    for song in songs:
+        if kind == OPUS:
+            missing = not get_opus_path(song["userid"], song["songid"]).exists()
+        else:
+            missing = _needs_hls(song["duration"]) and not song["hls"]
+
+        if missing:
+            _create_file_job(song, kind)
+            count += 1
+    db.commit()
+    return count
+
+def _create_file_job(song, kind):
+    # Queue a job to make one of the files for a song from its mp3
+    timestamp = datetime.now(timezone.utc).isoformat()
+    job = db.query(
+            """
+            INSERT INTO transcode_jobs (songid, userid, source, status, created, kind)
+            VALUES (?, ?, '', ?, ?, ?)
+            RETURNING jobid
+            """,
+            [song["songid"], song["userid"], PENDING, timestamp, kind],
+            one=True)
+    return job["jobid"]
+
+def _queue_file_jobs(song, kinds):
+    jobids = [_create_file_job(song, kind) for kind in kinds]
+    db.commit()
+    for jobid in jobids:
+        submit(jobid)
+
+@click.command("queue-opus")
+@with_appcontext
+def queue_opus_cmd():
+    """Queue background jobs to make Opus renditions of existing songs"""
+    count = queue_backfill(OPUS)
+    click.echo(f"Queued {count} songs (the server runs them after uploads)")
+
+@click.command("queue-hls")
+@with_appcontext
+def queue_hls_cmd():
+    """Queue background jobs to make HLS segments for existing long songs"""
+    count = queue_backfill(HLS)
+    click.echo(f"Queued {count} songs (the server runs them after uploads)")
+
+def submit(jobid):
+    # Run a job that has been created (and committed) with create_job
+    if current_app.config["TRANSCODE_WORKERS"] == 0:
+        _run_job(jobid)
+    else:
+        _get_executor().submit(_run_next_job, current_app._get_current_object())
+
+def get_job(jobid):
+    return db.query("SELECT * FROM transcode_jobs WHERE jobid = ?", [jobid], one=True)
+
+def get_latest_job(songid):
+    # Latest upload job for a song
+    return db.query(
+            """
+            SELECT * FROM transcode_jobs
+            WHERE songid = ? AND kind = ?
+            ORDER BY jobid DESC
+            LIMIT 1
+            """,
+            [songid, UPLOAD],
+            one=True)
+
+def get_queue_position(jobid):
+    # Number of pending upload jobs that will run before this one (uploads
+    # always run before backfill jobs)
+    row = db.query(
+            """
+            SELECT COUNT(*) AS position FROM transcode_jobs
+            WHERE status = ? AND kind = ? AND jobid < ?
+            """,
+            [PENDING, UPLOAD, jobid],
+            one=True)
+    return row["position"]
+
+def get_import_count(userid):
+    # Number of YouTube imports the user has waiting or running
+    row = db.query(
+            """
+            SELECT COUNT(*) AS count FROM transcode_jobs
+            WHERE userid = ? AND url IS NOT NULL AND status IN (?, ?)
+            """,
+            [userid, PENDING, PROCESSING],
+            one=True)
+    return row["count"]
+
+def get_opus_path(userid, songid):
+    return blobs.get_song_path(userid, songid).with_suffix(".webm")
+
+def get_hls_path(userid, songid):
+    # Directory with the manifest and segments
+    return blobs.get_song_path(userid, songid).with_suffix(".hls")
+
+def delete_jobs(songid):
+    # Cancel pending jobs for a song (processing jobs notice that the song is
+    # gone when they finish)
+    jobs = db.query(
+            "DELETE FROM transcode_jobs WHERE songid = ? RETURNING *", [songid])
+    for job in jobs:
+        if job["kind"] == UPLOAD and job["status"] == PENDING and os.path.exists(job["source"]):
+            os.remove(job["source"])
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=current_app.config["TRANSCODE_WORKERS"],
+                    thread_name_prefix="transcode")
+
+            # Pick up jobs that were left behind when the server last stopped
+            _recover_jobs()
+            app = current_app._get_current_object()
+            pending = db.query(
+                    "SELECT COUNT(*) AS count FROM transcode_jobs WHERE status = ?",
+                    [PENDING], one=True)
+            for _ in range(min(pending["count"], current_app.config["TRANSCODE_WORKERS"])):
+                _executor.submit(_run_next_job, app)
+
+        return _executor
+
+def _start_executor():
+    # Start the worker pool on the first request in each process
+    if _executor is None and current_app.config["TRANSCODE_WORKERS"] != 0:
+        _get_executor()
+
+def _recover_jobs():
+    # Requeue jobs that were being processed by a process that has since died
+    jobs = db.query(
+            "SELECT * FROM transcode_jobs WHERE status = ?", [PROCESSING])
+    for job in jobs:
+        if not _process_is_running(job["pid"]):
+            current_app.logger.warning(f"Requeueing transcode job {job['jobid']}")
+            db.query(
+                    "UPDATE transcode_jobs SET status = ? WHERE jobid = ?",
+                    [PENDING, job["jobid"]])
+    db.commit()
+
+def _process_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+def _run_next_job(app):
+    with app.app_context():
+        # Run pending jobs until there are none left; other worker processes
+        # share the job table, so this may not be the job that triggered this
+        # call
+        while True:
+            job = _claim_job()
+            if not job:
+                break
+
+            try:
+                _run_job(job["jobid"])
+            except Exception:
+                current_app.logger.exception(f"Transcode job {job['jobid']} failed")
+                job = get_job(job["jobid"])
+                if job:
+                    _finish_job(job, False)
+
+def _claim_job():
+    # Uploads run first, then analysis (so long songs get their HLS job
+    # early), oldest first; YouTube imports wait while YT_IMPORT_WORKERS
+    # imports are already running
+    job = db.query(
+            """
+            UPDATE transcode_jobs SET status = ?, pid = ?
+            WHERE jobid = (
+                SELECT jobid FROM transcode_jobs
+                WHERE status = ? AND (url IS NULL OR (
+                    SELECT COUNT(*) FROM transcode_jobs
+                    WHERE status = ? AND url IS NOT NULL
+                ) < ?)
+                ORDER BY kind != ?, kind != ?, jobid ASC
+                LIMIT 1
+            )
+            RETURNING jobid
+            """,
+            [
+                PROCESSING, os.getpid(), PENDING, PROCESSING,
+                current_app.config["YT_IMPORT_WORKERS"], UPLOAD, ANALYZE,
+            ],
+            one=True)
+    db.commit()
+    return job
+
+def _run_job(jobid):
+    job = get_job(jobid)
+    db.query(
+            "UPDATE transcode_jobs SET status = ?, pid = ? WHERE jobid = ?",
+            [PROCESSING, os.getpid(), jobid])
+
+    if job["kind"] != UPLOAD:
+        db.commit()
+        mp3_path = blobs.get_song_path(job["userid"], job["songid"])
+        if job["kind"] == OPUS and get_opus_path(job["userid"], job["songid"]).exists():
+            passed = True  # Made for another song with the same audio
+        else:
+            make_file = {ANALYZE: _analyze, OPUS: _encode_opus, HLS: _segment}[job["kind"]]
+            passed = mp3_path.exists() and make_file(job, mp3_path)
+        _finish_job(job, passed)
+
+        if job["kind"] == ANALYZE and passed:
+            # Long songs need the duration to know that they get segments
+            song = db.query("SELECT duration FROM songs WHERE songid = ?", [job["songid"]], one=True)
+            if song and _needs_hls(song["duration"]):
+                _queue_file_jobs(job, [HLS])
+        return
+
+    db.query(
+            "UPDATE songs SET status = 'processing' WHERE songid = ? AND status = 'pending'",
+            [job["songid"]])
+    db.commit()
+
+    if job["url"]:
+        # YouTube import: use the audio from an earlier import of the same
+        # video, or download it into the source file
+        blob = youtube.get_cached_blob(job["url"])
+        if blob and _reuse(job, blob):
+            return
+        current_app.logger.info(f"Transcode job {jobid}: downloading {job['url']}")
+        if not youtube.fetch(job["url"], job["source"]):
+            _finish_job(job, False)
+            return
+
+    # Songs made from the same file with the same settings share their files,
+    # so there's nothing to convert if this file has been uploaded before
+    blob = blobs.hash_source(job["source"], BLOB_SETTINGS)
+    blob_path = blobs.get_blob_path(blob)
+    if _reuse(job, blob):
+        if job["url"]:
+            youtube.cache_blob(job["url"], blob)
+        return
+
+    # Convert into a temporary file next to the blob, so it can be moved into
+    # place atomically
+    os.makedirs(blob_path.parent, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=blob_path.parent, suffix=".mp3", delete=False) as out_file:
+        out_file.close()
+        passed = False
+        if mp3info.is_compliant(job["source"]):
+            # Already what ffmpeg would produce; re-encoding would only cost
+            # CPU time and audio quality
+            current_app.logger.info(f"Transcode job {jobid}: copying compliant mp3")
+            passed = copy_mp3(job["source"], out_file.name)
+        if not passed:
+            current_app.logger.info(f"Transcode job {jobid}: converting with ffmpeg")
+            passed = convert(job["source"], out_file.name)
+
+        song = db.query("SELECT * FROM songs WHERE songid = ?", [job["songid"]], one=True)
+        if passed and song:
+            blobs.store(job["songid"], blob, out_file.name)
+            if job["url"]:
+                youtube.cache_blob(job["url"], blob)
+        elif os.path.exists(out_file.name):
+            os.remove(out_file.name)
+
+    # The song can be played now; make its other files in the background
+    _finish_job(job, passed)
+    if passed and song:
+        _queue_file_jobs(job, [ANALYZE, OPUS])
+
+def _reuse(job, blob):
+    # Finish an upload job with a blob that's already been made; returns
+    # False if there's no such blob
+    if not blobs.reuse(job["songid"], blob):
+        return False
+    current_app.logger.info(f"Transcode job {job['jobid']}: reused blob {blob}")
+    _segment(job, blobs.get_blob_path(blob))  # Usually already made, or not needed
+    _finish_job(job, True)
+    return True
+
+def _analyze(job, filepath):
+    # Audio info and waveform peaks are nice to have; the song can be played
+    # without them.  Returns True on success.
+    peaks_path = peaks.get_peaks_path(job["userid"], job["songid"])
+    try:
+        with ffmpeg.slot("analyze"):
+            info = audioinfo.analyze(filepath, peaks_path, ffmpeg.get_command())
+    except Exception:
+        current_app.logger.exception(f"Transcode job {job['jobid']}: failed to analyze audio")
+        return False
+
+    if info:
+        audioinfo.save(job["songid"], info)
+        db.commit()
+    else:
+        current_app.logger.warning(f"Transcode job {job['jobid']}: failed to analyze audio")
+    return bool(info)
+
+def _encode_opus(job, mp3_path):
+    # Make the small rendition of a song's mp3 (the rendition isn't required
+    # for the song to be played); returns True on success
+    opus_path = get_opus_path(job["userid"], job["songid"])
+    with tempfile.NamedTemporaryFile(dir=opus_path.parent, suffix=".webm", delete=False) as out_file:
+        out_file.close()
+        passed = convert_opus(mp3_path, out_file.name)
+
+        song = db.query("SELECT * FROM songs WHERE songid = ?", [job["songid"]], one=True)
+        if passed and song:
+            os.replace(out_file.name, opus_path)
+        elif os.path.exists(out_file.name):
+            os.remove(out_file.name)
+
+    if not passed:
+        current_app.logger.warning(f"Transcode job {job['jobid']}: failed to encode opus")
+    return passed
+
+def _needs_hls(duration):
+    min_duration = current_app.config["HLS_MIN_DURATION"]
+    return min_duration is not None and duration is not None and duration >= min_duration
+
+def _segment(job, mp3_path):
+    # Split a long song into HLS segments (segments are stored with the blob,
+    # so there's nothing to remove for short songs); returns True on success
+    song = db.query("SELECT duration FROM songs WHERE songid = ?", [job["songid"]], one=True)
+    if song is None:
+        return False
+    if not _needs_hls(song["duration"]):
+        _set_hls(job, False)
+        return True
+
+    hls_path = get_hls_path(job["userid"], job["songid"])
+    if (hls_path / HLS_MANIFEST).exists():
+        # Made for another song with the same audio
+        _set_hls(job, True)
+        return True
+
+    # Write segments into a temporary directory next to the final one
+    tmp_dir = tempfile.mkdtemp(dir=hls_path.parent, prefix=".hls-")
+    passed = convert_hls(mp3_path, tmp_dir)
+
+    song = db.query("SELECT * FROM songs WHERE songid = ?", [job["songid"]], one=True)
+    if passed and song:
+        _remove_hls(hls_path)
+        os.replace(tmp_dir, hls_path)
+        db.query("UPDATE songs SET hls = 1 WHERE songid = ?", [job["songid"]])
+        db.commit()
+    else:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if not passed:
+        current_app.logger.warning(f"Transcode job {job['jobid']}: failed to make HLS segments")
+    return passed
+
+def _set_hls(job, enabled):
+    db.query("UPDATE songs SET hls = ? WHERE songid = ?", [int(enabled), job["songid"]])
+    db.commit()
+
+def _remove_hls(hls_path):
+    # Move the directory out of the way first, so the manifest and segments
+    # disappear together
+    if hls_path.exists():
+        old_dir = tempfile.mkdtemp(dir=hls_path.parent, prefix=".hls-")
+        os.replace(hls_path, old_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+def _finish_job(job, passed):
+    db.query(
+            "UPDATE transcode_jobs SET status = ? WHERE jobid = ?",
+            [DONE if passed else FAILED, job["jobid"]])
+    if job["kind"] != UPLOAD:
+        db.commit()
+        return
+
+    if os.path.exists(job["source"]):
+        os.remove(job["source"])
+
+    if passed:
+        db.query(
+                "UPDATE songs SET status = 'ready' WHERE songid = ?",
+                [job["songid"]])
+    else:
+        # Songs that already had audio keep playing the previous file
+        db.query(
+                "UPDATE songs SET status = 'failed' WHERE songid = ? AND status != 'ready'",
+                [job["songid"]])
+    db.commit()
+
+def convert(source, dest):
+    # Convert an audio file to mp3 with ffmpeg, return True on success
+    result = ffmpeg.run(None, [
+            "-i", source,
+            "-codec:a", "libmp3lame",
+            "-qscale:a", "2",
+            "-ar", "44100",
+            "-y",
+            dest
+        ])
+    return result.returncode == 0
+
+def copy_mp3(source, dest):
+    # Copy an mp3's frames into a new file with ffmpeg, without re-encoding
+    # them or keeping any tags; return True on success
+    result = ffmpeg.run("copy", [
+            "-i", source,
+            "-map", "0:a:0",
+            "-codec:a", "copy",
+            "-map_metadata", "-1",
+            "-id3v2_version", "0",
+            "-f", "mp3",
+            "-y",
+            dest
+        ])
+    return result.returncode == 0
+
+def convert_opus(source, dest):
+    # Encode an Opus/WebM rendition with ffmpeg, return True on success
+    result = ffmpeg.run("opus", [
+            "-i", str(source),
+            "-vn",
+            "-codec:a", "libopus",
+            "-b:a", OPUS_BITRATE,
+            "-f", "webm",
+            "-y",
+            dest
+        ])
+    return result.returncode == 0
+
+def convert_hls(source, dest_dir):
+    # Split an mp3 into MPEG-TS segments (without re-encoding) and write an
+    # HLS manifest for them, return True on success
+    result = ffmpeg.run("hls", [
+            "-i", str(source),
+            "-vn",
+            "-codec:a", "copy",
+            "-f", "hls",
+            "-hls_time", str(HLS_SEGMENT_SECONDS),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_filename", os.path.join(dest_dir, "segment%05d.ts"),
+            "-y",
+            os.path.join(dest_dir, HLS_MANIFEST)
+        ])
+    return result.returncode == 0
@@ -0,0 +1,273 @@
+import contextlib
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import Blueprint, abort, current_app, jsonify, request, session
+from flask.cli import with_appcontext
+
+from . import datadir, db, transcode
+from .logutils import flash_and_log
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows; chunks aren't locked against finishing
+
+# Resumable uploads for large song files.  The edit song page sends the file
+# in chunks before submitting the form:
+#   POST /uploads {"size": <bytes>}      -> {"uploadid", "chunk_size"}
+#   PUT /uploads/<id>?offset=<bytes>     one chunk, with an optional
+#                                        X-Chunk-Sha256 header (hex digest)
+#   GET /uploads/<id>                    -> {"size", "chunk_size", "missing"}
+#   DELETE /uploads/<id>                 cancel
+# Then the song form is submitted with upload-id instead of song-file, which
+# hands the assembled file to the transcoder (see songs.stage_song_file).
+# If a chunk fails, the client asks for the missing offsets and resends only
+# those.  Uploads that haven't received a chunk in UPLOAD_EXPIRY are deleted
+# when the next upload starts, or by collect-uploads (for a cron job), so
+# other requests never wait for the cleanup.
+#
+# Chunks are written with a shared lock on the upload's file, and finishing
+# takes an exclusive lock, so a chunk still in flight can't write into a file
+# that has been handed to the transcoder; it gets a 409 instead.
+
+UPLOAD_EXPIRY = timedelta(days=1)
+MAX_UPLOADS_PER_USER = 4
+
+_READ_SIZE = 64 * 1024
+
+bp = Blueprint("uploads", __name__)
+
+def init_app(app):
+    app.config.setdefault("UPLOAD_CHUNK_SIZE", 8 * 1024 * 1024)
+    app.cli.add_command(collect_uploads_cmd)
+
+def get_upload_path(uploadid):
+    return datadir.get_upload_staging_path() / ("chunked-" + uploadid)
+
+@bp.post("/uploads")
+def create_upload():
+    if not "userid" in session:
+        abort(401)
+
+    try:
+        size = int(request.get_json(force=True, silent=True)["size"])
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+    if size <= 0:
+        abort(400)
+    if size > current_app.config["MAX_CONTENT_LENGTH"]:
+        abort(413)
+
+    collect_expired()
+
+    count = db.query(
+            "SELECT COUNT(*) AS count FROM uploads WHERE userid = ?",
+            [session["userid"]],
+            one=True)
+    if count["count"] >= MAX_UPLOADS_PER_USER:
+        abort(429)
+
+    # Sparse file; chunks are written into place as they arrive, in any order
+    uploadid = secrets.token_hex(16)
+    with open(get_upload_path(uploadid), "wb") as f:
+        f.truncate(size)
+
+    timestamp = datetime.now(timezone.utc).isoformat()
+    db.query(
+            """
+            INSERT INTO uploads (uploadid, userid, size, created, updated)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [uploadid, session["userid"], size, timestamp, timestamp])
+    db.commit()
+
+    return jsonify(
+            uploadid=uploadid,
+            chunk_size=current_app.config["UPLOAD_CHUNK_SIZE"]), 201
+
+@bp.get("/uploads/<uploadid>")
+def upload_status(uploadid):
+    upload = _get_upload(uploadid)
+    return jsonify(
+            size=upload["size"],
+            chunk_size=current_app.config["UPLOAD_CHUNK_SIZE"],
+            missing=[c * current_app.config["UPLOAD_CHUNK_SIZE"] for c in _get_missing_chunks(upload)])
+
+@bp.put("/uploads/<uploadid>")
+def upload_chunk(uploadid):
+    upload = _get_upload(uploadid)
+
+    # Chunks start on chunk boundaries, and fill the chunk (except the last)
+    chunk_size = current_app.config["UPLOAD_CHUNK_SIZE"]
+    offset = request.args.get("offset", type=int)
+    if offset is None or offset < 0 or offset >= upload["size"] or offset % chunk_size:
+        abort(400)
+    length = min(chunk_size, upload["size"] - offset)
+
+    try:
+        f = open(get_upload_path(uploadid), "r+b")
+    except FileNotFoundError:
+        abort(409)  # Finished or cancelled since it was looked up
+
+    sha = hashlib.sha256()
+    received = 0
+    with f, _lock_file(f, exclusive=False):
+        # Finished while waiting for the lock (the file is the transcoder's now)
+        if not _exists(uploadid):
+            abort(409)
+
+        f.seek(offset)
+        while received < length:
+            data = request.stream.read(min(_READ_SIZE, length - received))
+            if not data:
+                break
+            f.write(data)
+            sha.update(data)
+            received += len(data)
+
+    # The chunk isn't marked as received unless it's complete and intact, so
+    # the client sends it again
+    if received != length or request.stream.read(1):
+        abort(400)
+    checksum = request.headers.get("X-Chunk-Sha256")
+    if checksum is not None and checksum.lower() != sha.hexdigest():
+        current_app.logger.warning(f"Upload {uploadid}: checksum mismatch at {offset}")
+        abort(400)
+
+    timestamp = datetime.now(timezone.utc).isoformat()
+    updated = db.query(
+            "UPDATE uploads SET updated = ? WHERE uploadid = ? RETURNING uploadid",
+            [timestamp, uploadid],
+            one=True)
+    if updated is None:
+        abort(409)  # Cancelled while the chunk was written
+    db.query(
+            "INSERT OR IGNORE INTO upload_chunks (uploadid, chunk) VALUES (?, ?)",
+            [uploadid, offset // chunk_size])
+    db.commit()
+
+    return "", 204
+
+@bp.delete("/uploads/<uploadid>")
+def cancel_upload(uploadid):
+    _get_upload(uploadid)
+    _delete(uploadid)
+    db.commit()
+    return "", 204
+
+def finish(uploadid):
+    # Take the assembled file for a finished upload (from the song form);
+    # returns the path to the file (now owned by the caller), or None on
+    # failure
+    upload = db.query(
+            "SELECT * FROM uploads WHERE uploadid = ? AND userid = ?",
+            [uploadid, session["userid"]],
+            one=True)
+    upload_path = get_upload_path(uploadid)
+    try:
+        f = open(upload_path, "rb") if upload else None
+    except FileNotFoundError:
+        f = None  # Cancelled since it was looked up
+    if f is None:
+        flash_and_log("Upload not found, please try again", "error")
+        return None
+
+    # Chunks in flight are written before the upload is checked, and later
+    # ones see that it's gone (see upload_chunk).  An incomplete upload is left
+    # in place, so the client can resume it.
+    with f, _lock_file(f, exclusive=True):
+        if _get_missing_chunks(upload):
+            flash_and_log("Upload is incomplete, please try again", "error")
+            return None
+
+        # Move the file out of the way first, so it isn't deleted with the
+        # upload
+        source = upload_path.with_name("finished-" + uploadid)
+        os.replace(upload_path, source)
+        _delete(uploadid)
+        db.commit()
+    return str(source)
+
+def collect_expired():
+    # Delete uploads that were abandoned partway through, and old files in
+    # the staging directory that nothing uses (left by a crash between
+    # finishing an upload and queueing its job, for example); returns the
+    # number of files deleted
+    cutoff = datetime.now(timezone.utc) - UPLOAD_EXPIRY
+    expired = db.query("SELECT uploadid FROM uploads WHERE updated < ?", [cutoff.isoformat()])
+    for upload in expired:
+        current_app.logger.info(f"Deleting abandoned upload {upload['uploadid']}")
+        _delete(upload["uploadid"])
+    db.commit()
+
+    # Files for uploads in progress, and sources of jobs that haven't
+    # finished (YouTube downloads can add a suffix)
+    in_use = {
+        get_upload_path(row["uploadid"]).name
+        for row in db.query("SELECT uploadid FROM uploads")}
+    jobs = db.query(
+            "SELECT source FROM transcode_jobs WHERE status IN (?, ?)",
+            [transcode.PENDING, transcode.PROCESSING])
+    in_use.update(os.path.basename(job["source"]) for job in jobs)
+
+    count = len(expired)
+    for entry in os.scandir(datadir.get_upload_staging_path()):
+        try:
+            stale = entry.is_file() and entry.stat().st_mtime < cutoff.timestamp()
+            if stale and entry.name.split(".")[0] not in in_use:
+                current_app.logger.info(f"Deleting stale staged file {entry.name}")
+                os.remove(entry.path)
+                count += 1
+        except FileNotFoundError:
+            pass  # Already deleted by another process
+    return count
+
+@click.command("collect-uploads")
+@with_appcontext
+def collect_uploads_cmd():
+    """Delete abandoned uploads and stale files in the upload staging directory"""
+    count = collect_expired()
+    click.echo(f"Deleted {count} abandoned uploads and files")
+
+def _get_upload(uploadid):
+    if not "userid" in session:
+        abort(401)
+    upload = db.query(
+            "SELECT * FROM uploads WHERE uploadid = ?", [uploadid], expect_one=True)
+    if upload["userid"] != session["userid"]:
+        abort(404)
+    return upload
+
+def _exists(uploadid):
+    return db.query(
+            "SELECT 1 FROM uploads WHERE uploadid = ?", [uploadid], one=True) is not None
+
+@contextlib.contextmanager
+def _lock_file(f, exclusive):
+    # Hold a lock on an upload's open file for the body of the with statement
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
+def _get_missing_chunks(upload):
+    chunk_size = current_app.config["UPLOAD_CHUNK_SIZE"]
+    count = (upload["size"] + chunk_size - 1) // chunk_size
+    received = db.query(
+            "SELECT chunk FROM upload_chunks WHERE uploadid = ?", [upload["uploadid"]])
+    return sorted(set(range(count)) - {row["chunk"] for row in received})
+
+def _delete(uploadid):
+    db.query("DELETE FROM upload_chunks WHERE uploadid = ?", [uploadid])
+    db.query("DELETE FROM uploads WHERE uploadid = ?", [uploadid])
+    upload_path = get_upload_path(uploadid)
+    if upload_path.exists():
+        os.remove(upload_path)
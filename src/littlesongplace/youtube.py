@@ -0,0 +1,65 @@
+from datetime import datetime, timezone
+
+from flask import current_app
+from yt_dlp import YoutubeDL
+from yt_dlp.extractor.youtube import YoutubeIE
+from yt_dlp.utils import DownloadError
+
+from . import db
+
+# YouTube imports are downloaded by transcode jobs (see transcode.py), and the
+# blob made from each video is cached by video ID, so importing a video again
+# doesn't download or convert anything
+
+def init_app(app):
+    # Imports downloading at once (across all worker processes)
+    app.config.setdefault("YT_IMPORT_WORKERS", 2)
+    # Imports each user can have waiting or running at once
+    app.config.setdefault("YT_IMPORTS_PER_USER", 3)
+    # Function that downloads the audio for a URL into a file: download, or a
+    # local stand-in for testing offline
+    app.config.setdefault("YT_DOWNLOADER", download)
+
+def download(url, dest):
+    ydl_opts = {
+        'format': 'm4a/bestaudio/best',
+        'outtmpl': str(dest),
+        'logger': current_app.logger,
+    }
+    with YoutubeDL(ydl_opts) as ydl:
+        ydl.download([url])
+
+def fetch(url, dest):
+    # Download the audio for an import job; returns False on failure
+    try:
+        current_app.config["YT_DOWNLOADER"](url, dest)
+    except DownloadError as ex:
+        current_app.logger.warning(str(ex))
+        return False
+    return True
+
+def get_video_id(url):
+    # Parsed from the URL (without a network request); None for URLs that
+    # aren't YouTube videos, which are imported without caching
+    if YoutubeIE.suitable(url):
+        return YoutubeIE.get_temp_id(url)
+    return None
+
+def get_cached_blob(url):
+    videoid = get_video_id(url)
+    if videoid is None:
+        return None
+    row = db.query(
+            "SELECT blob FROM youtube_cache WHERE videoid = ?", [videoid], one=True)
+    return row["blob"] if row else None
+
+def cache_blob(url, blob):
+    # Entries are deleted with their blob (by a trigger on the blobs table)
+    videoid = get_video_id(url)
+    if videoid is None:
+        return
+    timestamp = datetime.now(timezone.utc).isoformat()
+    db.query(
+            "INSERT OR REPLACE INTO youtube_cache (videoid, blob, created) VALUES (?, ?, ?)",
+            [videoid, blob, timestamp])
+    db.commit()
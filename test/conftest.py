@@ -21,6 +21,25 @@ def app():
     with tempfile.TemporaryDirectory() as data_dir:
         lsp.datadir.set_data_dir(data_dir)
 
+        # Convert uploads in the request that submits them
+        lsp.app.config["TRANSCODE_WORKERS"] = 0
+        lsp.app.config["FFMPEG"] = "ffmpeg"
+        lsp.app.config["TRANSCODE_SLOTS"] = 8
+        lsp.app.config["FFMPEG_NICE"] = 10
+        lsp.app.config["FFMPEG_THREADS"] = 1
+        lsp.app.config["HLS_MIN_DURATION"] = 10 * 60
+        lsp.app.config["YT_DOWNLOADER"] = lsp.youtube.download
+        lsp.app.config["YT_IMPORT_WORKERS"] = 2
+        lsp.app.config["YT_IMPORTS_PER_USER"] = 3
+        lsp.app.config["UPLOAD_CHUNK_SIZE"] = 8 * 1024 * 1024
+
+        # Commit everything right away
+        lsp.app.config["DB_WRITE_BEHIND_INTERVAL"] = None
+
+        # Send files from Python
+        lsp.app.config["SENDFILE_MODE"] = None
+        lsp.app.config["SENDFILE_ACCEL_PREFIX"] = "/data"
+
         # Initialize Database
         with lsp.app.app_context():
             if fresh_db:
@@ -0,0 +1,110 @@
+import sqlite3
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import littlesongplace as lsp
+
+from .utils import create_user_and_song, get_song_list_from_page, get_song_path
+
+def _mp3_path():
+    return get_song_path(1, 1)
+
+def _peaks_path():
+    return get_song_path(1, 1).with_suffix(".peaks")
+
+def _clear_audio_info():
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.execute(
+            """
+            UPDATE songs
+            SET duration = NULL, bitrate = NULL, sample_rate = NULL,
+                size = NULL, loudness = NULL
+            """)
+    db.commit()
+    db.close()
+
+def _get_song(client):
+    return get_song_list_from_page(client, "/users/user")[0]
+
+# Audio info ###################################################################
+
+def test_audio_info_stored_on_upload(client):
+    create_user_and_song(client)
+
+    song = _get_song(client)
+    assert song["duration"] == pytest.approx(3.2, abs=0.1)
+    assert song["bitrate"] == 128
+    assert song["sample_rate"] == 44100
+    assert song["size"] == _mp3_path().stat().st_size
+    assert -70 < song["loudness"] < 0
+
+def test_decode_invalid_file(tmp_path):
+    path = tmp_path / "song.mp3"
+    path.write_bytes(b"not audio")
+    assert lsp.audioinfo.decode(path) is None
+
+# analyze-songs command ########################################################
+
+def test_analyze_songs_backfill(app, client):
+    create_user_and_song(client)
+    expected = _get_song(client)
+    expected_peaks = _peaks_path().read_bytes()
+    _clear_audio_info()
+    _peaks_path().unlink()
+    assert _get_song(client)["duration"] is None
+
+    result = app.test_cli_runner().invoke(args=["analyze-songs", "--jobs", "2"])
+    assert "Analyzed 1 songs (0 failed)" in result.output
+    assert _get_song(client) == expected
+    assert _peaks_path().read_bytes() == expected_peaks
+
+def test_analyze_songs_skips_analyzed(app, client):
+    create_user_and_song(client)
+
+    result = app.test_cli_runner().invoke(args=["analyze-songs"])
+    assert "Analyzed 0 songs" in result.output
+
+    result = app.test_cli_runner().invoke(args=["analyze-songs", "--all"])
+    assert "Analyzed 1 songs" in result.output
+
+def test_analyze_songs_ignores_deleted_songs(app, client):
+    create_user_and_song(client)
+    (lsp.datadir.get_user_songs_path(1) / "2.mp3").write_bytes(_mp3_path().read_bytes())
+    _clear_audio_info()
+
+    result = app.test_cli_runner().invoke(args=["analyze-songs"])
+    assert "Analyzed 1 songs (0 failed)" in result.output
+
+def test_analyze_songs_waits_for_slot(app, client):
+    create_user_and_song(client)
+    _clear_audio_info()
+    app.config["TRANSCODE_SLOTS"] = 1
+
+    # Another process holds the only slot until told to stop (held outside
+    # this process, so analyze-songs' workers don't inherit the lock)
+    lock_path = lsp.datadir.get_transcode_slots_path() / "0.lock"
+    holder = subprocess.Popen([
+            sys.executable, "-c",
+            "import fcntl, sys\n"
+            f"f = open({str(lock_path)!r}, 'a')\n"
+            "fcntl.flock(f, fcntl.LOCK_EX)\n"
+            "print('locked', flush=True)\n"
+            "sys.stdin.readline()\n"],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert holder.stdout.readline() == b"locked\n"
+
+    results = []
+    def analyze_songs():
+        results.append(app.test_cli_runner().invoke(args=["analyze-songs"]))
+
+    thread = threading.Thread(target=analyze_songs)
+    thread.start()
+    thread.join(timeout=1)
+    assert thread.is_alive()
+
+    holder.communicate(b"\n")
+    thread.join()
+    assert "Analyzed 1 songs (0 failed)" in results[0].output
@@ -0,0 +1,287 @@
+import sqlite3
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+import littlesongplace as lsp
+
+from .utils import TEST_DATA, create_user, create_user_and_song
+
+# Connections ##################################################################
+
+def test_connection_reused_between_requests(app):
+    with app.app_context():
+        first = lsp.db.get()
+    with app.app_context():
+        assert lsp.db.get() is first
+
+def test_connection_per_thread(app):
+    with app.app_context():
+        first = lsp.db.get()
+
+    connections = []
+    def get_connection():
+        with app.app_context():
+            connections.append(lsp.db.get())
+    thread = threading.Thread(target=get_connection)
+    thread.start()
+    thread.join()
+
+    assert connections[0] is not first
+
+def test_connection_settings(app):
+    with app.app_context():
+        assert lsp.db.query("PRAGMA journal_mode", one=True)[0] == "wal"
+        assert lsp.db.query("PRAGMA synchronous", one=True)[0] == 1  # NORMAL
+        assert lsp.db.query("PRAGMA foreign_keys", one=True)[0] == 1
+        assert lsp.db.query("PRAGMA busy_timeout", one=True)[0] == lsp.db.BUSY_TIMEOUT
+
+def test_uncommitted_changes_rolled_back(app, user):
+    with app.app_context():
+        lsp.db.query("UPDATE users SET bio = 'uncommitted'")
+    with app.app_context():
+        assert lsp.db.query("SELECT bio FROM users", one=True)["bio"] != "uncommitted"
+
+# Writes #######################################################################
+
+def _hold_write_lock(seconds):
+    # Take the write lock from another connection; returns once it's held
+    locked = threading.Event()
+    def hold():
+        db = sqlite3.connect(lsp.datadir.get_db_path(), isolation_level=None)
+        db.execute("BEGIN IMMEDIATE")
+        locked.set()
+        time.sleep(seconds)
+        db.execute("COMMIT")
+        db.close()
+    thread = threading.Thread(target=hold)
+    thread.start()
+    locked.wait()
+    return thread
+
+def test_write_starts_transaction(app, user):
+    with app.app_context():
+        before = lsp.db.get_stats()
+        lsp.db.query("SELECT * FROM users")
+        assert not lsp.db.get().in_transaction
+        lsp.db.query("UPDATE users SET bio = 'bio'")
+        assert lsp.db.get().in_transaction
+        lsp.db.query("UPDATE users SET bio = 'bio2'")
+        lsp.db.commit()
+        assert lsp.db.get_stats()["transactions"] == before["transactions"] + 1
+
+def test_write_waits_for_lock(app, user):
+    with app.app_context():
+        lsp.db.get()
+        before = lsp.db.get_stats()
+        holder = _hold_write_lock(0.3)
+        lsp.db.query("UPDATE users SET bio = 'bio'")
+        lsp.db.commit()
+        holder.join()
+        after = lsp.db.get_stats()
+
+    assert after["lock_wait"] - before["lock_wait"] >= 0.2
+    assert after["max_lock_wait"] >= 0.2
+
+def test_write_retries_when_busy(app, user):
+    with app.app_context(), mock.patch.object(lsp.db, "WRITE_BACKOFF", 0.1):
+        lsp.db.query("PRAGMA busy_timeout = 0")
+        before = lsp.db.get_stats()
+        holder = _hold_write_lock(0.15)
+        lsp.db.query("UPDATE users SET bio = 'bio'")
+        lsp.db.commit()
+        holder.join()
+        after = lsp.db.get_stats()
+
+    assert after["retries"] > before["retries"]
+    assert after["failures"] == before["failures"]
+
+def test_write_fails_after_retries(app, user):
+    with app.app_context(), mock.patch.object(lsp.db, "WRITE_BACKOFF", 0.01):
+        lsp.db.query("PRAGMA busy_timeout = 0")
+        before = lsp.db.get_stats()
+        holder = _hold_write_lock(0.5)
+        with pytest.raises(sqlite3.OperationalError):
+            lsp.db.query("UPDATE users SET bio = 'bio'")
+        holder.join()
+        after = lsp.db.get_stats()
+
+    assert after["retries"] == before["retries"] + lsp.db.WRITE_RETRIES
+    assert after["failures"] == before["failures"] + 1
+
+def test_query_many(app, user):
+    with app.app_context():
+        before = lsp.db.get_stats()
+        lsp.db.query_many("UPDATE users SET bio = ? WHERE userid = ?", [])
+        assert not lsp.db.get().in_transaction
+
+        lsp.db.query_many(
+                "INSERT INTO notifications (objectid, objecttype, targetuserid, created) VALUES (?, 0, 1, '')",
+                [[i] for i in range(5)])
+        assert lsp.db.get().in_transaction
+        lsp.db.commit()
+        assert lsp.db.get_stats()["transactions"] == before["transactions"] + 1
+
+        rows = lsp.db.query("SELECT objectid FROM notifications ORDER BY objectid")
+        assert [r["objectid"] for r in rows] == [0, 1, 2, 3, 4]
+
+def test_write_behind_disabled(app, user):
+    with app.app_context():
+        lsp.db.write_behind("UPDATE users SET bio = 'bio'")
+
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    assert db.execute("SELECT bio FROM users").fetchone()[0] == "bio"
+    db.close()
+
+def test_write_behind_batched(app, user):
+    app.config["DB_WRITE_BEHIND_INTERVAL"] = 60
+    with app.app_context():
+        lsp.db.write_behind("UPDATE users SET bio = 'bio'")
+        lsp.db.write_behind("UPDATE users SET fgcolor = '#000000'")
+
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    assert db.execute("SELECT bio FROM users").fetchone()[0] != "bio"
+
+    with app.app_context():
+        lsp.db.flush_writes()
+    assert tuple(db.execute("SELECT bio, fgcolor FROM users").fetchone()) == ("bio", "#000000")
+    db.close()
+
+def test_concurrent_comments(app, client):
+    create_user_and_song(client)
+    threads = 8
+    comments_per_thread = 10
+
+    clients = []
+    for i in range(threads):
+        thread_client = app.test_client()
+        create_user(thread_client, f"user{i}", login=True)
+        clients.append(thread_client)
+
+    statuses = []
+    def post_comments(thread_client):
+        for i in range(comments_per_thread):
+            response = thread_client.post("/comment?threadid=2", data={"content": f"comment {i}"})
+            statuses.append(response.status_code)
+            statuses.append(thread_client.get("/activity").status_code)
+
+    with app.app_context():
+        before = lsp.db.get_stats()
+    workers = [threading.Thread(target=post_comments, args=[c]) for c in clients]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    assert set(statuses) == {302, 200}
+    assert statuses.count(302) == threads * comments_per_thread
+    with app.app_context():
+        after = lsp.db.get_stats()
+        count = lsp.db.query("SELECT COUNT(*) AS count FROM comments", one=True)["count"]
+        notifications = lsp.db.query("SELECT COUNT(*) AS count FROM notifications", one=True)["count"]
+    assert count == threads * comments_per_thread
+    assert notifications == threads * comments_per_thread
+    assert after["failures"] == before["failures"]
+
+def test_stats_logged(app, client, caplog):
+    caplog.set_level("INFO")
+    with mock.patch.object(lsp, "_last_stats", time.monotonic() - lsp.STATS_INTERVAL):
+        client.get("/about")
+        client.get("/about")
+
+    messages = [r.getMessage() for r in caplog.records if " stats for process " in r.getMessage()]
+    assert len(messages) == 2
+    assert messages[0].startswith("Database stats")
+    assert "transactions=" in messages[0]
+    assert messages[1].startswith("ffmpeg stats")
+    assert "runs=" in messages[1]
+
+# Migration ####################################################################
+
+def _revert_db():
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    with lsp.app.open_resource("sql/schema_revert.sql", mode="r") as f:
+        db.executescript(f.read())
+    db.commit()
+    db.close()
+
+def test_migrate_old_database(app):
+    _revert_db()
+    assert lsp.db.migrate(app)
+
+    with app.app_context():
+        assert lsp.db.query("PRAGMA user_version", one=True)[0] == lsp.db.DB_VERSION
+
+def test_migrate_current_database(app):
+    assert not lsp.db.migrate(app)
+
+    with app.app_context():
+        assert lsp.db.query("PRAGMA user_version", one=True)[0] == lsp.db.DB_VERSION
+
+def _set_version(version):
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.execute(f"PRAGMA user_version = {version:d}")
+    db.commit()
+    db.close()
+
+def _get_schema(db_path):
+    # Columns (in any order) of each table, and names of everything else
+    db = sqlite3.connect(db_path)
+    schema = {}
+    for type_, name in db.execute("SELECT type, name FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"):
+        if type_ == "table":
+            schema[name] = {tuple(r[1:]) for r in db.execute(f"PRAGMA table_info({name})")}
+        else:
+            schema[name] = type_
+    db.close()
+    return schema
+
+def test_migrate_all_versions(app, tmp_path):
+    expected = _get_schema(lsp.datadir.get_db_path())
+
+    # Oldest schema with migrations
+    lsp.datadir.set_data_dir(tmp_path)
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.executescript((TEST_DATA / "schema-v5.sql").read_text())
+    db.close()
+
+    assert lsp.db.migrate(app)
+    assert _get_schema(lsp.datadir.get_db_path()) == expected
+    with app.app_context():
+        assert lsp.db.query("PRAGMA user_version", one=True)[0] == lsp.db.DB_VERSION
+
+def test_update_db_backfills_html(app, tmp_path):
+    lsp.datadir.set_data_dir(tmp_path)
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.executescript((TEST_DATA / "schema-v5.sql").read_text())
+    db.execute(
+            "INSERT INTO users (created, username, password, bio) VALUES ('', 'user', x'00', ?)",
+            ["<script>bad</script>bio"])
+    db.commit()
+    db.close()
+
+    lsp.update_db()
+    with app.app_context():
+        user = lsp.db.query("SELECT bio_html FROM users", one=True)
+    assert user["bio_html"] == "&lt;script&gt;bad&lt;/script&gt;bio"
+
+def test_migrate_no_migration(app):
+    _set_version(1)
+    with pytest.raises(RuntimeError, match="No migration to database version 2"):
+        lsp.db.migrate(app)
+
+    # Nothing changed
+    with app.app_context():
+        assert lsp.db.query("PRAGMA user_version", one=True)[0] == 1
+
+def test_migrate_newer_database(app):
+    _set_version(lsp.db.DB_VERSION + 1)
+    with pytest.raises(RuntimeError, match="newer than this app"):
+        lsp.db.migrate(app)
+
+def test_migrate_missing_database(app, tmp_path):
+    lsp.datadir.set_data_dir(tmp_path)
+    lsp.db.migrate(app)
+    assert not lsp.datadir.get_db_path().exists()
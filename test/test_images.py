@@ -0,0 +1,104 @@
+import hashlib
+import os
+import time
+from pathlib import Path
+from unittest import mock
+
+import littlesongplace as lsp
+
+STATIC = Path(__file__).parent.parent / "src" / "littlesongplace" / "static"
+
+def _cached_name(bgcolor, accolor="b36fab"):
+    version = lsp.images.gif_versions["lsp_btn_play02"]
+    return f"lsp_btn_play02-{version}-{bgcolor}-{accolor}.gif"
+
+def test_colored_gif(client):
+    response = client.get("/static-colored/lsp_btn_play02.gif?bg=%23112233&ac=AABBCC")
+    assert response.status_code == 200
+    assert response.mimetype == "image/gif"
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 365*24*60*60
+
+    with open(STATIC / "lsp_btn_play02.gif", "rb") as gif:
+        expected = bytearray(gif.read())
+    expected[16:22] = bytes.fromhex("112233aabbcc")
+    assert response.data == expected
+
+    # Cached on disk
+    assert (lsp.datadir.get_image_cache_path() / _cached_name("112233", "aabbcc")).exists()
+
+def test_colored_gif_versions(client):
+    with open(STATIC / "lsp_btn_play02.gif", "rb") as gif:
+        version = hashlib.sha256(gif.read()).hexdigest()[:8]
+    assert lsp.images.gif_versions["lsp_btn_play02"] == version
+
+    # Given to nav.js for image URLs
+    response = client.get("/")
+    assert f'"lsp_btn_play02": "{version}"'.encode() in response.data
+
+def test_colored_gif_changed(client):
+    client.get("/static-colored/lsp_btn_play02.gif")
+
+    # A changed .gif isn't served from the old cached image
+    gifs = {**lsp.images._gifs, "lsp_btn_play02": b"GIF89a" + bytes(32)}
+    versions = {**lsp.images.gif_versions, "lsp_btn_play02": "00000000"}
+    with mock.patch.object(lsp.images, "_gifs", gifs), \
+            mock.patch.object(lsp.images, "gif_versions", versions):
+        response = client.get("/static-colored/lsp_btn_play02.gif?v=00000000")
+    assert response.data[:6] == b"GIF89a"
+    assert response.data[22:] == bytes(16)
+
+def test_colored_gif_default_colors(client):
+    response = client.get("/static-colored/lsp_btn_play02.gif")
+    assert response.status_code == 200
+    assert response.data[16:22] == bytes.fromhex("e8e6b5b36fab")
+
+def test_colored_gif_invalid_color(client):
+    # Default colors instead
+    for query in ["bg=red&ac=", "bg=%23fff&ac=rgb(1,2,3)"]:
+        response = client.get(f"/static-colored/lsp_btn_play02.gif?{query}")
+        assert response.status_code == 200
+        assert response.data[16:22] == bytes.fromhex("e8e6b5b36fab")
+
+def test_colored_gif_invalid_name(client):
+    response = client.get("/static-colored/notagif.gif")
+    assert response.status_code == 404
+
+def test_colored_gif_cache_eviction(client):
+    with mock.patch.object(lsp.images, "CACHE_SIZE", 4), \
+            mock.patch.object(lsp.images, "CACHE_TRIM", 0.5), \
+            mock.patch.object(lsp.images, "_cache_count", None):
+        colors = ["000001", "000002", "000003", "000004"]
+        for i, color in enumerate(colors):
+            client.get(f"/static-colored/lsp_btn_play02.gif?bg={color}")
+            path = lsp.datadir.get_image_cache_path() / _cached_name(color)
+            os.utime(path, (i, i))  # Make sure mtimes are distinct
+
+        # Least recently used images evicted when the cache is over its size,
+        # down to CACHE_TRIM of it
+        client.get(f"/static-colored/lsp_btn_play02.gif?bg=000005")
+        cached = sorted(os.listdir(lsp.datadir.get_image_cache_path()))
+        assert cached == [_cached_name("000004"), _cached_name("000005")]
+
+        # Counted without scanning the cache until it's full again
+        with mock.patch.object(lsp.images, "_evict", wraps=lsp.images._evict) as evict:
+            client.get(f"/static-colored/lsp_btn_play02.gif?bg=000006")
+            client.get(f"/static-colored/lsp_btn_play02.gif?bg=000007")
+            assert evict.call_count == 0
+            client.get(f"/static-colored/lsp_btn_play02.gif?bg=000008")
+            assert evict.call_count == 1
+
+def test_colored_gif_cache_touch(client):
+    client.get("/static-colored/lsp_btn_play02.gif")
+    path = lsp.datadir.get_image_cache_path() / _cached_name("e8e6b5")
+
+    # Hits only mark the image as used if it hasn't been lately
+    recent = time.time() - 60
+    os.utime(path, (recent, recent))
+    client.get("/static-colored/lsp_btn_play02.gif")
+    assert path.stat().st_mtime == recent
+
+    old = time.time() - lsp.images.TOUCH_INTERVAL - 60
+    os.utime(path, (old, old))
+    client.get("/static-colored/lsp_btn_play02.gif")
+    assert path.stat().st_mtime > recent
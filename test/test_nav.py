@@ -0,0 +1,54 @@
+import json
+import re
+
+from .utils import create_user, create_user_and_song
+
+FRAGMENT = {"X-LSP-Fragment": "1"}
+
+def _get_page_data(response):
+    match = re.search(
+            r'<script type="application/json" id="page-data">(.*?)</script>',
+            response.data.decode(),
+            re.DOTALL)
+    assert match
+    return json.loads(match.group(1))
+
+def test_full_page(client):
+    response = client.get("/about")
+    assert response.status_code == 200
+    assert b"<html>" in response.data
+    assert b"player-container" in response.data
+    assert b'id="page-data"' not in response.data
+    assert "X-LSP-Fragment" in response.headers["Vary"]
+
+def test_fragment(client):
+    response = client.get("/about", headers=FRAGMENT)
+    assert response.status_code == 200
+    assert b"<html>" not in response.data
+    assert b"player-container" not in response.data
+    assert "X-LSP-Fragment" in response.headers["Vary"]
+
+    page = _get_page_data(response)
+    assert page["title"] == "About"
+    assert page["bgcolor"] == "#e8e6b5"
+    assert page["username"] is None
+    assert page["flashes"] == []
+
+def test_fragment_title_unescaped(client):
+    create_user_and_song(client)
+    client.post("/upload-song?songid=1", data={
+        "title": "a & b", "description": "", "tags": "", "collabs": ""})
+    response = client.get("/song/1/1?action=view", headers=FRAGMENT)
+    assert _get_page_data(response)["title"] == "a & b"
+
+def test_fragment_user_and_flashes(client):
+    create_user(client, "user", login=True)
+    client.post("/edit-profile", data={
+        "bio": "bio", "bgcolor": "#000000", "fgcolor": "#111111",
+        "accolor": "#222222", "pfp": (b"", "")})
+
+    response = client.get("/users/user", headers=FRAGMENT)
+    page = _get_page_data(response)
+    assert page["username"] == "user"
+    assert page["bgcolor"] == "#000000"
+    assert ["message", "Profile updated successfully"] in page["flashes"]
@@ -0,0 +1,90 @@
+import numpy as np
+
+import littlesongplace as lsp
+
+from .utils import create_user_and_song, get_song_path
+
+def _peaks_path():
+    return get_song_path(1, 1).with_suffix(".peaks")
+
+# Peak computation #############################################################
+
+def test_compute_peaks():
+    samples = np.array([0, 32767, -32768, 256, -512, 512, 1024, -1024], dtype=np.int16)
+    peaks = lsp.peaks.compute_peaks(samples, count=4)
+    assert peaks.dtype == np.int8
+    assert list(peaks) == [0, 127, -128, 1, -2, 2, -4, 4]
+
+def test_compute_peaks_short_audio():
+    samples = np.array([-32768, 32767], dtype=np.int16)
+    peaks = lsp.peaks.compute_peaks(samples, count=4)
+    assert list(peaks) == [-128, -128, 127, 127, 0, 0, 0, 0]
+
+def _accumulate(samples, chunk_size, count):
+    accumulator = lsp.peaks.PeakAccumulator(count)
+    for i in range(0, len(samples), chunk_size):
+        accumulator.add(samples[i:i + chunk_size])
+    assert accumulator.length == len(samples)
+    return accumulator
+
+def test_peak_accumulator_short_audio():
+    samples = np.array([0, 32767, -32768, 256, -512, 512, 1024, -1024], dtype=np.int16)
+    for chunk_size in [1, 3, 8]:
+        accumulator = _accumulate(samples, chunk_size, count=4)
+        assert list(accumulator.peaks()) == list(lsp.peaks.compute_peaks(samples, count=4))
+
+    assert list(lsp.peaks.PeakAccumulator(2).peaks()) == [0, 0, 0, 0]
+
+def test_peak_accumulator_long_audio():
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-32768, 32768, 4 * 2**14, dtype=np.int16)
+
+    # Chunks that don't line up with blocks
+    accumulator = _accumulate(samples, 1000, count=4)
+
+    # Only a few blocks are kept
+    assert accumulator._blocks < 2 * lsp.peaks.BLOCKS_PER_PEAK * 4
+
+    # Peak boundaries line up with blocks here, so the peaks are exact
+    assert list(accumulator.peaks()) == list(lsp.peaks.compute_peaks(samples, count=4))
+
+def test_peak_accumulator_uneven_length():
+    # Peaks are within rounding of exact even when boundaries don't line up
+    samples = (np.sin(np.arange(1_000_003) / 40_000) * 32767).astype(np.int16)
+    accumulator = _accumulate(samples, 4097, count=lsp.peaks.PEAK_COUNT)
+    assert accumulator._blocks < 2 * lsp.peaks.BLOCKS_PER_PEAK * lsp.peaks.PEAK_COUNT
+    expected = lsp.peaks.compute_peaks(samples).astype(int)
+    assert np.abs(accumulator.peaks().astype(int) - expected).max() <= 1
+
+def test_encode_decode():
+    peaks = lsp.peaks.compute_peaks(np.arange(-1000, 1000, dtype=np.int16), count=10)
+    data = lsp.peaks.encode(peaks)
+    assert len(data) == 8 + 20
+    assert list(lsp.peaks.decode(data)) == list(peaks)
+
+# Peaks endpoint ###############################################################
+
+def test_peaks_generated_on_upload(client):
+    create_user_and_song(client)
+
+    response = client.get("/song/1/1/peaks")
+    assert response.status_code == 200
+    assert response.mimetype == "application/octet-stream"
+    peaks = lsp.peaks.decode(response.data)
+    assert len(peaks) == lsp.peaks.PEAK_COUNT * 2
+    assert peaks.max() > 0
+
+    # Peaks only change when the song's audio changes
+    response = client.get("/song/1/1/peaks", headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+def test_peaks_missing_song(client):
+    response = client.get("/song/1/1/peaks")
+    assert response.status_code == 404
+
+def test_delete_song_deletes_peaks(client):
+    create_user_and_song(client)
+    assert _peaks_path().exists()
+
+    client.get("/delete-song/1")
+    assert not _peaks_path().exists()
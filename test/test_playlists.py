@@ -1,3 +1,5 @@
+import littlesongplace as lsp
+
 from .utils import create_user, upload_song, get_song_list_from_page, create_user_song_and_playlist
 
 # Create Playlist ##############################################################
@@ -201,6 +203,38 @@ def test_edit_playlist_remove_song(client):
     assert len(songs) == 1
     assert songs[0]["songid"] == 2
 
+def test_edit_playlist_repeated_song(client):
+    create_user_song_and_playlist(client)
+    upload_song(client, b"Successfully uploaded")
+    response = client.post("/edit-playlist/1", data={"name": "my playlist", "type": "private", "songids": "1,2,1"})
+    assert response.status_code == 302
+
+    songs = get_song_list_from_page(client, "/playlists/1")
+    assert [s["songid"] for s in songs] == [1, 2, 1]
+
+def test_edit_playlist_keeps_unchanged_rows(app, client):
+    create_user_song_and_playlist(client)
+    upload_song(client, b"Successfully uploaded")
+    upload_song(client, b"Successfully uploaded")
+    client.post("/edit-playlist/1", data={"name": "my playlist", "type": "private", "songids": "1,2,3"})
+    with app.app_context():
+        # Move rows out of the way of new rowids, so re-added rows would differ
+        lsp.db.query("UPDATE playlist_songs SET rowid = rowid + 100")
+        lsp.db.commit()
+        before = {
+            r["position"]: r["rowid"] for r in
+            lsp.db.query("SELECT rowid, position FROM playlist_songs")}
+
+    # Replace the last two songs with one
+    client.post("/edit-playlist/1", data={"name": "my playlist", "type": "private", "songids": "1,3"})
+    songs = get_song_list_from_page(client, "/playlists/1")
+    assert [s["songid"] for s in songs] == [1, 3]
+    with app.app_context():
+        after = {
+            r["position"]: r["rowid"] for r in
+            lsp.db.query("SELECT rowid, position FROM playlist_songs")}
+    assert after == {0: before[0], 1: before[1]}
+
 def test_edit_playlist_not_logged_in(client):
     create_user_song_and_playlist(client)
     client.get("/logout")
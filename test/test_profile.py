@@ -73,6 +73,28 @@ def test_get_pfp_no_file(client):
     response = client.get("/pfp/1")
     assert response.status_code == 404
 
+def test_get_pfp_accel_redirect(app, client):
+    create_user(client, "user", "password", login=True)
+    client.post("/edit-profile", data={
+        "bio": "",
+        "pfp": open(TEST_DATA/"lsp_notes.png", "rb"),
+        "fgcolor": "#000000",
+        "bgcolor": "#000000",
+        "accolor": "#000000",
+    })
+
+    app.config["SENDFILE_MODE"] = "accel"
+    response = client.get("/pfp/1")
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"] == "/data/images/1/pfp.jpg"
+    assert response.mimetype == "image/jpeg"
+
+def test_get_pfp_no_file_accel_redirect(app, client):
+    create_user(client, "user", "password", login=True)
+    app.config["SENDFILE_MODE"] = "accel"
+    response = client.get("/pfp/1")
+    assert response.status_code == 404
+
 def test_get_pfp_invalid_user(client):
     response = client.get("/pfp/1")
     # User doesn't exist
@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+from unittest import mock
+
+import bleach
+
+import littlesongplace as lsp
+
+from .utils import create_user_and_song, create_user_song_and_comment, upload_song
+
+def _clear_stored_html():
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.execute("update songs set description_html = null")
+    db.execute("update comments set content_html = null")
+    db.commit()
+    db.close()
+
+def _get_stored_html():
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    description = db.execute("select description_html from songs").fetchone()[0]
+    content = db.execute("select content_html from comments").fetchone()[0]
+    db.close()
+    return description, content
+
+# Sanitizer cache ##############################################################
+
+def test_sanitize_matches_bleach():
+    text = '<a href="x" onclick="y">link</a><script>bad</script><p style="color: red; position: fixed">p</p>'
+    expected = bleach.clean(
+            text,
+            tags=lsp.sanitize.ALLOWED_TAGS,
+            attributes=lsp.sanitize.ALLOWED_ATTRIBUTES,
+            css_sanitizer=bleach.css_sanitizer.CSSSanitizer(
+                allowed_css_properties=lsp.sanitize.ALLOWED_CSS_PROPERTIES))
+    assert lsp.sanitize.sanitize_user_text(text) == expected
+
+def test_sanitize_cache():
+    lsp.sanitize.cache_clear()
+    for _ in range(3):
+        assert lsp.sanitize.sanitize_user_text("<b>hi</b><script>") == "<b>hi</b>&lt;script&gt;"
+    lsp.sanitize.sanitize_user_text("other")
+
+    info = lsp.sanitize.cache_info()
+    assert info.hits == 2
+    assert info.misses == 2
+    assert info.currsize == 2
+
+def test_sanitize_cache_evicts_oldest():
+    lsp.sanitize.cache_clear()
+    with mock.patch.object(lsp.sanitize, "CACHE_SIZE", 2):
+        lsp.sanitize.sanitize_user_text("a")
+        lsp.sanitize.sanitize_user_text("b")
+        lsp.sanitize.sanitize_user_text("a")  # Hit, "b" is now oldest
+        lsp.sanitize.sanitize_user_text("c")  # Evicts "b"
+        lsp.sanitize.sanitize_user_text("a")
+        assert lsp.sanitize.cache_info().hits == 2
+        lsp.sanitize.sanitize_user_text("b")
+        assert lsp.sanitize.cache_info().misses == 4
+
+def test_sanitize_threads():
+    lsp.sanitize.cache_clear()
+    results = {}
+    cleaners = []
+    def sanitize(i):
+        cleaners.append(lsp.sanitize._get_cleaner())
+        results[i] = [lsp.sanitize.sanitize_user_text(f"<b>{i}-{j}</b><script>") for j in range(50)]
+
+    threads = [threading.Thread(target=sanitize, args=[i]) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Each thread has its own cleaner
+    assert len({id(c) for c in cleaners}) == 8
+    for i in range(8):
+        assert results[i] == [f"<b>{i}-{j}</b>&lt;script&gt;" for j in range(50)]
+
+# Write-time sanitization ######################################################
+
+def test_sanitized_on_write(client):
+    create_user_and_song(client)
+    upload_song(client, b"Success", songid=1, description="<script>bad</script>desc")
+    client.post("/comment?threadid=2", data={"content": "<script>bad</script>comment"})
+
+    response = client.get("/song/1/1?action=view")
+    assert b"<script>bad" not in response.data
+    assert b"&lt;script&gt;bad" in response.data
+
+def test_no_sanitizing_on_read(client):
+    create_user_song_and_comment(client, "comment text here")
+    with mock.patch.object(lsp.sanitize, "sanitize_user_text") as sanitize:
+        response = client.get("/song/1/1?action=view")
+        assert b"comment text here" in response.data
+        sanitize.assert_not_called()
+
+# sanitize-db command ##########################################################
+
+def test_sanitize_db_backfill(client, app):
+    create_user_song_and_comment(client, "<script>bad</script>comment")
+    _clear_stored_html()
+
+    result = app.test_cli_runner().invoke(lsp.sanitize.sanitize_db_cmd)
+    assert result.exit_code == 0
+    assert "Sanitized 1 rows in songs" in result.output
+
+    description, content = _get_stored_html()
+    assert description == "song description"
+    assert content == "&lt;script&gt;bad&lt;/script&gt;comment"
+
+def test_sanitize_db_all(client, app):
+    create_user_song_and_comment(client, "comment")
+
+    # Only missing rows are sanitized by default
+    result = app.test_cli_runner().invoke(lsp.sanitize.sanitize_db_cmd)
+    assert "Sanitized 0 rows in comments" in result.output
+
+    result = app.test_cli_runner().invoke(lsp.sanitize.sanitize_db_cmd, ["--all"])
+    assert "Sanitized 1 rows in comments" in result.output
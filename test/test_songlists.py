@@ -1,4 +1,11 @@
-from .utils import create_user_and_song, create_user, upload_song, get_song_list_from_page
+import html
+import random
+import re
+from unittest import mock
+
+import littlesongplace as lsp
+
+from .utils import create_user_and_song, create_user, create_user_song_and_playlist, upload_song, get_song_list_from_page
 
 # Profile ######################################################################
 
@@ -115,3 +122,239 @@ def test_random_songs(client):
     assert len(songs) == 2
     assert songs[0]["title"] in ["song1", "song2"]
     assert songs[1]["title"] in ["song1", "song2"]
+
+def _insert_songs(songids, status="ready"):
+    for songid in songids:
+        lsp.db.query(
+                """
+                INSERT INTO songs (songid, created, userid, title, status)
+                VALUES (?, '2025-01-01T00:00:00+00:00', 1, ?, ?)
+                """,
+                [songid, f"song{songid}", status])
+    lsp.db.commit()
+
+def test_random_songs_sampled(app, client):
+    create_user(client, "user1", "password", login=True)
+    with app.app_context():
+        _insert_songs(range(1, 301))
+        _insert_songs(range(301, 401), status="processing")
+        lsp.db.query("DELETE FROM songs WHERE songid % 3 = 0")
+        lsp.db.commit()
+
+        with mock.patch.object(lsp.songs, "random", random.Random(0)), \
+                mock.patch.object(lsp.db, "query", wraps=lsp.db.query) as query:
+            songs = lsp.songs.get_random(50)
+        assert not any("ORDER BY random()" in c.args[0] for c in query.call_args_list)
+
+    songids = [s.songid for s in songs]
+    assert len(set(songids)) == 50
+    assert all(songid <= 300 and songid % 3 for songid in songids)
+
+def test_random_songs_low_hit_rate(app, client):
+    create_user(client, "user1", "password", login=True)
+    with app.app_context():
+        _insert_songs(range(1, 1001))
+        lsp.db.query("DELETE FROM songs WHERE songid % 10 != 0")
+        lsp.db.commit()
+
+        # Probes grow to match the hit rate instead of giving up
+        with mock.patch.object(lsp.songs, "random", random.Random(0)), \
+                mock.patch.object(lsp.db, "query", wraps=lsp.db.query) as query:
+            songs = lsp.songs.get_random(20)
+        assert not any("ORDER BY random()" in c.args[0] for c in query.call_args_list)
+
+    songids = [s.songid for s in songs]
+    assert len(set(songids)) == 20
+    assert all(songid % 10 == 0 for songid in songids)
+
+def test_random_songs_sparse_ids(app, client):
+    create_user(client, "user1", "password", login=True)
+    with app.app_context():
+        _insert_songs([1, 10_000, 20_000, 1_000_000])
+        songs = lsp.songs.get_random(3)
+
+    songids = [s.songid for s in songs]
+    assert len(set(songids)) == 3
+    assert set(songids) <= {1, 10_000, 20_000, 1_000_000}
+
+# Song listing #################################################################
+
+def _check_song_listing(app):
+    # song_listing matches a listing built from scratch
+    with app.app_context():
+        listing = lsp.db.query("SELECT * FROM song_listing ORDER BY songid")
+        expected = lsp.db.query(
+                """
+                SELECT
+                    songs.songid, songs.userid, songs.created, songs.status,
+                    songs.eventid, users.username, users.fgcolor,
+                    users.bgcolor, users.accolor, jam_events.title,
+                    jam_events.jamid, jam_events.enddate,
+                    (SELECT GROUP_CONCAT(tag) FROM song_tags WHERE songid = songs.songid),
+                    (SELECT GROUP_CONCAT(name) FROM song_collaborators WHERE songid = songs.songid)
+                FROM songs
+                INNER JOIN users ON users.userid = songs.userid
+                LEFT JOIN jam_events ON jam_events.eventid = songs.eventid
+                ORDER BY songs.songid
+                """)
+        assert [tuple(r) for r in listing] == [tuple(r) for r in expected]
+        return listing
+
+def test_song_listing_follows_song_changes(app, client, user):
+    upload_song(client, b"Success", title="song1", tags="a, b", collabs="x")
+    upload_song(client, b"Success", title="song2", tags="c", collabs="")
+    listing = _check_song_listing(app)
+    assert [(r["tags"], r["collaborators"]) for r in listing] == [("a,b", "x"), ("c", None)]
+
+    upload_song(client, b"Success", songid=1, title="song1", tags="d", collabs="y, z")
+    listing = _check_song_listing(app)
+    assert (listing[0]["tags"], listing[0]["collaborators"]) == ("d", "y,z")
+
+    client.get("/delete-song/2")
+    listing = _check_song_listing(app)
+    assert len(listing) == 1
+
+def test_song_listing_follows_user_colors(app, client, user):
+    upload_song(client, b"Success", title="song1")
+    client.post("/edit-profile", data={
+        "bio": "",
+        "pfp": (b"", "", "aplication/octet-stream"),
+        "fgcolor": "#000000",
+        "bgcolor": "#FFFF00",
+        "accolor": "#FF00FF",
+    })
+    listing = _check_song_listing(app)
+    assert listing[0]["bgcolor"] == "#FFFF00"
+
+def test_song_listing_follows_event_changes(app, client, user, jam, event):
+    upload_song(client, b"Success", eventid=event)
+    client.post(f"/jams/{jam}/events/{event}/update", data={
+        "title": "New Title",
+        "description": "",
+        "startdate": "2040-01-01T00:00:00+00:00",
+        "enddate": "2040-01-02T00:00:00+00:00",
+    })
+    listing = _check_song_listing(app)
+    assert listing[0]["event_title"] == "New Title"
+
+    client.get(f"/jams/{jam}/events/{event}/delete")
+    listing = _check_song_listing(app)
+    assert listing[0]["event_title"] is None
+
+# Pagination ###################################################################
+
+def _get_all_pages(get_page, *args):
+    songids = []
+    after = None
+    while True:
+        page = get_page(*args, after=after, count=2)
+        songids.extend(s.songid for s in page.songs)
+        if page.after is None:
+            return songids
+        after = page.after
+
+def test_pages_for_user(app, client, user):
+    with app.app_context():
+        _insert_songs(range(1, 6))
+        # Songs with the same created time are sorted by ID
+        lsp.db.query("UPDATE songs SET created = '2025-01-02T00:00:00+00:00' WHERE songid = 2")
+        lsp.db.commit()
+
+        assert _get_all_pages(lsp.songs.get_page_for_userid, 1) == [2, 5, 4, 3, 1]
+        assert _get_all_pages(lsp.songs.get_page_for_username, "user") == [2, 5, 4, 3, 1]
+
+def test_pages_for_tag(app, client, user):
+    with app.app_context():
+        _insert_songs(range(1, 6))
+        for songid in [1, 2, 4, 5]:
+            lsp.db.query("INSERT INTO song_tags (songid, tag) VALUES (?, 'tag')", [songid])
+        lsp.db.commit()
+
+        assert _get_all_pages(lsp.songs.get_page_for_tag, "tag") == [5, 4, 2, 1]
+        assert _get_all_pages(lsp.songs.get_page_for_username_and_tag, "user", "tag") == [5, 4, 2, 1]
+
+def test_pages_for_playlist(app, client, user):
+    with app.app_context():
+        _insert_songs(range(1, 4))
+    client.post("/create-playlist", data={"name": "my playlist", "type": "public"})
+    for songid in [3, 1, 2, 1]:
+        client.post("/append-to-playlist", data={"playlistid": "1", "songid": str(songid)})
+
+    with app.app_context():
+        assert _get_all_pages(lsp.songs.get_page_for_playlist, 1) == [3, 1, 2, 1]
+
+def test_load_more_songs(app, client, user):
+    with app.app_context():
+        _insert_songs(range(1, lsp.songs.PAGE_SIZE + 11))
+
+    response = client.get("/users/user")
+    assert len(re.findall(r'data-song="', response.data.decode())) == lsp.songs.PAGE_SIZE
+    more_url = html.unescape(re.search(r'data-url="([^"]*)"', response.data.decode()).group(1))
+    assert more_url.startswith("/users/user?after=")
+
+    songs = get_song_list_from_page(client, more_url)
+    assert [s["songid"] for s in songs] == list(range(10, 0, -1))
+    assert b"Load more" not in client.get(more_url).data
+
+def test_load_more_invalid_cursor(client, user):
+    response = client.get("/songs?user=user&after=abc")
+    assert response.status_code == 400
+
+# Query count ##################################################################
+
+def _count_queries(client, url):
+    # Total number of queries for a page, and the number that load comments
+    with mock.patch.object(lsp.db, "query", wraps=lsp.db.query) as query:
+        response = client.get(url)
+        assert response.status_code == 200
+        comment_queries = [c for c in query.call_args_list if "from comments" in c.args[0]]
+        return query.call_count, len(comment_queries)
+
+def _add_songs_with_comments(client, count):
+    # Songs with a comment and a reply each, added to the playlist (the first
+    # song is thread 2, and the playlist is thread 3)
+    for i in range(count):
+        songid = i + 2
+        threadid = i + 4
+        upload_song(client, b"Success", title=f"song{i}")
+        client.post(f"/comment?threadid={threadid}", data={"content": "comment"})
+        client.post(f"/comment?threadid={threadid}&replytoid={2 * i + 1}", data={"content": "reply"})
+        client.post("/append-to-playlist", data={"playlistid": "1", "songid": str(songid)})
+
+def test_song_list_query_count_constant(client):
+    # Song lists don't load the songs' comments (they're shown with the song's
+    # details); profiles and playlists only load their own
+    pages = {"/": 0, "/songs": 0, "/songs?user=user": 0, "/users/user": 1, "/playlists/1": 1}
+    create_user_song_and_playlist(client)
+    counts = {page: _count_queries(client, page) for page in pages}
+
+    _add_songs_with_comments(client, 4)
+
+    for page in pages:
+        total, comment_queries = _count_queries(client, page)
+        assert total == counts[page][0], page
+        assert comment_queries == pages[page], page
+
+def test_song_page_one_comment_query(client):
+    create_user_song_and_playlist(client)
+    _add_songs_with_comments(client, 4)
+
+    for url in ["/song/1/2?action=view", "/song/2/details"]:
+        _, comment_queries = _count_queries(client, url)
+        assert comment_queries == 1, url
+
+def test_song_comments_loaded_together(app, client):
+    create_user_song_and_playlist(client)
+    _add_songs_with_comments(client, 4)
+
+    with app.app_context():
+        page = lsp.songs.get_page_for_username("user")
+        with mock.patch.object(lsp.db, "query", wraps=lsp.db.query) as query:
+            song_comments = {song.songid: song.get_comments() for song in page.songs}
+            assert query.call_count == 1
+
+    assert len(song_comments) == 5
+    assert song_comments[1] == []
+    for songid in range(2, 6):
+        assert [c["content"] for c in song_comments[songid]] == ["comment"]
+        assert [r["content"] for r in song_comments[songid][0]["replies"]] == ["reply"]
@@ -4,17 +4,19 @@ from unittest import mock
 
 import pytest
 
-from .utils import create_user, create_user_and_song, get_song_list_from_page, upload_song
+import littlesongplace as lsp
+from .utils import create_user, create_user_and_song, get_song_list_from_page, get_song_path, upload_song
 
 TEST_DATA = Path(__file__).parent / "data"
 
 def _create_fake_mp3_and_return(returncode):
     def _create_fake_mp3(*args, **kwargs):
         subprocess_args = args[0]
-        if subprocess_args[0] == "ffmpeg":
-            # Create "fake" mp3 file by just copying input file
+        if "ffmpeg" in subprocess_args and subprocess_args[-1] != "-":
+            # Create "fake" mp3 file by just copying input file (but don't
+            # write anything when decoding to stdout)
             output_filename = subprocess_args[-1]
-            input_filename = subprocess_args[2]
+            input_filename = subprocess_args[subprocess_args.index("-i") + 1]
             with open(input_filename, "rb") as infile, open(output_filename, "wb") as outfile:
                 outfile.write(infile.read())
 
@@ -219,6 +221,48 @@ def test_update_song_other_users_song(client):
     response = client.post(f"/upload-song?songid=1", data=data)
     assert response.status_code == 401
 
+def test_update_song_changed_tags(app, client):
+    create_user(client, "user", "password", login=True)
+    upload_song(client, b"Success", tags="tag1, tag2, tag3", collabs="collab1, collab2")
+    with app.app_context():
+        before = lsp.db.query("SELECT rowid FROM song_tags WHERE tag = 'tag1'", one=True)
+
+    upload_song(client, b"Success", songid=1, tags="tag1, tag4, tag4", collabs="collab2, collab3")
+    songs = get_song_list_from_page(client, "/users/user")
+    assert songs[0]["tags"] == ["tag1", "tag4"]
+    assert sorted(songs[0]["collaborators"]) == ["collab2", "collab3"]
+
+    # Unchanged tags aren't deleted and re-added
+    with app.app_context():
+        after = lsp.db.query("SELECT rowid FROM song_tags WHERE tag = 'tag1'", one=True)
+    assert after["rowid"] == before["rowid"]
+
+def test_update_song_reordered_tags(client):
+    # Tags and collaborators are listed in sorted order, not in the order
+    # they were entered
+    create_user(client, "user", "password", login=True)
+    upload_song(client, b"Success", tags="b, a", collabs="d, c")
+    songs = get_song_list_from_page(client, "/users/user")
+    assert songs[0]["tags"] == ["a", "b"]
+    assert songs[0]["collaborators"] == ["c", "d"]
+
+    upload_song(client, b"Success", songid=1, tags="a, b", collabs="c, d")
+    songs = get_song_list_from_page(client, "/users/user")
+    assert songs[0]["tags"] == ["a", "b"]
+    assert songs[0]["collaborators"] == ["c", "d"]
+
+def test_song_tags_sorted(app, client):
+    create_user(client, "user", "password", login=True)
+    upload_song(client, b"Success", tags="a, b", collabs="c, d")
+    with app.app_context():
+        # GROUP_CONCAT could list them in any order
+        lsp.db.query("UPDATE song_listing SET tags = 'b,a', collaborators = 'd,c'")
+        lsp.db.commit()
+
+    songs = get_song_list_from_page(client, "/users/user")
+    assert songs[0]["tags"] == ["a", "b"]
+    assert songs[0]["collaborators"] == ["c", "d"]
+
 def test_uppercase_tags(client):
     create_user(client, "user", "password", login=True)
     upload_song(client, b"Success", tags="TAG1, tag2")
@@ -291,3 +335,65 @@ def test_get_song_invalid_user(client):
     response = client.get("/song/2/1")
     assert response.status_code == 404
 
+def test_get_song_accel_redirect(app, client):
+    create_user_and_song(client)
+    app.config["SENDFILE_MODE"] = "accel"
+    response = client.get("/song/1/1")
+    assert response.status_code == 200
+    mp3_path = get_song_path(1, 1).relative_to(lsp.datadir.get_data_dir())
+    assert response.headers["X-Accel-Redirect"] == f"/data/{mp3_path}"
+    assert response.mimetype == "audio/mpeg"
+    assert "X-Sendfile" not in response.headers
+    assert response.data == b""
+
+def test_get_song_accel_redirect_prefix(app, client):
+    create_user_and_song(client)
+    app.config["SENDFILE_MODE"] = "accel"
+    app.config["SENDFILE_ACCEL_PREFIX"] = "/internal/"
+    response = client.get("/song/1/1?action=download")
+    assert response.status_code == 200
+    mp3_path = get_song_path(1, 1).relative_to(lsp.datadir.get_data_dir())
+    assert response.headers["X-Accel-Redirect"] == f"/internal/{mp3_path}"
+    assert "attachment" in response.headers["Content-Disposition"]
+
+def test_get_song_x_sendfile(app, client):
+    create_user_and_song(client)
+    app.config["SENDFILE_MODE"] = "sendfile"
+    response = client.get("/song/1/1")
+    assert response.status_code == 200
+    assert response.headers["X-Sendfile"] == str(get_song_path(1, 1))
+    assert response.data == b""
+
+def test_get_song_accel_redirect_invalid_song(app, client):
+    create_user_and_song(client)
+    app.config["SENDFILE_MODE"] = "accel"
+    response = client.get("/song/1/2")
+    assert response.status_code == 404
+    assert "X-Accel-Redirect" not in response.headers
+
+
+# Song details #################################################################
+
+def test_song_details(client):
+    create_user_and_song(client)
+    client.post("/comment?threadid=2", data={"content": "comment text here"})
+
+    response = client.get("/song/1/details")
+    assert response.status_code == 200
+    assert b"song description" in response.data
+    assert b"comment text here" in response.data
+    assert b"<html>" not in response.data  # Fragment only
+
+def test_song_details_not_in_song_list(client):
+    create_user_and_song(client)
+    client.post("/comment?threadid=2", data={"content": "comment text here"})
+
+    for page in ["/", "/songs", "/users/user"]:
+        response = client.get(page)
+        assert b'data-details-url="/song/1/details"' in response.data
+        assert b"comment text here" not in response.data
+
+def test_song_details_invalid_song(client):
+    create_user_and_song(client)
+    response = client.get("/song/2/details")
+    assert response.status_code == 404
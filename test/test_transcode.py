@@ -0,0 +1,652 @@
+import os
+import sqlite3
+import stat
+import struct
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import littlesongplace as lsp
+
+from .utils import TEST_DATA, create_user, get_song_list_from_page, get_song_path, upload_song
+
+@pytest.fixture
+def ffmpeg(app, tmp_path):
+    # Stub ffmpeg that copies the input file to the output file (or stdout,
+    # when decoding waveform peaks); waits for the "release" file to exist
+    # first if "hold" exists, and fails if "fail" exists
+    script = tmp_path / "ffmpeg"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import os, shutil, sys, time\n"
+        f"control = {str(tmp_path)!r}\n"
+        "while (os.path.exists(os.path.join(control, 'hold'))\n"
+        "        and not os.path.exists(os.path.join(control, 'release'))):\n"
+        "    time.sleep(0.01)\n"
+        "if os.path.exists(os.path.join(control, 'fail')):\n"
+        "    sys.exit(1)\n"
+        "source = sys.argv[sys.argv.index('-i') + 1]\n"
+        "if sys.argv[-1] == '-':\n"
+        "    shutil.copyfileobj(open(source, 'rb'), sys.stdout.buffer)\n"
+        "else:\n"
+        "    shutil.copyfile(source, sys.argv[-1])\n")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    app.config["FFMPEG"] = str(script)
+    yield tmp_path
+
+def _wait_for_status(client, songid, status):
+    for _ in range(500):
+        data = client.get(f"/song/{songid}/status").json
+        if data["status"] == status:
+            return data
+        time.sleep(0.01)
+    raise AssertionError(f"Song {songid} never reached status {status}")
+
+def _upload_video(client, msg, **kwargs):
+    # mp4 files always go through ffmpeg (compliant mp3s skip it)
+    upload_song(client, msg, filename=TEST_DATA/"sample-4s.mp4", **kwargs)
+
+def _staged_files():
+    return os.listdir(lsp.datadir.get_upload_staging_path())
+
+def _blobs():
+    # {blob: refcount}
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    blobs = dict(db.execute("SELECT blob, refcount FROM blobs").fetchall())
+    db.close()
+    return blobs
+
+# Inline Jobs ##################################################################
+
+def test_upload_runs_stub_ffmpeg(client, ffmpeg):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+
+    data = client.get("/song/1/status").json
+    assert data == {"status": "ready", "job": "done", "position": None}
+
+    response = client.get("/song/1/1")
+    assert response.status_code == 200
+    with open(get_song_path(1, 1), "rb") as songfile:
+        assert response.data == songfile.read()
+
+    assert not _staged_files()
+
+def test_upload_failed_conversion_removes_song(client, ffmpeg):
+    (ffmpeg / "fail").touch()
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Invalid audio file", error=True)
+
+    assert client.get("/song/1/status").status_code == 404
+    assert not _staged_files()
+
+def test_update_failed_conversion_keeps_old_audio(client, ffmpeg):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    (ffmpeg / "fail").touch()
+    _upload_video(client, b"Invalid audio file", error=True, songid=1, title="new title")
+
+    data = client.get("/song/1/status").json
+    assert data == {"status": "ready", "job": "failed", "position": None}
+    assert b"new title" not in client.get("/song/1/1?action=view").data
+    assert client.get("/song/1/1").status_code == 200
+
+def test_song_ready_before_other_files(client):
+    # Analysis, Opus and HLS run as separate jobs once the mp3 is stored
+    statuses = []
+    def analyze(job, filepath):
+        song = lsp.db.query("SELECT status FROM songs WHERE songid = ?", [job["songid"]], one=True)
+        statuses.append(song["status"])
+        return True
+
+    create_user(client, "user", login=True)
+    with mock.patch.object(lsp.transcode, "_analyze", side_effect=analyze):
+        upload_song(client, b"Successfully uploaded")
+    assert statuses == ["ready"]
+
+def test_upload_queues_file_jobs(app, client):
+    app.config["HLS_MIN_DURATION"] = 1
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    with app.app_context():
+        jobs = lsp.db.query("SELECT kind, status FROM transcode_jobs ORDER BY jobid")
+    assert [tuple(j) for j in jobs] == [
+        ("upload", "done"), ("analyze", "done"), ("opus", "done"), ("hls", "done")]
+
+def test_status_invalid_song(client):
+    response = client.get("/song/1/status")
+    assert response.status_code == 404
+
+# Upload Staging ###############################################################
+
+def test_upload_streamed_into_staging_dir(client, ffmpeg):
+    create_user(client, "user", login=True)
+    # Uploads are written to the staging directory while the request is
+    # parsed, so they never need to be copied
+    with mock.patch.object(FileStorage, "save", side_effect=AssertionError):
+        _upload_video(client, b"Successfully uploaded")
+
+    response = client.get("/song/1/1")
+    assert response.data == (TEST_DATA/"sample-4s.mp4").read_bytes()
+    assert not _staged_files()
+
+# Background Jobs ##############################################################
+
+@pytest.fixture
+def background(app, ffmpeg):
+    app.config["TRANSCODE_WORKERS"] = 1
+    (ffmpeg / "hold").touch()
+    yield ffmpeg
+    (ffmpeg / "release").touch()
+
+    # Let jobs queued by uploads finish before the next test (the worker pool
+    # is shared)
+    if lsp.transcode._executor:
+        lsp.transcode._executor.shutdown(wait=True)
+        lsp.transcode._executor = None
+
+def test_upload_returns_before_conversion(client, background):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+
+    data = client.get("/song/1/status").json
+    assert data["status"] in ["pending", "processing"]
+
+    (background / "release").touch()
+    data = _wait_for_status(client, 1, "ready")
+    assert data["job"] == "done"
+    assert get_song_path(1, 1).exists()
+
+def test_processing_song_shown_to_owner_only(client, background):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+
+    response = client.get("/users/user")
+    assert b"[Processing]" in response.data
+
+    response = client.get("/song/1/1?action=view")
+    assert b"Processing audio file..." in response.data
+
+    client.get("/logout")
+    assert b"song title" not in client.get("/users/user").data
+    assert b"song title" not in client.get("/").data
+
+    (background / "release").touch()
+    _wait_for_status(client, 1, "ready")
+    assert b"song title" in client.get("/users/user").data
+
+def test_queue_position(client, background):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+    _upload_video(client, b"Successfully uploaded")
+    _upload_video(client, b"Successfully uploaded")
+
+    # First job is holding the only worker, others are waiting in line
+    assert client.get("/song/3/status").json["position"] == 1
+
+    (background / "release").touch()
+    for songid in [1, 2, 3]:
+        _wait_for_status(client, songid, "ready")
+
+def test_failed_background_job(client, background):
+    (background / "fail").touch()
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+
+    (background / "release").touch()
+    data = _wait_for_status(client, 1, "failed")
+    assert data["job"] == "failed"
+    assert b"[Failed]" in client.get("/users/user").data
+    assert not _staged_files()
+
+def test_delete_pending_song(client, background):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+    _upload_video(client, b"Successfully uploaded")
+
+    # Second song is still waiting for the worker
+    response = client.get("/delete-song/2")
+    assert response.status_code == 302
+    assert len(_staged_files()) == 1
+
+    (background / "release").touch()
+    _wait_for_status(client, 1, "ready")
+    assert len(_blobs()) == 1
+
+# Compliant MP3s ###############################################################
+
+def _fake_frames(bitrate_index=9, sample_rate_index=0, frames=20):
+    # MPEG-1 Layer III frames with empty audio data (9 = 128 kbps, 0 = 44.1 kHz)
+    header = bytes([0xff, 0xfb, (bitrate_index << 4) | (sample_rate_index << 2), 0x00])
+    bitrate = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320][bitrate_index]
+    sample_rate = [44100, 48000, 32000][sample_rate_index]
+    frame_length = 144 * bitrate * 1000 // sample_rate
+    return (header + bytes(frame_length - 4)) * frames
+
+def _fake_mp3(path, bitrate_index=9, sample_rate_index=0, frames=20):
+    path.write_bytes(_fake_frames(bitrate_index, sample_rate_index, frames))
+    return path
+
+def _ape_tag():
+    # APEv2 tag with a header, one item, and a footer
+    item = struct.pack("<II", 5, 0) + b"Title\x00hello"
+    def header(flags):
+        return b"APETAGEX" + struct.pack("<IIII", 2000, len(item) + 32, 1, flags) + bytes(8)
+    return header(0xa0000000) + item + header(0x80000000)
+
+def test_probe_sample_mp3():
+    info = lsp.mp3info.probe(TEST_DATA/"sample-3s.mp3")
+    assert info == lsp.mp3info.Mp3Info(
+            sample_rate=44100, bitrate=128, channels=2, vbr=False)
+
+@pytest.mark.parametrize("filename", ["sample-4s.mp4", "lsp_notes.png"])
+def test_probe_not_mp3(filename):
+    assert lsp.mp3info.probe(TEST_DATA/filename) is None
+
+def test_compliant_mp3(tmp_path):
+    assert lsp.mp3info.is_compliant(_fake_mp3(tmp_path / "a.mp3"))
+
+def test_low_bitrate_mp3_not_compliant(tmp_path):
+    path = _fake_mp3(tmp_path / "a.mp3", bitrate_index=7)  # 96 kbps
+    assert lsp.mp3info.probe(path).bitrate == 96
+    assert not lsp.mp3info.is_compliant(path)
+
+def test_48khz_mp3_not_compliant(tmp_path):
+    path = _fake_mp3(tmp_path / "a.mp3", sample_rate_index=1)
+    assert lsp.mp3info.probe(path).sample_rate == 48000
+    assert not lsp.mp3info.is_compliant(path)
+
+def test_low_bitrate_vbr_mp3_not_compliant(tmp_path):
+    # Same floor as CBR files
+    path = tmp_path / "a.mp3"
+    path.write_bytes((_fake_frames(8, frames=1) + _fake_frames(9, frames=1)) * 10)  # 112/128 kbps
+    info = lsp.mp3info.probe(path)
+    assert info.vbr and info.bitrate == 120
+    assert not lsp.mp3info.is_compliant(path)
+
+def test_mp3_with_end_tags_compliant(tmp_path):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(_fake_frames() + _ape_tag() + b"TAG" + bytes(125))
+    assert lsp.mp3info.is_compliant(path)
+
+@pytest.mark.parametrize("tail", [
+    b"garbage" * 100,  # Junk after the frames
+    _fake_frames(sample_rate_index=1),  # Format changes partway through
+    _fake_frames(frames=1)[:-10],  # Last frame cut short
+    b"TAG" + bytes(125) + b"more",  # ID3v1 tag that isn't last
+])
+def test_mp3_with_bad_tail_not_compliant(tmp_path, tail):
+    path = tmp_path / "a.mp3"
+    path.write_bytes(_fake_frames() + tail)
+    assert lsp.mp3info.probe(path) is not None
+    assert not lsp.mp3info.is_compliant(path)
+
+def test_single_frame_header_not_compliant(tmp_path):
+    # A single frame header could just be random data
+    path = tmp_path / "a.mp3"
+    frame = _fake_mp3(tmp_path / "b.mp3", frames=1).read_bytes()
+    path.write_bytes(frame + b"\x01" * 10_000)
+    assert not lsp.mp3info.is_compliant(path)
+
+def test_upload_compliant_mp3_copied(client, ffmpeg):
+    create_user(client, "user", login=True)
+    with mock.patch.object(lsp.transcode, "convert") as convert:
+        upload_song(client, b"Successfully uploaded")
+    assert not convert.called
+
+    # The stub ffmpeg copies the file
+    response = client.get("/song/1/1")
+    assert response.status_code == 200
+    assert response.data == (TEST_DATA/"sample-3s.mp3").read_bytes()
+    assert not _staged_files()
+
+def test_upload_compliant_mp3_tags_dropped(client, tmp_path):
+    create_user(client, "user", login=True)
+    path = tmp_path / "tagged.mp3"
+    path.write_bytes((TEST_DATA/"sample-3s.mp3").read_bytes() + _ape_tag() + b"TAG" + bytes(125))
+    with mock.patch.object(lsp.transcode, "convert") as convert:
+        upload_song(client, b"Successfully uploaded", filename=path)
+    assert not convert.called
+
+    # Frames copied by ffmpeg, without the ID3v2 tag at the start or the
+    # tags at the end
+    data = client.get("/song/1/1").data
+    assert data[:2] == b"\xff\xfb"
+    assert b"APETAGEX" not in data
+    assert b"TAG" not in data[-128:]
+
+def test_upload_noncompliant_mp3_uses_ffmpeg(client, ffmpeg, tmp_path):
+    (ffmpeg / "fail").touch()
+    create_user(client, "user", login=True)
+    path = _fake_mp3(tmp_path / "low.mp3", bitrate_index=7)
+    upload_song(client, b"Invalid audio file", error=True, filename=path)
+
+# Opus Rendition ###############################################################
+
+def _opus_path():
+    return get_song_path(1, 1).with_suffix(".webm")
+
+def test_upload_makes_opus_rendition(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    response = client.get("/song/1/1")
+    assert response.mimetype == "audio/mpeg"
+    assert "Accept" in response.vary
+
+    response = client.get("/song/1/1?rendition=opus")
+    assert response.mimetype == "audio/webm"
+    assert response.data == _opus_path().read_bytes()
+    assert response.data[:4] == b"\x1a\x45\xdf\xa3"  # EBML (WebM) header
+
+def test_opus_from_accept_header(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    response = client.get("/song/1/1", headers={"Accept": "audio/webm"})
+    assert response.mimetype == "audio/webm"
+
+    # Clients that can play mp3s get the mp3 unless they ask for the rendition
+    response = client.get("/song/1/1", headers={"Accept": "audio/webm,audio/*;q=0.9,*/*;q=0.5"})
+    assert response.mimetype == "audio/mpeg"
+
+def test_opus_falls_back_to_mp3(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    _opus_path().unlink()
+
+    response = client.get("/song/1/1?rendition=opus")
+    assert response.mimetype == "audio/mpeg"
+
+def test_delete_song_deletes_opus(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    opus_path = _opus_path()
+    assert opus_path.exists()
+
+    client.get("/delete-song/1")
+    assert not opus_path.exists()
+
+def test_failed_opus_doesnt_serve_old_rendition(client, ffmpeg):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+    assert _opus_path().exists()
+
+    with mock.patch.object(lsp.transcode, "convert_opus", return_value=False):
+        upload_song(client, b"Successfully updated", songid=1)
+
+    assert not _opus_path().exists()
+    assert client.get("/song/1/1?rendition=opus").mimetype == "audio/mpeg"
+    assert client.get("/song/1/status").json["status"] == "ready"
+
+def test_queue_opus_backfill(app, client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    _opus_path().unlink()
+
+    result = app.test_cli_runner().invoke(args=["queue-opus"])
+    assert "Queued 1 songs" in result.output
+
+    # Already queued
+    result = app.test_cli_runner().invoke(args=["queue-opus"])
+    assert "Queued 0 songs" in result.output
+
+    with app.app_context():
+        # Backfill jobs don't hold up uploads
+        job = lsp.transcode.get_latest_job(1)
+        assert job["kind"] == lsp.transcode.UPLOAD
+
+        lsp.transcode._run_next_job(app)
+
+    assert _opus_path().exists()
+    assert client.get("/song/1/status").json == {"status": "ready", "job": "done", "position": None}
+
+# HLS Segments #################################################################
+
+def _hls_path():
+    return get_song_path(1, 1).with_suffix(".hls")
+
+def test_short_song_not_segmented(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    assert not _hls_path().exists()
+    assert not get_song_list_from_page(client, "/users/user")[0]["hls"]
+    assert client.get("/song/1/1/hls/index.m3u8").status_code == 404
+
+def test_long_song_segmented(app, client):
+    app.config["HLS_MIN_DURATION"] = 1
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    assert get_song_list_from_page(client, "/users/user")[0]["hls"]
+
+    response = client.get("/song/1/1/hls/index.m3u8")
+    assert response.status_code == 200
+    assert response.mimetype == "application/vnd.apple.mpegurl"
+    manifest = response.data.decode()
+    assert manifest.startswith("#EXTM3U")
+    assert "#EXT-X-ENDLIST" in manifest
+    assert "segment00000.ts" in manifest
+
+    response = client.get("/song/1/1/hls/segment00000.ts")
+    assert response.status_code == 200
+    assert response.mimetype == "video/mp2t"
+
+    assert client.get("/song/1/1/hls/..%2F1.mp3").status_code == 404
+
+def test_segments_removed_when_not_needed(app, client):
+    app.config["HLS_MIN_DURATION"] = 1
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    hls_path = _hls_path()
+    assert hls_path.exists()
+
+    app.config["HLS_MIN_DURATION"] = None
+    _upload_video(client, b"Successfully updated", songid=1)
+    assert not hls_path.exists()
+    assert not _hls_path().exists()
+    assert not get_song_list_from_page(client, "/users/user")[0]["hls"]
+
+def test_delete_song_deletes_segments(app, client):
+    app.config["HLS_MIN_DURATION"] = 1
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    hls_path = _hls_path()
+    assert hls_path.exists()
+
+    client.get("/delete-song/1")
+    assert not hls_path.exists()
+
+def test_queue_hls_backfill(app, client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    assert not _hls_path().exists()
+
+    app.config["HLS_MIN_DURATION"] = 1
+    result = app.test_cli_runner().invoke(args=["queue-hls"])
+    assert "Queued 1 songs" in result.output
+
+    with app.app_context():
+        lsp.transcode._run_next_job(app)
+
+    assert (_hls_path() / "index.m3u8").exists()
+    assert get_song_list_from_page(client, "/users/user")[0]["hls"]
+
+# Blob Store ###################################################################
+
+def test_same_file_shares_blob(client):
+    create_user(client, "user", login=True)
+    with mock.patch.object(lsp.transcode, "convert", wraps=lsp.transcode.convert) as convert:
+        _upload_video(client, b"Successfully uploaded")
+        _upload_video(client, b"Successfully uploaded")
+    assert convert.call_count == 1
+
+    assert get_song_path(1, 1) == get_song_path(1, 2)
+    assert list(_blobs().values()) == [2]
+
+    songs = get_song_list_from_page(client, "/users/user")
+    assert songs[0]["status"] == "ready"
+    assert songs[0]["duration"] == songs[1]["duration"]
+
+def test_reupload_same_file_skips_ffmpeg(client):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+    mp3_path = get_song_path(1, 1)
+
+    with mock.patch.object(lsp.transcode, "convert", return_value=False):
+        _upload_video(client, b"Successfully updated", songid=1)
+
+    assert get_song_path(1, 1) == mp3_path
+    assert mp3_path.exists()
+    assert list(_blobs().values()) == [1]
+
+def test_different_settings_use_different_blob():
+    path = TEST_DATA/"sample-3s.mp3"
+    blob = lsp.blobs.hash_source(path, lsp.transcode.BLOB_SETTINGS)
+    assert blob != lsp.blobs.hash_source(path, lsp.transcode.BLOB_SETTINGS + " ")
+
+def test_delete_song_keeps_shared_blob(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+    upload_song(client, b"Successfully uploaded")
+    mp3_path = get_song_path(1, 1)
+
+    client.get("/delete-song/1")
+    assert mp3_path.exists()
+    assert client.get("/song/1/2").status_code == 200
+
+    client.get("/delete-song/2")
+    assert not mp3_path.exists()
+    assert not mp3_path.with_suffix(".peaks").exists()
+    assert _blobs() == {}
+
+def test_update_song_frees_old_blob(client):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+    old_path = get_song_path(1, 1)
+
+    upload_song(client, b"Successfully updated", songid=1)
+    assert get_song_path(1, 1) != old_path
+    assert not old_path.exists()
+    assert list(_blobs().values()) == [1]
+
+def test_update_song_from_before_blobs(client):
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    # Move the song's files to where they were stored before blobs
+    legacy_path = lsp.datadir.get_user_songs_path(1) / "1.mp3"
+    blob_path = get_song_path(1, 1)
+    for suffix in [".mp3", ".peaks", ".webm"]:
+        os.replace(blob_path.with_suffix(suffix), legacy_path.with_suffix(suffix))
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.execute("UPDATE songs SET blob = NULL")
+    db.execute("DELETE FROM blobs")
+    db.commit()
+    db.close()
+
+    assert client.get("/song/1/1").data == legacy_path.read_bytes()
+
+    _upload_video(client, b"Successfully updated", songid=1)
+    assert get_song_path(1, 1) != legacy_path
+    assert not legacy_path.exists()
+    assert not legacy_path.with_suffix(".peaks").exists()
+    assert not legacy_path.with_suffix(".webm").exists()
+    assert client.get("/song/1/1").status_code == 200
+
+# Recovery #####################################################################
+
+def test_recover_jobs_from_dead_process(client, ffmpeg):
+    create_user(client, "user", login=True)
+    _upload_video(client, b"Successfully uploaded")
+
+    with lsp.app.app_context():
+        source = lsp.datadir.get_upload_staging_path() / "source"
+        source.write_bytes(b"audio")
+        lsp.db.query("UPDATE songs SET status = 'processing'")
+        jobid = lsp.transcode.create_job(1, 1, source)
+
+        # Use the PID of a process that has already exited
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        pid = process.pid
+        lsp.db.query(
+                "UPDATE transcode_jobs SET status = 'processing', pid = ? WHERE jobid = ?",
+                [pid, jobid])
+        lsp.db.commit()
+
+        lsp.transcode._recover_jobs()
+        assert lsp.transcode.get_job(jobid)["status"] == lsp.transcode.PENDING
+
+# Transcoding Slots ############################################################
+
+def test_ffmpeg_command_limits(app):
+    with app.app_context():
+        command = lsp.ffmpeg.get_command()
+        assert command[:3] == ["nice", "-n", "10"]
+        assert command[3] == "ffmpeg"
+        assert command[command.index("-threads") + 1] == "1"
+
+        app.config["FFMPEG_NICE"] = None
+        app.config["FFMPEG_THREADS"] = None
+        assert lsp.ffmpeg.get_command() == ["ffmpeg"]
+
+def test_slot_waits_for_other_thread(app):
+    app.config["TRANSCODE_SLOTS"] = 1
+    ran = threading.Event()
+
+    def run_in_slot():
+        with app.app_context(), lsp.ffmpeg.slot("waiter"):
+            ran.set()
+
+    with app.app_context():
+        before = lsp.ffmpeg.get_stats()
+        with lsp.ffmpeg.slot("holder"):
+            waiter = threading.Thread(target=run_in_slot)
+            waiter.start()
+            for _ in range(500):
+                if lsp.ffmpeg.get_stats()["waiting"] == before["waiting"] + 1:
+                    break
+                time.sleep(0.01)
+            assert lsp.ffmpeg.get_stats()["waiting"] == before["waiting"] + 1
+            time.sleep(0.2)
+            assert not ran.is_set()
+        waiter.join()
+        after = lsp.ffmpeg.get_stats()
+
+    assert ran.is_set()
+    assert after["runs"] == before["runs"] + 2
+    assert after["waiting"] == before["waiting"]
+    assert after["wait_time"] - before["wait_time"] >= 0.15
+
+def test_slot_shared_between_processes(app, caplog):
+    app.config["TRANSCODE_SLOTS"] = 1
+    with app.app_context():
+        # Another process holds the only slot for a moment
+        lock_path = lsp.datadir.get_transcode_slots_path() / "0.lock"
+        holder = subprocess.Popen([
+                sys.executable, "-c",
+                "import fcntl, sys, time\n"
+                f"f = open({str(lock_path)!r}, 'a')\n"
+                "fcntl.flock(f, fcntl.LOCK_EX)\n"
+                "print('locked', flush=True)\n"
+                "time.sleep(0.3)\n"],
+                stdout=subprocess.PIPE)
+        assert holder.stdout.readline() == b"locked\n"
+
+        caplog.set_level("INFO")
+        with lsp.ffmpeg.slot("test"):
+            pass
+        holder.wait()
+
+    message = next(r.getMessage() for r in caplog.records if "Ran ffmpeg (test)" in r.getMessage())
+    waited = float(message.split("waited ")[1].split(" s")[0])
+    assert waited >= 0.1
@@ -0,0 +1,312 @@
+import fcntl
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import littlesongplace as lsp
+
+from .utils import TEST_DATA, create_user, create_user_and_song, get_song_list_from_page, get_song_path
+
+CHUNK_SIZE = 16 * 1024
+
+@pytest.fixture
+def chunks(app):
+    # Small chunks, so the sample file takes a few
+    app.config["UPLOAD_CHUNK_SIZE"] = CHUNK_SIZE
+    data = (TEST_DATA/"sample-3s.mp3").read_bytes()
+    return [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+
+def _start_upload(client, size):
+    response = client.post("/uploads", json={"size": size})
+    assert response.status_code == 201
+    assert response.json["chunk_size"] == CHUNK_SIZE
+    return response.json["uploadid"]
+
+def _put_chunk(client, uploadid, chunks, index, checksum=True):
+    headers = {}
+    if checksum:
+        headers["X-Chunk-Sha256"] = hashlib.sha256(chunks[index]).hexdigest()
+    return client.put(
+            f"/uploads/{uploadid}?offset={index * CHUNK_SIZE}",
+            data=chunks[index], headers=headers)
+
+def _upload_all(client, chunks):
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    for i in reversed(range(len(chunks))):
+        assert _put_chunk(client, uploadid, chunks, i).status_code == 204
+    return uploadid
+
+def _submit_song_form(client, uploadid, songid=None):
+    url = "/upload-song" + (f"?songid={songid}" if songid else "")
+    response = client.post(url, data={
+        "upload-id": uploadid,
+        "title": "song title",
+        "description": "",
+        "tags": "",
+        "collabs": "",
+    })
+    assert response.status_code == 302
+    return client.get("/users/user").data
+
+def _missing(client, uploadid):
+    response = client.get(f"/uploads/{uploadid}")
+    assert response.status_code == 200
+    return response.json["missing"]
+
+def _staged_files():
+    return os.listdir(lsp.datadir.get_upload_staging_path())
+
+# Chunks #######################################################################
+
+def test_upload_in_chunks(app, client, chunks, tmp_path):
+    create_user(client, "user", login=True)
+    uploadid = _upload_all(client, chunks)
+    assert _missing(client, uploadid) == []
+
+    page = _submit_song_form(client, uploadid)
+    assert b"Successfully uploaded" in page
+
+    # Same frames as the original file (compliant mp3s are copied by ffmpeg)
+    expected = tmp_path / "expected.mp3"
+    with app.app_context():
+        assert lsp.transcode.copy_mp3(str(TEST_DATA/"sample-3s.mp3"), str(expected))
+    assert get_song_path(1, 1).read_bytes() == expected.read_bytes()
+    assert get_song_list_from_page(client, "/users/user")[0]["status"] == "ready"
+    assert not _staged_files()
+
+def test_update_song_in_chunks(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _upload_all(client, chunks)
+    _submit_song_form(client, uploadid)
+
+    uploadid = _upload_all(client, chunks)
+    page = _submit_song_form(client, uploadid, songid=1)
+    assert b"Successfully updated" in page
+
+def test_resume_upload(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    _put_chunk(client, uploadid, chunks, 0)
+    _put_chunk(client, uploadid, chunks, 2)
+
+    assert _missing(client, uploadid) == [CHUNK_SIZE] + [i * CHUNK_SIZE for i in range(3, len(chunks))]
+
+    for offset in _missing(client, uploadid):
+        assert _put_chunk(client, uploadid, chunks, offset // CHUNK_SIZE).status_code == 204
+    assert _missing(client, uploadid) == []
+
+def test_chunk_without_checksum(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    assert _put_chunk(client, uploadid, chunks, 0, checksum=False).status_code == 204
+
+def test_chunk_bad_checksum(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    response = client.put(
+            f"/uploads/{uploadid}?offset=0", data=chunks[0],
+            headers={"X-Chunk-Sha256": hashlib.sha256(b"other").hexdigest()})
+    assert response.status_code == 400
+    assert 0 in _missing(client, uploadid)
+
+@pytest.mark.parametrize("offset", ["", "1", "-16384", "100000000"])
+def test_chunk_bad_offset(client, chunks, offset):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    response = client.put(f"/uploads/{uploadid}?offset={offset}", data=chunks[0])
+    assert response.status_code == 400
+
+def test_chunk_wrong_length(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    response = client.put(f"/uploads/{uploadid}?offset=0", data=chunks[0][:-1])
+    assert response.status_code == 400
+    response = client.put(f"/uploads/{uploadid}?offset=0", data=chunks[0] + b"x")
+    assert response.status_code == 400
+    assert 0 in _missing(client, uploadid)
+
+# Finishing ####################################################################
+
+def test_incomplete_upload(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    _put_chunk(client, uploadid, chunks, 0)
+
+    page = _submit_song_form(client, uploadid)
+    assert b"Upload is incomplete" in page
+    assert not get_song_list_from_page(client, "/users/user")
+
+def test_finish_other_users_upload(client, chunks):
+    create_user(client, "user2", login=True)
+    uploadid = _upload_all(client, chunks)
+
+    create_user(client, "user", login=True)
+    page = _submit_song_form(client, uploadid)
+    assert b"Upload not found" in page
+
+def test_incomplete_upload_resumed(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    _put_chunk(client, uploadid, chunks, 0)
+    _submit_song_form(client, uploadid)
+
+    # Left in place to finish
+    for i in range(1, len(chunks)):
+        assert _put_chunk(client, uploadid, chunks, i).status_code == 204
+    page = _submit_song_form(client, uploadid)
+    assert b"Successfully uploaded" in page
+
+def test_upload_kept_when_form_rejected(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _upload_all(client, chunks)
+
+    response = client.post("/upload-song", data={
+        "upload-id": uploadid, "title": "\r\n", "description": "", "tags": "", "collabs": ""})
+    assert response.status_code == 302
+    assert not _missing(client, uploadid)
+
+    page = _submit_song_form(client, uploadid)
+    assert b"Successfully uploaded" in page
+
+def _lock_upload(uploadid, exclusive):
+    f = open(lsp.uploads.get_upload_path(uploadid), "rb")
+    fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return f
+
+def test_finish_waits_for_chunk(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _upload_all(client, chunks)
+
+    # A chunk is still being written
+    chunk = _lock_upload(uploadid, exclusive=False)
+    pages = []
+    thread = threading.Thread(target=lambda: pages.append(_submit_song_form(client, uploadid)))
+    thread.start()
+    thread.join(timeout=0.5)
+    assert thread.is_alive()
+    assert lsp.uploads.get_upload_path(uploadid).exists()
+
+    chunk.close()
+    thread.join()
+    assert b"Successfully uploaded" in pages[0]
+
+def test_chunk_after_finish(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _upload_all(client, chunks)
+
+    # Finishing (holding the lock) when the chunk arrives
+    finishing = _lock_upload(uploadid, exclusive=True)
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(_put_chunk(client, uploadid, chunks, 0)))
+    thread.start()
+    thread.join(timeout=0.5)
+    assert thread.is_alive()
+
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.execute("DELETE FROM upload_chunks")
+    db.execute("DELETE FROM uploads")
+    db.commit()
+    db.close()
+    finishing.close()
+    thread.join()
+    assert responses[0].status_code == 409
+
+    # Later chunks don't find it at all
+    assert _put_chunk(client, uploadid, chunks, 0).status_code == 404
+
+# Access #######################################################################
+
+def test_start_upload_not_logged_in(client):
+    response = client.post("/uploads", json={"size": 100})
+    assert response.status_code == 401
+
+def test_other_users_upload(client, chunks):
+    create_user(client, "user2", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+
+    create_user(client, "user", login=True)
+    assert client.get(f"/uploads/{uploadid}").status_code == 404
+    assert _put_chunk(client, uploadid, chunks, 0).status_code == 404
+    assert client.delete(f"/uploads/{uploadid}").status_code == 404
+
+@pytest.mark.parametrize("body", [{}, {"size": "abc"}, {"size": 0}])
+def test_start_upload_bad_size(client, body):
+    create_user(client, "user", login=True)
+    assert client.post("/uploads", json=body).status_code == 400
+
+def test_start_upload_too_large(app, client):
+    create_user(client, "user", login=True)
+    response = client.post("/uploads", json={"size": app.config["MAX_CONTENT_LENGTH"] + 1})
+    assert response.status_code == 413
+
+def test_too_many_uploads(client):
+    create_user(client, "user", login=True)
+    for _ in range(lsp.uploads.MAX_UPLOADS_PER_USER):
+        assert client.post("/uploads", json={"size": 100}).status_code == 201
+    assert client.post("/uploads", json={"size": 100}).status_code == 429
+
+# Cleanup ######################################################################
+
+def test_cancel_upload(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    assert client.delete(f"/uploads/{uploadid}").status_code == 204
+    assert client.get(f"/uploads/{uploadid}").status_code == 404
+    assert not _staged_files()
+
+def test_abandoned_upload_collected(client, chunks):
+    create_user(client, "user", login=True)
+    uploadid = _start_upload(client, sum(len(c) for c in chunks))
+    _put_chunk(client, uploadid, chunks, 0)
+
+    # Last chunk was received more than a day ago
+    updated = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    db.execute("UPDATE uploads SET updated = ?", [updated])
+    db.commit()
+    db.close()
+
+    # Collected when the next upload starts
+    _start_upload(client, 100)
+    assert client.get(f"/uploads/{uploadid}").status_code == 404
+    assert not lsp.uploads.get_upload_path(uploadid).exists()
+    assert len(_staged_files()) == 1  # The new upload
+
+def _make_staged_file(name, age=timedelta(days=2)):
+    path = lsp.datadir.get_upload_staging_path() / name
+    path.write_bytes(b"data")
+    mtime = (datetime.now() - age).timestamp()
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_stale_staged_files_collected(app, client):
+    create_user_and_song(client)
+    orphaned = _make_staged_file("finished-0123")
+    recent = _make_staged_file("staged-4567", age=timedelta(hours=1))
+    queued = _make_staged_file("staged-89ab")
+    download = _make_staged_file("staged-89ab.part")
+    with app.app_context():
+        lsp.transcode.create_job(1, 1, queued)
+        lsp.db.commit()
+
+    result = app.test_cli_runner().invoke(args=["collect-uploads"])
+    assert "Deleted 1 abandoned uploads and files" in result.output
+    assert not orphaned.exists()
+    assert recent.exists()
+    assert queued.exists()
+    assert download.exists()
+
+def test_collected_when_upload_starts(client, chunks):
+    create_user(client, "user", login=True)
+    orphaned = _make_staged_file("chunked-0123")
+
+    # Other requests don't wait for cleanup
+    client.get("/")
+    assert orphaned.exists()
+
+    _start_upload(client, 100)
+    assert not orphaned.exists()
@@ -0,0 +1,151 @@
+import shutil
+import sqlite3
+
+import pytest
+from yt_dlp.utils import DownloadError
+
+import littlesongplace as lsp
+
+from .utils import TEST_DATA, create_user, get_song_list_from_page, get_song_path, upload_song
+
+VIDEO_URL = "https://www.youtube.com/watch?v=5e5Z6gZWiEs"
+
+@pytest.fixture
+def youtube(app):
+    # Local stand-in for yt-dlp; "downloads" a sample file for any URL except
+    # ones for missing videos, and records the URLs it was asked for
+    downloads = []
+    def download(url, dest):
+        downloads.append(url)
+        if "missing" in url:
+            raise DownloadError("Video unavailable")
+        shutil.copyfile(TEST_DATA/"sample-4s.mp4", dest)
+    app.config["YT_DOWNLOADER"] = download
+    yield downloads
+
+def _import_song(client, yt_url, songid=None):
+    upload_url = "/upload-song"
+    if songid:
+        upload_url += f"?songid={songid}"
+    response = client.post(upload_url, data={
+        "song-url": yt_url,
+        "title": "song title",
+        "description": "song description",
+        "tags": "tag",
+        "collabs": "collab",
+    })
+    assert response.status_code == 302
+    return client.get("/users/user").data
+
+def _cached_videos():
+    db = sqlite3.connect(lsp.datadir.get_db_path())
+    videos = [row[0] for row in db.execute("SELECT videoid FROM youtube_cache")]
+    db.close()
+    return videos
+
+# Video IDs ####################################################################
+
+@pytest.mark.parametrize("url", [
+    "https://www.youtube.com/watch?v=5e5Z6gZWiEs",
+    "https://youtu.be/5e5Z6gZWiEs",
+    "https://youtu.be/5e5Z6gZWiEs?si=abc123",
+    "https://www.youtube.com/watch?v=5e5Z6gZWiEs&t=30",
+])
+def test_video_id(url):
+    assert lsp.youtube.get_video_id(url) == "5e5Z6gZWiEs"
+
+def test_video_id_other_site():
+    assert lsp.youtube.get_video_id("https://example.com/song.mp3") is None
+
+# Import Jobs ##################################################################
+
+def test_import_song(client, youtube):
+    create_user(client, "user", login=True)
+    page = _import_song(client, VIDEO_URL)
+    assert b"Successfully uploaded" in page
+    assert youtube == [VIDEO_URL]
+
+    assert client.get("/song/1/status").json == {"status": "ready", "job": "done", "position": None}
+    assert client.get("/song/1/1").status_code == 200
+    assert _cached_videos() == ["5e5Z6gZWiEs"]
+
+def test_import_failed(client, youtube):
+    create_user(client, "user", login=True)
+    page = _import_song(client, "https://www.youtube.com/watch?v=missingvid1")
+    assert b"Failed to import from YouTube URL" in page
+    assert not get_song_list_from_page(client, "/users/user")
+    assert not _cached_videos()
+
+def test_update_song_import_failed_keeps_old_audio(client, youtube):
+    create_user(client, "user", login=True)
+    _import_song(client, VIDEO_URL)
+
+    page = _import_song(client, "https://www.youtube.com/watch?v=missingvid1", songid=1)
+    assert b"Failed to import from YouTube URL" in page
+    assert client.get("/song/1/status").json["status"] == "ready"
+    assert client.get("/song/1/1").status_code == 200
+
+def test_import_limit_per_user(app, client, youtube):
+    app.config["YT_IMPORTS_PER_USER"] = 1
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    # An import still waiting for a worker
+    with app.app_context():
+        lsp.transcode.create_job(1, 1, "", VIDEO_URL)
+        lsp.db.commit()
+
+    page = _import_song(client, VIDEO_URL)
+    assert b"Too many YouTube imports in progress" in page
+    assert not youtube
+
+def test_import_workers_limit(app, client):
+    app.config["YT_IMPORT_WORKERS"] = 1
+    create_user(client, "user", login=True)
+    upload_song(client, b"Successfully uploaded")
+
+    with app.app_context():
+        running = lsp.transcode.create_job(1, 1, "", VIDEO_URL)
+        waiting = lsp.transcode.create_job(1, 1, "", VIDEO_URL)
+        upload = lsp.transcode.create_job(1, 1, "")
+        lsp.db.commit()
+
+        assert lsp.transcode._claim_job()["jobid"] == running
+
+        # Uploads don't wait for imports
+        assert lsp.transcode._claim_job()["jobid"] == upload
+        assert lsp.transcode._claim_job() is None
+
+        lsp.db.query("UPDATE transcode_jobs SET status = 'done' WHERE jobid = ?", [running])
+        lsp.db.commit()
+        assert lsp.transcode._claim_job()["jobid"] == waiting
+
+# Video Cache ##################################################################
+
+def test_import_same_video_again(client, youtube):
+    create_user(client, "user", login=True)
+    _import_song(client, VIDEO_URL)
+    _import_song(client, "https://youtu.be/5e5Z6gZWiEs?si=abc123")
+
+    # Second import didn't download anything
+    assert youtube == [VIDEO_URL]
+    assert get_song_path(1, 1) == get_song_path(1, 2)
+    assert client.get("/song/1/status").json["status"] == "ready"
+
+def test_cache_cleared_when_blob_deleted(client, youtube):
+    create_user(client, "user", login=True)
+    _import_song(client, VIDEO_URL)
+
+    client.get("/delete-song/1")
+    assert not _cached_videos()
+
+    _import_song(client, VIDEO_URL)
+    assert youtube == [VIDEO_URL, VIDEO_URL]
+    assert client.get("/song/1/2").status_code == 200
+
+def test_uploaded_file_matches_imported_video(client, youtube):
+    # The same audio uploaded directly shares the imported song's blob
+    create_user(client, "user", login=True)
+    _import_song(client, VIDEO_URL)
+    upload_song(client, b"Successfully uploaded", filename=TEST_DATA/"sample-4s.mp4")
+    assert get_song_path(1, 1) == get_song_path(1, 2)
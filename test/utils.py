@@ -3,6 +3,8 @@ import json
 import re
 from pathlib import Path
 
+import littlesongplace as lsp
+
 HOST = "http://littlesong.place:8000"
 TEST_DATA = Path(__file__).parent / "data"
 
@@ -83,6 +85,11 @@ def upload_song(
     response = client.get(f"/users/{user}")
     assert msg in response.data
 
+def get_song_path(userid, songid):
+    # Where a song's mp3 is stored (see blobs.py)
+    with lsp.app.app_context():
+        return lsp.blobs.get_song_path(userid, songid)
+
 def get_song_list_from_page(client, url):
     response = client.get(url)
     print(response.data.decode())